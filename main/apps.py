@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from django.db import connections
+        from django.db.models.signals import post_migrate
+
+        from . import blobs, page_cache
+        from .search import ensure_index
+
+        blobs.connect()
+        page_cache.connect()
+        post_migrate.connect(
+            lambda using, **kwargs: ensure_index(connections[using]),
+            sender=self, weak=False, dispatch_uid='main.search.ensure_index',
+        )
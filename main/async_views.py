@@ -0,0 +1,122 @@
+"""
+Async versions of the busiest views.
+
+With ASYNC_VIEWS on, main.urls routes the home feed, profiles, the inbox and
+like/comment here. Queries go through Django's async ORM, and channel layer
+broadcasts are awaited on the event loop instead of being wrapped in
+async_to_sync. A template cannot run queries in an async view, so everything
+it reads is loaded before rendering: related objects, the signed-in user
+(request.user is replaced by the awaited one) and the unread badges. The
+querysets come from main.feed, shared with the sync views. Writes that need
+a transaction (main.likes, main.comments) run in a single sync_to_async call.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect, render
+
+from . import feed as feeds, graph, likes, page_cache, timeline, unread
+from .comments import aadd_comment
+from .models import Follow, Post
+from .pagination import akeyset_page
+from .usernames import aget_user_or_404
+
+
+async def _prepare(request):
+    """Resolve request.user and the unread badges, so that rendering runs no queries."""
+    user = await request.auser()
+    request.user = user
+    if user.is_authenticated:
+        request.unread_counts = {
+            'unread_message_count': await unread.amessage_count(user.id),
+            'unread_notification_count': await unread.anotification_count(user.id),
+        }
+    else:
+        request.unread_counts = {'unread_message_count': 0, 'unread_notification_count': 0}
+    return user
+
+
+async def _feed_page(request, user):
+    posts = feeds.feed_posts(user)
+
+    if feeds.feed_tab(request) == 'following':
+        post_ids, next_cursor = await timeline.ahome_timeline_page(user, None, settings.FEED_PAGE_SIZE)
+        posts_by_id = await posts.ain_bulk(post_ids)
+        return [posts_by_id[pk] for pk in post_ids if pk in posts_by_id], next_cursor
+
+    return await akeyset_page(posts, None, settings.FEED_PAGE_SIZE)
+
+
+@page_cache.anonymous_page_cache(page_cache.FEED, page_cache.USERS)
+async def index(request):
+    user = await _prepare(request)
+    posts, next_cursor = await _feed_page(request, user)
+    stories = []
+    suggestions = []
+
+    if user.is_authenticated:
+        stories = feeds.stories(user, [story_user async for story_user in feeds.following_users(user)])
+        suggestions = await sync_to_async(graph.suggested_users)(user, settings.SUGGESTIONS_LIMIT)
+
+    context = {
+        'posts': posts,
+        'next_cursor': next_cursor,
+        'feed_tab': feeds.feed_tab(request),
+        'stories': stories,
+        'suggestions': suggestions,
+    }
+    return render(request, 'main/index.html', context)
+
+
+@login_required
+async def messages_view(request):
+    user = await _prepare(request)
+    context = {
+        'conversations': [conversation async for conversation in feeds.conversations(user)],
+        'following_users': [following async for following in feeds.following_users(user)],
+    }
+    return render(request, 'main/messages.html', context)
+
+
+@login_required
+async def user_profile(request, username):
+    viewer = await _prepare(request)
+    user = await aget_user_or_404(username)
+
+    is_following = False
+    if viewer != user:
+        is_following = await Follow.objects.filter(from_user=viewer, to_user=user).aexists()
+
+    context = {
+        'user': user,
+        'posts': [post async for post in feeds.profile_posts(user, viewer)],
+        'is_following': is_following,
+        'follower_count': user.follower_count,
+        'following_count': user.following_count,
+    }
+    return render(request, 'main/profile.html', context)
+
+
+@login_required
+async def like_post(request, post_id):
+    user = await request.auser()
+    try:
+        liked, like_count = await likes.atoggle_like(user, post_id)
+    except Post.DoesNotExist:
+        raise Http404('No Post matches the given query.')
+    return JsonResponse({'likes_count': like_count, 'liked': liked})
+
+
+@login_required
+async def add_comment(request, post_id):
+    user = await request.auser()
+    try:
+        post = await Post.objects.only('id', 'user_id').aget(id=post_id)
+    except Post.DoesNotExist:
+        raise Http404('No Post matches the given query.')
+
+    text = request.POST.get('text') if request.method == 'POST' else None
+    if text:
+        await aadd_comment(user, post, text)
+    return redirect('index')
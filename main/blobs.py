@@ -0,0 +1,174 @@
+"""
+Reference counts for content-addressed media blobs (see main.storage).
+
+A blob is referenced by every image field that holds its name, and by every
+derivative recorded in a `derivatives` field. Saves and deletes of the
+tracked models adjust Blob.ref_count through model signals, so cascades
+(deleting a user deletes their posts) are counted too. Code that changes
+these fields with QuerySet.update() must call acquire()/release() itself.
+Blobs whose count reaches zero are left on disk for `collect_garbage`.
+
+Files saved before content-addressed storage keep their original names. They
+belong to a single row, so they are deleted as soon as that row lets go of
+them.
+"""
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from .models import Blob
+from .storage import BLOB_PREFIX, is_blob
+
+TRACKED_FIELDS = {
+    'main.Post': ('image',),
+    'main.User': ('profile_picture', 'cover_image'),
+}
+DERIVATIVES_FIELD = 'derivatives'
+
+
+def _fields(model):
+    return TRACKED_FIELDS[model._meta.label] + (DERIVATIVES_FIELD,)
+
+
+def _names_from_values(model, values):
+    names = [values[field] for field in TRACKED_FIELDS[model._meta.label] if values.get(field)]
+    for entry in (values.get(DERIVATIVES_FIELD) or {}).values():
+        names.extend(name for size, name in entry.items() if size != 'source' and name)
+    return names
+
+
+def references(instance):
+    """Names of the stored files that `instance` points at."""
+    values = {field: getattr(instance, field) for field in _fields(type(instance))}
+    for field in TRACKED_FIELDS[instance._meta.label]:
+        values[field] = values[field].name
+    return _names_from_values(type(instance), values)
+
+
+def register(name, size):
+    """Record a newly stored blob, or refresh an existing one so GC leaves it alone for now."""
+    if not Blob.objects.filter(name=name).update(updated_at=timezone.now()):
+        Blob.objects.get_or_create(name=name, defaults={'size': size})
+
+
+def _adjust(deltas):
+    now = timezone.now()
+    for name, delta in deltas.items():
+        if delta:
+            Blob.objects.filter(name=name).update(ref_count=F('ref_count') + delta, updated_at=now)
+
+
+def acquire(names):
+    _adjust(Counter(name for name in names if is_blob(name)))
+
+
+def release(names):
+    names = list(names)
+    _adjust(Counter({name: -count for name, count in Counter(n for n in names if is_blob(n)).items()}))
+    legacy = [name for name in names if name and not is_blob(name)]
+    if legacy:
+        transaction.on_commit(lambda: _delete_files(legacy))
+
+
+def _delete_files(names):
+    for name in names:
+        default_storage.delete(name)
+
+
+def _tracks(update_fields, model):
+    return update_fields is None or bool(set(update_fields) & set(_fields(model)))
+
+
+def _remember_references(sender, instance, update_fields=None, **kwargs):
+    instance._blob_references = []
+    if instance._state.adding or not _tracks(update_fields, sender):
+        return
+    values = sender._base_manager.filter(pk=instance.pk).values(*_fields(sender)).first()
+    if values:
+        instance._blob_references = _names_from_values(sender, values)
+
+
+def _update_references(sender, instance, update_fields=None, **kwargs):
+    if not _tracks(update_fields, sender):
+        return
+    before = Counter(getattr(instance, '_blob_references', []))
+    after = Counter(references(instance))
+    acquire((after - before).elements())
+    release((before - after).elements())
+    instance._blob_references = list(after.elements())
+
+
+def _drop_references(sender, instance, **kwargs):
+    release(references(instance))
+
+
+def connect():
+    for label in TRACKED_FIELDS:
+        model = apps.get_model(label)
+        pre_save.connect(_remember_references, sender=model, dispatch_uid=f'blobs.remember.{label}')
+        post_save.connect(_update_references, sender=model, dispatch_uid=f'blobs.update.{label}')
+        post_delete.connect(_drop_references, sender=model, dispatch_uid=f'blobs.drop.{label}')
+
+
+def recount(batch_size=1000):
+    """Recompute every blob's ref_count from the tracked fields. Returns how many were wrong."""
+    counts = Counter()
+    for label in TRACKED_FIELDS:
+        model = apps.get_model(label)
+        for values in model._base_manager.values(*_fields(model)).iterator(chunk_size=batch_size):
+            counts.update(name for name in _names_from_values(model, values) if is_blob(name))
+
+    fixed = 0
+    for blob in Blob.objects.only('name', 'ref_count').iterator(chunk_size=batch_size):
+        if blob.ref_count != counts[blob.name]:
+            Blob.objects.filter(pk=blob.pk).update(ref_count=counts[blob.name], updated_at=timezone.now())
+            fixed += 1
+    return fixed
+
+
+def collect_garbage(grace_period, storage=None, dry_run=False):
+    """
+    Delete blobs that have been unreferenced for longer than `grace_period`
+    seconds, and blob files with no Blob row (interrupted saves).
+
+    Returns (files removed, bytes freed).
+    """
+    storage = storage or default_storage
+    cutoff = timezone.now() - timedelta(seconds=grace_period)
+    removed = freed = 0
+
+    for blob in Blob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff).iterator():
+        if dry_run:
+            deleted = 1
+        else:
+            # Re-checked in the DELETE, in case the blob was re-used meanwhile.
+            deleted, _ = Blob.objects.filter(pk=blob.pk, ref_count__lte=0, updated_at__lt=cutoff).delete()
+            if deleted:
+                storage.purge(blob.name)
+        if deleted:
+            removed += 1
+            freed += blob.size
+
+    root = storage.path(BLOB_PREFIX)
+    for directory, _, files in os.walk(root):
+        names = [
+            os.path.relpath(os.path.join(directory, file), storage.location).replace(os.sep, '/')
+            for file in files
+        ]
+        known = set(Blob.objects.filter(name__in=names).values_list('name', flat=True))
+        for name in set(names) - known:
+            path = storage.path(name)
+            if os.path.getmtime(path) >= cutoff.timestamp():
+                continue
+            removed += 1
+            freed += os.path.getsize(path)
+            if not dry_run:
+                storage.purge(name)
+    return removed, freed
@@ -0,0 +1,385 @@
+"""
+Write-behind persistence for chat messages.
+
+With CHAT_WRITE_BEHIND enabled, ChatConsumer no longer waits for an INSERT
+before broadcasting. Each message gets its id and timestamp in-process,
+is broadcast right away and is handed to a single writer thread, which stores
+messages with bulk_create in batches of up to CHAT_WRITE_BEHIND_BATCH_SIZE or
+every CHAT_WRITE_BEHIND_INTERVAL seconds, whichever comes first. The queue is
+drained when the interpreter exits cleanly.
+
+A message is broadcast before it is saved, so its id is never changed
+afterwards. Failed writes are retried with backoff; messages that still
+cannot be saved (or whose id is taken) are appended to CHAT_DEAD_LETTER_PATH
+and can be saved later with the replay_chat_dead_letters command.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import inbox
+from .models import ChatWriterNode, Message
+
+logger = logging.getLogger(__name__)
+
+# Message ids are 63-bit and time-ordered: milliseconds since EPOCH_MS, then
+# the process's node number (CHAT_WRITER_NODE or a leased ChatWriterNode),
+# then a per-millisecond sequence.
+EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 2.0
+
+_STOP = object()
+
+
+class MessageIdGenerator:
+    def __init__(self, node=None):
+        self._lock = threading.Lock()
+        self.node = node
+        self._last_ms = 0
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            now = max(int(time.time() * 1000) - EPOCH_MS, self._last_ms)
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond; borrow the next one.
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << (NODE_BITS + SEQUENCE_BITS)) | (self.node << SEQUENCE_BITS) | self._sequence
+
+
+class NodeLease:
+    """A node number leased from the ChatWriterNode table and renewed while the process runs."""
+
+    def __init__(self):
+        self.token = uuid.uuid4().hex
+        self.slot = None
+        self.renewed_at = 0.0
+
+    def claim(self):
+        now = timezone.now()
+        until = now + timedelta(seconds=settings.CHAT_WRITER_NODE_LEASE)
+        taken = set(ChatWriterNode.objects.filter(leased_until__gte=now).values_list('slot', flat=True))
+        for slot in random.sample(range(1 << NODE_BITS), 1 << NODE_BITS):
+            if slot in taken:
+                continue
+            # Only one process can win the conditional UPDATE (or the INSERT).
+            claimed = ChatWriterNode.objects.filter(slot=slot, leased_until__lt=now).update(
+                token=self.token, leased_until=until,
+            )
+            if not claimed:
+                try:
+                    with transaction.atomic():
+                        ChatWriterNode.objects.create(slot=slot, token=self.token, leased_until=until)
+                except IntegrityError:
+                    continue
+            self.slot = slot
+            self.renewed_at = time.monotonic()
+            return slot
+        raise RuntimeError('Every chat writer node number is leased')
+
+    def renew(self):
+        """Extend the lease. Returns False if it expired and was taken by another process."""
+        until = timezone.now() + timedelta(seconds=settings.CHAT_WRITER_NODE_LEASE)
+        renewed = ChatWriterNode.objects.filter(slot=self.slot, token=self.token).update(leased_until=until)
+        self.renewed_at = time.monotonic()
+        return bool(renewed)
+
+    def release(self):
+        ChatWriterNode.objects.filter(slot=self.slot, token=self.token).delete()
+
+
+def _dead_letter_entry(message):
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'receiver_id': message.receiver_id,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def dead_letter(messages):
+    """Append `messages` to CHAT_DEAD_LETTER_PATH, keeping their ids."""
+    try:
+        with open(settings.CHAT_DEAD_LETTER_PATH, 'a', encoding='utf-8') as dead_letters:
+            for message in messages:
+                dead_letters.write(json.dumps(_dead_letter_entry(message)) + '\n')
+    except OSError:
+        # Last resort: the log is the only copy left.
+        logger.exception(
+            'Could not dead-letter chat messages: %s',
+            json.dumps([_dead_letter_entry(message) for message in messages]),
+        )
+
+
+def _stored(messages):
+    """Ids of the `messages` that are already saved, as opposed to clashing with other rows."""
+    wanted = {(message.id, message.sender_id, message.receiver_id, message.content) for message in messages}
+    rows = Message.objects.filter(pk__in=[message.id for message in messages]).values_list(
+        'pk', 'sender_id', 'receiver_id', 'content',
+    )
+    return {row[0] for row in rows if row in wanted}
+
+
+def replay_dead_letters():
+    """
+    Save dead-lettered messages that can be stored now. Returns (saved, kept):
+    messages whose id is still taken by another row stay in the file.
+    """
+    path = settings.CHAT_DEAD_LETTER_PATH
+    replaying = path + '.replaying'
+    try:
+        # The writer may append while we work; it starts a new file.
+        os.replace(path, replaying)
+    except FileNotFoundError:
+        return 0, 0
+    with open(replaying, encoding='utf-8') as dead_letters:
+        entries = [json.loads(line) for line in dead_letters if line.strip()]
+
+    saved, kept = 0, []
+    for entry in entries:
+        message = Message(
+            id=entry['id'],
+            sender_id=entry['sender_id'],
+            receiver_id=entry['receiver_id'],
+            content=entry['content'],
+            timestamp=datetime.fromisoformat(entry['timestamp']),
+        )
+        try:
+            with transaction.atomic():
+                message.save(force_insert=True)
+                inbox.messages_saved([message])
+        except IntegrityError:
+            if not _stored([message]):
+                kept.append(message)
+                continue
+        saved += 1
+
+    if kept:
+        dead_letter(kept)
+    os.remove(replaying)
+    return saved, len(kept)
+
+
+class MessageWriter:
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._ids = MessageIdGenerator(settings.CHAT_WRITER_NODE)
+        self._lease = None
+        # Set once the writer thread has a node number for message ids.
+        self._ready = threading.Event()
+        if self._ids.node is not None:
+            self._ready.set()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the writer thread (and lease a node number) ahead of the first message."""
+        self._ensure_started()
+        self._ready.wait()
+
+    def submit(self, sender, receiver, content):
+        """Assign an id and timestamp to a new message and queue it for saving."""
+        # Only the first message of a process that was not start()ed waits here.
+        self.start()
+        message = Message(
+            id=self._ids.next_id(),
+            sender=sender,
+            receiver=receiver,
+            content=content,
+            timestamp=timezone.now(),
+        )
+        self._queue.put(message)
+        return message
+
+    def flush(self):
+        """Block until every message submitted so far has been written."""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        # Restart the writer if it died before reaching the event.
+        while not done.wait(1):
+            self._ensure_started()
+
+    def stop(self):
+        """Write everything still queued and stop the writer thread."""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+            if thread is not None and not thread.is_alive():
+                thread = self._start_thread()
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _ensure_started(self):
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._thread is not None:
+                # Queued messages are still in the queue for the new thread.
+                logger.error('Chat message writer thread died, restarting it')
+            self._thread = self._start_thread()
+
+    def _start_thread(self):
+        thread = threading.Thread(target=self._run, name='chat-message-writer', daemon=True)
+        thread.start()
+        return thread
+
+    def _take_node(self):
+        if self._ids.node is not None:
+            return
+        try:
+            self._lease = NodeLease()
+            self._ids.node = self._lease.claim()
+        except Exception:
+            # Messages cannot wait for the database; a random node number
+            # is what every process used before leases.
+            self._lease = None
+            self._ids.node = random.getrandbits(NODE_BITS)
+            logger.exception('Could not lease a chat writer node number, using %d', self._ids.node)
+
+    def _renew_node(self):
+        lease = self._lease
+        if lease is None or time.monotonic() - lease.renewed_at < settings.CHAT_WRITER_NODE_LEASE / 3:
+            return
+        try:
+            if not lease.renew():
+                logger.error('Chat writer node %d was leased by another process, taking a new one', lease.slot)
+                self._ids.node = lease.claim()
+        except Exception:
+            logger.exception('Could not renew the chat writer node lease')
+
+    def _release_node(self):
+        if self._lease is None:
+            return
+        try:
+            self._lease.release()
+        except Exception:
+            # It expires on its own.
+            logger.exception('Could not release the chat writer node lease')
+        # A writer restarted after stop() leases a new one.
+        self._lease = None
+        self._ids.node = None
+        self._ready.clear()
+
+    def _run(self):
+        batch_size = settings.CHAT_WRITE_BEHIND_BATCH_SIZE
+        interval = settings.CHAT_WRITE_BEHIND_INTERVAL
+        try:
+            try:
+                self._take_node()
+            finally:
+                self._ready.set()
+            while True:
+                try:
+                    batch = [self._queue.get(timeout=settings.CHAT_WRITER_NODE_LEASE / 3)]
+                except queue.Empty:
+                    self._renew_node()
+                    continue
+                deadline = time.monotonic() + interval
+                # Flush early when asked to (a flush() event or stop()).
+                while len(batch) < batch_size and isinstance(batch[-1], Message):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+
+                messages = [item for item in batch if isinstance(item, Message)]
+                try:
+                    if messages:
+                        self._write(messages)
+                    self._renew_node()
+                except Exception:
+                    logger.exception('Failed to write %d chat messages, dead-lettering them', len(messages))
+                    dead_letter(messages)
+                finally:
+                    for item in batch:
+                        if isinstance(item, threading.Event):
+                            item.set()
+                if batch[-1] is _STOP:
+                    self._release_node()
+                    return
+        finally:
+            connection.close()
+
+    def _write(self, messages):
+        """Save `messages`, retrying failures with backoff, and dead-letter what still fails."""
+        delay = RETRY_DELAY
+        for attempt in range(settings.CHAT_WRITE_BEHIND_RETRIES):
+            if attempt:
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+            close_old_connections()
+            messages = self._save(messages)
+            if not messages:
+                return
+        logger.error('Giving up on %d chat messages, dead-lettering them', len(messages))
+        dead_letter(messages)
+
+    def _save(self, messages):
+        """Save `messages` in one batch, or row by row if that fails. Returns the ones to retry."""
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(messages)
+                inbox.messages_saved(messages)
+            return []
+        except IntegrityError:
+            logger.warning('Message batch hit an id conflict, saving row by row')
+        except Exception:
+            logger.warning('Failed to write %d chat messages', len(messages), exc_info=True)
+            return messages
+
+        retry, rejected = [], []
+        for message in messages:
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+                    inbox.messages_saved([message])
+            except IntegrityError:
+                rejected.append(message)
+            except Exception:
+                logger.warning('Failed to write chat message %d', message.id, exc_info=True)
+                retry.append(message)
+        if rejected:
+            try:
+                stored = _stored(rejected)
+            except Exception:
+                return retry + rejected
+            # Already broadcast under these ids, so they are kept for replay
+            # rather than saved under new ones.
+            rejected = [message for message in rejected if message.id not in stored]
+            if rejected:
+                logger.error('%d chat messages clash with stored rows, dead-lettering them', len(rejected))
+                dead_letter(rejected)
+        return retry
+
+
+writer = MessageWriter()
+atexit.register(writer.stop)
@@ -0,0 +1,69 @@
+"""
+Adding comments.
+
+add_comment() saves the comment, moves Post.comment_count (and the version
+that keys its cached card) and creates the author's notification in one
+transaction. The author's badge is updated and broadcast once it commits,
+and the anonymous page cache starts a new feed generation at the same time.
+"""
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from . import counters, page_cache, unread
+from .models import Comment, Notification, Post
+
+
+def _add(user, post, text):
+    """Returns the id of the author to notify, or None."""
+    with transaction.atomic():
+        comment = Comment.objects.create(user=user, post=post, text=text)
+        counters.adjust(Post, post.pk, comment_count=1, version=1)
+        # comment_count moves through update(), which sends no signals.
+        page_cache.invalidate(page_cache.FEED)
+        if post.user_id == user.id:
+            return None
+        Notification.objects.create(
+            user_id=post.user_id,
+            created_by=user,
+            notification_type='comment',
+            post=post,
+            comment=comment,
+        )
+    return post.user_id
+
+
+def add_comment(user, post, text):
+    notify = _add(user, post, text)
+    if notify is not None:
+        transaction.on_commit(lambda: notify_comment(notify))
+
+
+async def aadd_comment(user, post, text):
+    """add_comment() for async views; the whole write runs in one sync_to_async call."""
+    notify = await sync_to_async(_add)(user, post, text)
+    if notify is not None:
+        await anotify_comment(notify)
+
+
+def notify_comment(author_id):
+    unread.notification_created(author_id)
+    # Broadcast the notification with the new count, so sockets don't re-count
+    async_to_sync(get_channel_layer().group_send)(
+        f"user_{author_id}",
+        {
+            "type": "unread_notification_count_update",
+            "count": unread.notification_count(author_id),
+        }
+    )
+
+
+async def anotify_comment(author_id):
+    await unread.anotification_created(author_id)
+    await get_channel_layer().group_send(
+        f"user_{author_id}",
+        {
+            "type": "unread_notification_count_update",
+            "count": await unread.anotification_count(author_id),
+        }
+    )
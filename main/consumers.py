@@ -1,8 +1,14 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from .models import Message
+from . import history, inbox, replicas, unread
+from .chat_writer import writer
+from .usernames import user_id_for
 
 User = get_user_model()
 
@@ -16,10 +22,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # The other user's username is expected from the URL route.
         # This consumer is for 1-on-1 chat.
         self.other_username = self.scope['url_route']['kwargs']['username']
+
+        # Resolve the peer once; every later query filters by id.
+        other_user_id = await self.get_user_id(self.other_username)
+        if other_user_id is None:
+            await self.close()
+            return
+        self.other_user = User(id=other_user_id, username=self.other_username)
         
         # Create a consistent, unique room name for the two users.
-        sorted_usernames = sorted([self.user.username, self.other_username])
-        self.room_group_name = f"chat_{sorted_usernames[0]}_{sorted_usernames[1]}"
+        # Ids rather than usernames: '@' and '+' are not allowed in group names.
+        low_id, high_id = sorted([self.user.id, other_user_id])
+        self.room_group_name = f"chat_{low_id}_{high_id}"
 
         # Join room group
         await self.channel_layer.group_add(
@@ -32,6 +46,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.mark_messages_as_read()
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'room_group_name'):
+            # Rejected in connect() before joining the room.
+            return
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -42,22 +59,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data):
         try:
             text_data_json = json.loads(text_data)
+            if text_data_json.get('type') == 'load_older':
+                await self.load_older(text_data_json.get('cursor'))
+                return
             message_content = text_data_json['message']
-        except (json.JSONDecodeError, KeyError):
+        except (json.JSONDecodeError, KeyError, AttributeError):
             await self.send_error("Invalid data format.")
             return
 
         if not message_content:
             return
 
-        # Get receiver user object
-        receiver = await self.get_user(self.other_username)
-        if not receiver:
-            await self.send_error("Receiver user not found.")
-            return
+        receiver = self.other_user
 
-        # Save message to database
-        new_message = await self.save_message(self.user, receiver, message_content)
+        if settings.CHAT_WRITE_BEHIND:
+            # Broadcast now; the writer thread saves the message in the next batch.
+            new_message = writer.submit(self.user, receiver, message_content)
+            await replicas.apin(self.user.id)
+            await unread.amessage_received(receiver.id)
+            receiver_unread_count = await unread.amessage_count(receiver.id)
+        else:
+            # Save message to database
+            new_message, receiver_unread_count = await self.save_message(self.user, receiver, message_content)
 
         # Prepare user-specific channel names for notification
         sender_channel = f"user_{self.user.id}"
@@ -68,6 +91,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             {
                 'type': 'chat_message',
+                'id': new_message.id,
                 'message': new_message.content,
                 'sender': self.user.username,
                 'timestamp': new_message.timestamp.isoformat()
@@ -78,7 +102,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.channel_layer.group_send(
             receiver_channel,
             {
-                'type': 'unread_message_count_update'
+                'type': 'unread_message_count_update',
+                'count': receiver_unread_count
             }
         )
 
@@ -87,11 +112,24 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
             'type': 'chat.message',
+            'id': event.get('id'),
             'message': event['message'],
             'sender': event['sender'],
             'timestamp': event['timestamp']
         }))
     
+    async def load_older(self, cursor):
+        try:
+            messages, next_cursor = await self.get_history_page(cursor)
+        except ValueError:
+            await self.send_error("Invalid cursor.")
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'chat.history',
+            'messages': messages,
+            'next_cursor': next_cursor,
+        }))
+
     async def send_error(self, message):
         await self.send(text_data=json.dumps({
             'type': 'error',
@@ -99,24 +137,35 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }))
 
     @database_sync_to_async
-    def get_user(self, username):
+    def get_user_id(self, username):
         try:
-            return User.objects.get(username=username)
+            with replicas.routing(self.user.id):
+                return user_id_for(username)
         except User.DoesNotExist:
             return None
 
+    @database_sync_to_async
+    def get_history_page(self, cursor):
+        with replicas.routing(self.user.id):
+            messages, next_cursor = history.conversation_page(self.user.id, self.other_user.id, cursor)
+        names = {self.user.id: self.user.username, self.other_user.id: self.other_user.username}
+        return [history.serialize(message, names) for message in messages], next_cursor
+
     @database_sync_to_async
     def save_message(self, sender, receiver, content):
-        return Message.objects.create(sender=sender, receiver=receiver, content=content)
+        # The sender's next page reads from the primary until replicas catch up.
+        with replicas.routing(sender.id), transaction.atomic():
+            message = Message.objects.create(sender=sender, receiver=receiver, content=content)
+            inbox.messages_saved([message])
+        unread.message_received(receiver.id)
+        return message, unread.message_count(receiver.id)
 
     @database_sync_to_async
     def mark_messages_as_read(self):
         # Mark messages sent by the other user to the current user as read
-        Message.objects.filter(
-            sender__username=self.other_username, 
-            receiver=self.user, 
-            is_read=False
-        ).update(is_read=True)
+        with replicas.routing(self.user.id):
+            read = inbox.mark_read(self.user.id, self.other_user.id)
+        unread.messages_read(self.user.id, read)
 
 # This new consumer will handle user-specific notifications like unread counts
 class NotificationConsumer(AsyncWebsocketConsumer):
@@ -127,6 +176,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             return
 
         self.group_name = f"user_{self.user.id}"
+        # Latest count per badge waiting to be sent; None means "recount on flush".
+        self.pending_counts = {}
+        self.flush_task = None
 
         await self.channel_layer.group_add(
             self.group_name,
@@ -135,6 +187,8 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
+        if getattr(self, 'flush_task', None):
+            self.flush_task.cancel()
         await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
@@ -142,24 +196,42 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
     # Handler for when a new unread notification is created
     async def unread_notification_count_update(self, event):
-        count = await self.get_unread_notification_count()
-        await self.send(text_data=json.dumps({
-            'type': 'unread_notification_update',
-            'count': count
-        }))
+        self.queue_count('notifications', event.get('count'))
         
     # Handler for when a new unread message is received
     async def unread_message_count_update(self, event):
-        count = await self.get_unread_message_count()
+        self.queue_count('messages', event.get('count'))
+
+    def queue_count(self, badge, count):
+        # Events arriving within the coalesce window are sent as one frame
+        # carrying only the latest count for each badge.
+        if count is not None or badge not in self.pending_counts:
+            self.pending_counts[badge] = count
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_counts())
+
+    async def flush_counts(self):
+        await asyncio.sleep(settings.NOTIFICATION_COALESCE_WINDOW)
+        pending, self.pending_counts = self.pending_counts, {}
+        self.flush_task = None
+
+        # Producers that didn't include a count are recounted once per window.
+        if pending.get('notifications', 0) is None:
+            pending['notifications'] = await self.get_unread_notification_count()
+        if pending.get('messages', 0) is None:
+            pending['messages'] = await self.get_unread_message_count()
+
         await self.send(text_data=json.dumps({
-            'type': 'unread_message_update',
-            'count': count
+            'type': 'unread_update',
+            **pending
         }))
 
     @database_sync_to_async
     def get_unread_notification_count(self):
-        return self.user.notifications.filter(is_read=False).count()
+        with replicas.routing(self.user.id):
+            return unread.notification_count(self.user.id)
 
     @database_sync_to_async
     def get_unread_message_count(self):
-        return Message.objects.filter(receiver=self.user, is_read=False).count()
+        with replicas.routing(self.user.id):
+            return unread.message_count(self.user.id)
@@ -1,14 +1,19 @@
-from .models import Message
+from . import unread
 
 def unread_counts(request):
+    # Async views look the counts up before rendering (main.async_views).
+    counts = getattr(request, 'unread_counts', None)
+    if counts is not None:
+        return counts
+
     if not request.user.is_authenticated:
         return {
             'unread_message_count': 0,
             'unread_notification_count': 0,
         }
     
-    unread_message_count = Message.objects.filter(receiver=request.user, is_read=False).count()
-    unread_notification_count = request.user.notifications.filter(is_read=False).count()
+    unread_message_count = unread.message_count(request.user.id)
+    unread_notification_count = unread.notification_count(request.user.id)
 
     return {
         'unread_message_count': unread_message_count,
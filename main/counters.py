@@ -0,0 +1,105 @@
+"""
+Denormalized like, comment and follow counters.
+
+Counter columns are adjusted in place with F() expressions by the write paths
+in views, so rendering a card or a profile never needs a COUNT. reconcile()
+recomputes them from the source tables to repair any drift (for example rows
+removed by a cascade when an account is deleted).
+"""
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import page_cache
+from .models import Comment, Follow, Like, Post, User
+
+# (model, counter field, source model, source foreign key to model)
+COUNTERS = [
+    (Post, 'like_count', Like, 'post'),
+    (Post, 'comment_count', Comment, 'post'),
+    (User, 'follower_count', Follow, 'to_user'),
+    (User, 'following_count', Follow, 'from_user'),
+]
+
+
+def adjust(model, pk, **deltas):
+    """Atomically add `deltas` to counter columns of one row: adjust(Post, 1, like_count=1)."""
+    model.objects.filter(pk=pk).update(**{
+        field: F(field) + delta for field, delta in deltas.items()
+    })
+
+
+def _can_update_returning():
+    # PostgreSQL always has UPDATE ... RETURNING; SQLite only from 3.35, which
+    # is also when Django turns on returning columns from an INSERT.
+    return connection.vendor == 'postgresql' or (
+        connection.vendor == 'sqlite' and connection.features.can_return_columns_from_insert
+    )
+
+
+def adjust_returning(model, pk, returning, **deltas):
+    """
+    adjust() one row and read back the `returning` fields, e.g. the new count.
+
+    One UPDATE ... RETURNING where the database supports it, otherwise the
+    UPDATE and a SELECT in one transaction. Returns a tuple of values, or None
+    when there is no such row.
+    """
+    if not _can_update_returning():
+        with transaction.atomic():
+            if not model.objects.filter(pk=pk).update(**{field: F(field) + delta for field, delta in deltas.items()}):
+                return None
+            return model.objects.filter(pk=pk).values_list(*returning).get()
+
+    quote = connection.ops.quote_name
+    columns = {field.name: quote(field.column) for field in model._meta.concrete_fields}
+    assignments = ', '.join(f'{columns[field]} = {columns[field]} + %s' for field in deltas)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {quote(model._meta.db_table)} SET {assignments} '
+            f'WHERE {quote(model._meta.pk.column)} = %s '
+            f'RETURNING {", ".join(columns[field] for field in returning)}',
+            [*deltas.values(), pk],
+        )
+        return cursor.fetchone()
+
+
+def _actual_count(source, fk):
+    counts = (
+        source.objects.filter(**{fk: OuterRef('pk')})
+        .order_by().values(fk).annotate(count=Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+def reconcile(batch_size=1000):
+    """
+    Recompute every counter from its source table, one pk range at a time.
+
+    Returns a {'Model.field': repaired_rows} mapping.
+    """
+    repaired = {}
+    for model, field, source, fk in COUNTERS:
+        fixed = 0
+        last_pk = 0
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last_pk).order_by('pk')
+                .annotate(actual=_actual_count(source, fk))
+                .values_list('pk', field, 'actual')[:batch_size]
+            )
+            if not rows:
+                break
+            for pk, stored, actual in rows:
+                if stored != actual:
+                    changes = {field: actual}
+                    if model is Post:
+                        # Cached post cards show the counters.
+                        changes['version'] = F('version') + 1
+                    model.objects.filter(pk=pk).update(**changes)
+                    fixed += 1
+            last_pk = rows[-1][0]
+        if fixed and model is Post:
+            page_cache.invalidate(page_cache.FEED)
+        repaired[f'{model.__name__}.{field}'] = fixed
+    return repaired
@@ -0,0 +1,74 @@
+"""
+Queries behind the feed, profile and inbox pages.
+
+Shared by the sync views (main.views) and their async versions
+(main.async_views), so both build the same querysets and differ only in how
+they run them.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef, Prefetch
+
+from .models import Comment, Like, Post
+
+User = get_user_model()
+
+
+def annotate_user_has_liked(posts, user):
+    """Annotate each post with whether `user` has liked it."""
+    if user.is_authenticated:
+        posts = posts.annotate(user_has_liked=Exists(Like.objects.filter(post=OuterRef('pk'), user=user)))
+    return posts
+
+
+def with_comment_preview(posts):
+    """
+    Prefetch only the latest COMMENT_PREVIEW_SIZE comments of each post.
+
+    The sliced Prefetch is run as one ROW_NUMBER() window query for the whole
+    page; the rest of a thread is loaded on demand from post_comments.
+    """
+    preview = Comment.objects.select_related('user').order_by('-created_at', '-id')
+    return posts.prefetch_related(
+        Prefetch('comments', queryset=preview[:settings.COMMENT_PREVIEW_SIZE], to_attr='preview_comments')
+    )
+
+
+def feed_tab(request):
+    """Signed-in users see their following timeline unless they ask for everything."""
+    if request.user.is_authenticated and request.GET.get('tab') != 'all':
+        return 'following'
+    return 'all'
+
+
+def feed_posts(user):
+    """Posts as shown on the home feed to `user`; paged by the caller."""
+    return annotate_user_has_liked(with_comment_preview(Post.objects.select_related('user')), user)
+
+
+def profile_posts(user, viewer):
+    """`user`'s posts, newest first, as shown on their profile to `viewer`."""
+    posts = with_comment_preview(user.posts.select_related('user')).order_by('-created_at')
+    if viewer != user:
+        posts = annotate_user_has_liked(posts, viewer)
+    return posts
+
+
+def following_users(user):
+    return User.objects.filter(followers__from_user=user)
+
+
+def stories(user, following):
+    """The story bar: the accounts `user` follows, with `user` first."""
+    stories = list(following)
+    if user not in stories:
+        stories.insert(0, user)
+    return stories
+
+
+def conversations(user):
+    """
+    `user`'s inbox, latest conversation first. The materialized inbox
+    (main.inbox) already holds each conversation's last message and unread count.
+    """
+    return user.conversations.select_related('other_user', 'last_message').order_by('-last_message_at')
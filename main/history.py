@@ -0,0 +1,115 @@
+"""
+Paged chat history between two users.
+
+A conversation is the union of two directed streams, (a -> b) and (b -> a).
+Each is paged separately with the same (timestamp, id) cursor, so both are
+range scans on the (sender, receiver, timestamp, id) index, and the two
+pages are merged newest first. Opening a long conversation costs one page,
+not the whole history.
+
+Old read messages may have been moved into MessageArchive chunks by
+main.retention. Chunks overlapping the page are decompressed and merged in
+as a third stream, so the pager returns the same history either way.
+"""
+import json
+import zlib
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Message, MessageArchive
+from .pagination import decode_cursor, encode_cursor, keyset_page
+
+
+def _position(message):
+    return message.timestamp, message.id
+
+
+def pack(messages):
+    """Encode `messages` for MessageArchive.data."""
+    rows = [
+        [message.id, message.sender_id, message.receiver_id, message.content, message.timestamp.isoformat()]
+        for message in messages
+    ]
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode(), 9)
+
+
+def unpack(archive):
+    """Unsaved Message instances of a MessageArchive chunk, in stored order."""
+    return [
+        Message(
+            id=message_id, sender_id=sender_id, receiver_id=receiver_id, content=content,
+            timestamp=datetime.fromisoformat(timestamp), is_read=True,
+        )
+        for message_id, sender_id, receiver_id, content, timestamp in json.loads(zlib.decompress(archive.data))
+    ]
+
+
+def _archived(user_id, other_user_id, cursor, size, after=None):
+    """Up to size + 1 archived messages before `cursor` (and newer than `after`), newest first."""
+    low_id, high_id = sorted((user_id, other_user_id))
+    chunks = MessageArchive.objects.filter(low_user_id=low_id, high_user_id=high_id)
+    before = None
+    if cursor:
+        before = decode_cursor(cursor)
+        chunks = chunks.filter(
+            Q(first_timestamp__lt=before[0]) | Q(first_timestamp=before[0], first_id__lt=before[1])
+        )
+    if after:
+        chunks = chunks.filter(
+            Q(last_timestamp__gt=after[0]) | Q(last_timestamp=after[0], last_id__gt=after[1])
+        )
+
+    found = []
+    for chunk in chunks.order_by('-last_timestamp', '-last_id').iterator():
+        # Chunks can overlap, so stop only once no later chunk can beat the page.
+        if len(found) > size and (chunk.last_timestamp, chunk.last_id) < _position(found[-1]):
+            break
+        found.extend(m for m in unpack(chunk) if before is None or _position(m) < before)
+        found.sort(key=_position, reverse=True)
+        del found[size + 1:]
+    return found
+
+
+def conversation_page(user_id, other_user_id, cursor=None, size=None):
+    """
+    Return (messages, next_cursor) for one page of the conversation, newest first.
+
+    Raises ValueError for a malformed cursor.
+    """
+    size = size or settings.MESSAGES_PAGE_SIZE
+    directions = [(user_id, other_user_id)]
+    if other_user_id != user_id:
+        directions.append((other_user_id, user_id))
+
+    candidates = []
+    has_more = False
+    for sender_id, receiver_id in directions:
+        items, direction_cursor = keyset_page(
+            Message.objects.filter(sender_id=sender_id, receiver_id=receiver_id),
+            cursor, size, time_field='timestamp',
+        )
+        candidates.extend(items)
+        has_more = has_more or direction_cursor is not None
+
+    candidates.sort(key=_position, reverse=True)
+    # Usually the live rows overfill the page and no archive chunk reaches into it.
+    after = _position(candidates[size]) if len(candidates) > size else None
+    candidates.extend(_archived(user_id, other_user_id, cursor, size, after))
+    candidates.sort(key=_position, reverse=True)
+    page = candidates[:size]
+    next_cursor = None
+    if page and (has_more or len(candidates) > size):
+        next_cursor = encode_cursor(page[-1].timestamp, page[-1].id)
+    return page, next_cursor
+
+
+def serialize(message, usernames):
+    """JSON shape shared with ChatConsumer's chat.message frames."""
+    return {
+        'id': message.id,
+        'message': message.content,
+        'sender': usernames[message.sender_id],
+        'timestamp': message.timestamp.isoformat(),
+    }
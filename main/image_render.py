@@ -0,0 +1,33 @@
+"""
+Image rendering for the derivative process pool (main.images).
+
+The pool's workers are spawned, not forked, and import only this module, so
+it must depend on nothing but Pillow: no Django, no settings, no models.
+"""
+import io
+
+from PIL import Image, ImageOps
+
+CROPPED_SIZES = {'thumb'}
+
+
+def render(source, sizes, image_format, quality):
+    """
+    Render `sizes` ({name: edge px}) of the encoded image `source` (bytes).
+
+    Runs in a pool worker; returns {name: encoded bytes}.
+    """
+    with Image.open(io.BytesIO(source)) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        rendered = {}
+        for name, edge in sizes.items():
+            if name in CROPPED_SIZES:
+                resized = ImageOps.fit(image, (edge, edge), Image.Resampling.LANCZOS)
+            else:
+                resized = image.copy()
+                resized.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, format=image_format, quality=quality, method=4)
+            rendered[name] = buffer.getvalue()
+    return rendered
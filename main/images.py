@@ -0,0 +1,196 @@
+"""
+Resized derivatives of uploaded images.
+
+Post images, profile pictures and cover images are kept as uploaded, and
+IMAGE_DERIVATIVE_SIZES versions of each are rendered in
+IMAGE_DERIVATIVE_FORMAT: a square-cropped "thumb" for avatars and grids, and
+"feed" and "full" versions that fit within their size. Rendering runs in a
+process pool after the upload's transaction commits, from the file's bytes,
+so any storage backend works. The results are saved and recorded in the
+instance's `derivatives` field as {field: {'source': name, size: name}} by
+a single storing thread, not on the pool's own result-handling thread.
+
+`derivative_url` (and the `derivative_url` template tag) returns the original
+file's URL until derivatives for the current file exist, so a new upload is
+visible right away and replacing a file never serves stale derivatives.
+
+The pool's workers are started with 'spawn' rather than forked from this
+multi-threaded process, where a child could inherit a lock some other thread
+holds. They only import main.image_render.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+
+from .image_render import render
+
+logger = logging.getLogger(__name__)
+
+# Which derivatives to render for each image field.
+FIELD_SIZES = {
+    'image': ('thumb', 'feed', 'full'),
+    'profile_picture': ('thumb',),
+    'cover_image': ('full',),
+}
+_pool = None
+_pool_lock = threading.Lock()
+# Rendered jobs waiting for _store_results, and the thread running it.
+_results = queue.SimpleQueue()
+_storer = None
+
+
+def _render_args(fieldfile, field_name):
+    sizes = {name: settings.IMAGE_DERIVATIVE_SIZES[name] for name in FIELD_SIZES[field_name]}
+    with fieldfile.storage.open(fieldfile.name, 'rb') as source:
+        data = source.read()
+    return data, sizes, settings.IMAGE_DERIVATIVE_FORMAT, settings.IMAGE_DERIVATIVE_QUALITY
+
+
+def _get_pool():
+    global _pool, _storer
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_DERIVATIVE_WORKERS or None,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        if _storer is None or not _storer.is_alive():
+            _storer = threading.Thread(target=_store_results, name='image-derivative-store', daemon=True)
+            _storer.start()
+        return _pool
+
+
+def _store_results():
+    """Save and record what the pool rendered for _render_and_store, one job at a time."""
+    try:
+        while True:
+            model, pk, field_name, source, future = _results.get()
+            close_old_connections()
+            try:
+                _store(model, pk, field_name, source, future.result())
+            except Exception:
+                logger.exception('Could not render derivatives of %s', source)
+    finally:
+        connection.close()
+
+
+def _store(model, pk, field_name, source, rendered):
+    """Save rendered derivatives and record them, unless the file was replaced meanwhile."""
+    storage = model._meta.get_field(field_name).storage
+    extension = settings.IMAGE_DERIVATIVE_FORMAT.lower()
+    stem = os.path.splitext(source)[0]
+    entry = {'source': source}
+    for name, data in rendered.items():
+        entry[name] = storage.save(f'derivatives/{stem}_{name}.{extension}', ContentFile(data))
+
+    from . import blobs, page_cache
+
+    with transaction.atomic():
+        instance = model.objects.select_for_update().filter(pk=pk).only('derivatives', field_name).first()
+        if instance is None or getattr(instance, field_name).name != source:
+            # Never referenced; unused blobs are collected by gc_blobs.
+            unused = entry
+        else:
+            unused = instance.derivatives.get(field_name, {})
+            instance.derivatives[field_name] = entry
+            changes = {'derivatives': instance.derivatives}
+            if hasattr(instance, 'version'):
+                # The post's cached card shows the old image URL.
+                changes['version'] = F('version') + 1
+            model.objects.filter(pk=pk).update(**changes)
+            page_cache.invalidate(*page_cache.SOURCES[model._meta.label])
+            # update() skips the signals that keep blob reference counts.
+            blobs.acquire(_stored_names(entry))
+            blobs.release(_stored_names(unused))
+            unused = {}
+    for name in _stored_names(unused):
+        storage.delete(name)
+
+
+def _stored_names(entry):
+    return [name for size, name in entry.items() if size != 'source' and name]
+
+
+def _render_and_store(model, pk, field_name, fieldfile):
+    source = fieldfile.name
+    args = _render_args(fieldfile, field_name)
+    if settings.IMAGE_DERIVATIVE_WORKERS == 0:
+        # Render inline (tests, small dev setups).
+        _store(model, pk, field_name, source, render(*args))
+        return
+
+    future = _get_pool().submit(render, *args)
+    # Callbacks run on the pool's result-handling thread; storing blocks, so hand it off.
+    future.add_done_callback(lambda future: _results.put((model, pk, field_name, source, future)))
+
+
+def generate_derivatives(instance, field_names=None):
+    """Render derivatives of `instance`'s image fields once the current transaction commits."""
+    model = type(instance)
+    for field_name in field_names or [name for name in FIELD_SIZES if hasattr(instance, name)]:
+        fieldfile = getattr(instance, field_name)
+        if not fieldfile:
+            continue
+        transaction.on_commit(
+            lambda field_name=field_name, fieldfile=fieldfile: _render_and_store(model, instance.pk, field_name, fieldfile)
+        )
+
+
+def derivative_url(instance, field_name, size):
+    """URL of the `size` derivative of `instance.<field_name>`, or of the original until it is ready."""
+    fieldfile = getattr(instance, field_name)
+    if not fieldfile:
+        return ''
+    entry = (instance.derivatives or {}).get(field_name, {})
+    if entry.get('source') == fieldfile.name and entry.get(size):
+        return fieldfile.storage.url(entry[size])
+    return fieldfile.url
+
+
+def _is_current(instance, field_name):
+    entry = (instance.derivatives or {}).get(field_name, {})
+    return entry.get('source') == getattr(instance, field_name).name
+
+
+def backfill(instances, force=False, window=64):
+    """
+    Render missing or stale derivatives for `instances` in the process pool.
+
+    Waits for every job, keeping at most `window` in flight, and returns
+    (rendered, failed) counts.
+    """
+    pool = _get_pool()
+    pending = {}
+    rendered = failed = 0
+
+    def drain(until):
+        nonlocal rendered, failed
+        while len(pending) > until:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                model, pk, field_name, source = pending.pop(future)
+                try:
+                    _store(model, pk, field_name, source, future.result())
+                    rendered += 1
+                except Exception:
+                    logger.exception('Could not render derivatives of %s', source)
+                    failed += 1
+
+    for instance in instances:
+        for field_name in FIELD_SIZES:
+            fieldfile = getattr(instance, field_name, None)
+            if not fieldfile or (not force and _is_current(instance, field_name)):
+                continue
+            future = pool.submit(render, *_render_args(fieldfile, field_name))
+            pending[future] = (type(instance), instance.pk, field_name, fieldfile.name)
+            drain(window)
+    drain(0)
+    return rendered, failed
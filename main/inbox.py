@@ -0,0 +1,96 @@
+"""
+Materialized conversation inbox.
+
+Every participant of a chat has one Conversation row per partner holding the
+last message and their unread count. Rows are updated in the transaction that
+saves the messages (ChatConsumer, or the write-behind writer) and reset when
+the messages are read, so the messages page is one range scan on
+(owner, -last_message_at) instead of several correlated subqueries per
+partner. `rebuild()` recomputes the table from the message history.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Conversation, Message
+
+
+def _apply(owner_id, other_user_id, message, unread):
+    """Point one inbox row at `message` unless it already shows a newer one, and add `unread`."""
+    rows = Conversation.objects.filter(owner_id=owner_id, other_user_id=other_user_id)
+    if rows.update(unread_count=F('unread_count') + unread):
+        rows.filter(last_message_at__lte=message.timestamp).update(
+            last_message=message, last_message_at=message.timestamp,
+        )
+        return
+    try:
+        with transaction.atomic():
+            Conversation.objects.create(
+                owner_id=owner_id,
+                other_user_id=other_user_id,
+                last_message=message,
+                last_message_at=message.timestamp,
+                unread_count=unread,
+            )
+    except IntegrityError:
+        # Another process created the row first; update it instead.
+        _apply(owner_id, other_user_id, message, unread)
+
+
+def messages_saved(messages):
+    """Fold newly saved messages into both participants' inbox rows."""
+    latest = {}
+    unread = Counter()
+    for message in messages:
+        if message.sender_id == message.receiver_id:
+            continue
+        for key in ((message.sender_id, message.receiver_id), (message.receiver_id, message.sender_id)):
+            current = latest.get(key)
+            if current is None or (message.timestamp, message.id) > (current.timestamp, current.id):
+                latest[key] = message
+        unread[(message.receiver_id, message.sender_id)] += 1
+
+    with transaction.atomic():
+        for (owner_id, other_user_id), message in latest.items():
+            _apply(owner_id, other_user_id, message, unread[(owner_id, other_user_id)])
+
+
+def mark_read(owner_id, other_user_id):
+    """Mark other_user's messages to owner as read. Returns how many were unread."""
+    with transaction.atomic():
+        read = Message.objects.filter(
+            sender_id=other_user_id, receiver_id=owner_id, is_read=False,
+        ).update(is_read=True)
+        Conversation.objects.filter(
+            owner_id=owner_id, other_user_id=other_user_id, unread_count__gt=0,
+        ).update(unread_count=0)
+    return read
+
+
+def rebuild(batch_size=1000):
+    """Recreate every inbox row from the message history. Returns the number of rows."""
+    summaries = {}
+    history = Message.objects.order_by('timestamp', 'id').values_list(
+        'id', 'sender_id', 'receiver_id', 'timestamp', 'is_read',
+    )
+    for message_id, sender_id, receiver_id, timestamp, is_read in history.iterator(chunk_size=batch_size):
+        if sender_id == receiver_id:
+            continue
+        for key in ((sender_id, receiver_id), (receiver_id, sender_id)):
+            summary = summaries.setdefault(key, {'unread_count': 0})
+            summary['last_message_id'] = message_id
+            summary['last_message_at'] = timestamp
+        if not is_read:
+            summaries[(receiver_id, sender_id)]['unread_count'] += 1
+
+    with transaction.atomic():
+        Conversation.objects.all().delete()
+        Conversation.objects.bulk_create(
+            (
+                Conversation(owner_id=owner_id, other_user_id=other_user_id, **summary)
+                for (owner_id, other_user_id), summary in summaries.items()
+            ),
+            batch_size=batch_size,
+        )
+    return len(summaries)
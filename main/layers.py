@@ -0,0 +1,357 @@
+"""
+Channel layer shared by several worker processes through one SQLite file.
+
+InMemoryChannelLayer only reaches consumers in the same process, so group_send
+from a view served by one daphne worker never arrives at a socket held by
+another. SQLiteChannelLayer keeps queued messages and group memberships in a
+WAL-mode SQLite database on local disk instead, which every worker on the host
+can open without running a broker.
+
+Each layer instance owns a single connection on a dedicated thread. Receives
+on process-specific channels (the `...!xyz` names handed out by new_channel)
+are served by one poller per process: it watches `PRAGMA data_version`, which
+only changes when another connection commits, and reads every new message
+addressed to this process in one query per channel prefix, so idle workers
+cost one cheap pragma per poll interval rather than one query per socket.
+Rows are deleted once they have been received (in the next poll), so
+messages buffered in a process still count toward the channel's capacity.
+"""
+import asyncio
+import json
+import random
+import sqlite3
+import string
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    body TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel, id);
+CREATE INDEX IF NOT EXISTS messages_expires ON messages (expires);
+CREATE TABLE IF NOT EXISTS groups (
+    grp TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (grp, channel)
+);
+"""
+
+# SQLite's default limit on bound parameters is far above this; it just keeps
+# IN (...) lists for very large groups to a sensible size.
+PARAM_CHUNK = 500
+FETCH_BATCH = 200
+CLEANUP_INTERVAL = 1.0
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class _Inbox:
+    """Messages fetched for one process-specific channel, and the receivers waiting on it."""
+
+    def __init__(self):
+        self.messages = deque()
+        self.receivers = 0
+        self._arrived = asyncio.Event()
+
+    def put(self, item):
+        self.messages.append(item)
+        self._arrived.set()
+
+    async def get(self):
+        self.receivers += 1
+        try:
+            while not self.messages:
+                self._arrived.clear()
+                await self._arrived.wait()
+            return self.messages.popleft()
+        finally:
+            self.receivers -= 1
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """
+    Channel layer storing messages in a SQLite database shared between processes.
+
+    Supports the "groups" and "flush" extensions, per-channel capacity limits
+    (ChannelFull on send, silently dropped on group_send, as with the other
+    layers), message expiry and group membership expiry. Messages must be
+    JSON-serializable.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.005,
+        max_poll_interval=0.05,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.client_prefix = uuid.uuid4().hex[:12]
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-channel-layer')
+        self._connection = None
+        self._last_cleanup = 0.0
+        # Set by our own sends, which do not change data_version for our connection.
+        self._dirty = True
+
+        self._loop = None
+        self._inboxes = {}
+        self._waiters = 0
+        self._poller = None
+        # Highest message id fetched per channel range, and ids received since the last poll.
+        self._seen = {}
+        self._received = []
+
+    # --- Database side (always runs on the layer's own thread) ---
+
+    def _db(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _cleanup(self, db, now):
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        # A channel with an expired message has a dead reader; drop it from its groups.
+        db.execute(
+            'DELETE FROM groups WHERE expires < ? OR channel IN '
+            '(SELECT DISTINCT channel FROM messages WHERE expires < ?)',
+            (now, now),
+        )
+        db.execute('DELETE FROM messages WHERE expires < ?', (now,))
+
+    def _enqueue(self, db, channels, body, now):
+        """Insert `body` for each channel with room left. Returns the full channels."""
+        queued = {}
+        for chunk in _chunks(channels, PARAM_CHUNK):
+            placeholders = ','.join('?' * len(chunk))
+            queued.update(db.execute(
+                f'SELECT channel, COUNT(*) FROM messages WHERE channel IN ({placeholders}) '
+                'AND expires >= ? GROUP BY channel',
+                (*chunk, now),
+            ))
+
+        full = [channel for channel in channels if queued.get(channel, 0) >= self.get_capacity(channel)]
+        rows = [(channel, body, now + self.expiry) for channel in channels if channel not in full]
+        db.executemany('INSERT INTO messages (channel, body, expires) VALUES (?, ?, ?)', rows)
+        if rows:
+            self._dirty = True
+        return full
+
+    def _send(self, channel, body):
+        db = self._db()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            self._cleanup(db, now)
+            full = self._enqueue(db, [channel], body, now)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return bool(full)
+
+    def _group_send(self, group, body):
+        db = self._db()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            self._cleanup(db, now)
+            channels = [row[0] for row in db.execute(
+                'SELECT channel FROM groups WHERE grp = ? AND expires >= ?', (group, now)
+            )]
+            self._enqueue(db, channels, body, now)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _fetch(self, ranges, last_version, received):
+        """
+        Delete the `received` message ids, then read the messages after
+        `ranges[(low, high)]` whose channel falls in [low, high).
+
+        Returns (data_version, [(id, channel, expires, body), ...]); skips the
+        read entirely when nothing has been committed since `last_version`.
+        """
+        db = self._db()
+        self._delete(received)
+        version = db.execute('PRAGMA data_version').fetchone()[0]
+        if version == last_version and not self._dirty:
+            return version, []
+        self._dirty = False
+
+        rows = []
+        for (low, high), after in ranges.items():
+            batch = db.execute(
+                'SELECT id, channel, expires, body FROM messages '
+                'WHERE channel >= ? AND channel < ? AND id > ? ORDER BY id LIMIT ?',
+                (low, high, after, FETCH_BATCH),
+            ).fetchall()
+            if len(batch) >= FETCH_BATCH:
+                # There may be more waiting; make sure the next poll looks again.
+                self._dirty = True
+            rows.extend(batch)
+        rows.sort()
+        return version, rows
+
+    def _delete(self, ids):
+        db = self._db()
+        for chunk in _chunks(ids, PARAM_CHUNK):
+            db.execute(f'DELETE FROM messages WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+
+    def _group_add(self, group, channel):
+        self._db().execute(
+            'INSERT OR REPLACE INTO groups (grp, channel, expires) VALUES (?, ?, ?)',
+            (group, channel, time.time() + self.group_expiry),
+        )
+
+    def _group_discard(self, group, channel):
+        self._db().execute('DELETE FROM groups WHERE grp = ? AND channel = ?', (group, channel))
+
+    def _flush(self):
+        db = self._db()
+        db.execute('DELETE FROM messages')
+        db.execute('DELETE FROM groups')
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    # --- Channel layer API ---
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        if await self._run(self._send, channel, json.dumps(message)):
+            raise ChannelFull(channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+        await self._run(self._group_send, group, json.dumps(message))
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._run(self._group_add, group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        await self._run(self._group_discard, group, channel)
+
+    async def new_channel(self, prefix='specific.'):
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{prefix}.{self.client_prefix}!{suffix}'
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Inboxes and the poller belong to the loop that created them;
+            # whatever the old ones held is still in the database.
+            self._loop = loop
+            self._inboxes = {}
+            self._waiters = 0
+            self._poller = None
+            self._seen = {}
+
+        inbox = self._inboxes.setdefault(channel, _Inbox())
+        self._waiters += 1
+        if self._poller is None or self._poller.done():
+            self._poller = loop.create_task(self._poll())
+        try:
+            while True:
+                message_id, expires, message = await inbox.get()
+                self._received.append(message_id)
+                if expires >= time.time():
+                    return message
+        finally:
+            self._waiters -= 1
+            if not inbox.messages and self._inboxes.get(channel) is inbox:
+                del self._inboxes[channel]
+
+    async def _poll(self):
+        """Deliver queued messages to local receivers while any are waiting."""
+        interval = self.poll_interval
+        version = None
+        while self._waiters > 0:
+            ranges = {}
+            for channel in list(self._inboxes):
+                low = self.non_local_name(channel)
+                # '!' is followed by '"' in ASCII, so [name!, name") covers every
+                # process-specific channel under the same prefix.
+                high = low[:-1] + '"' if low.endswith('!') else low + '\0'
+                ranges[low, high] = self._seen.get((low, high), 0)
+            self._seen = ranges
+            received, self._received = self._received, []
+
+            version, rows = await self._run(self._fetch, dict(ranges), version, received)
+            for message_id, channel, expires, body in rows:
+                for (low, high), after in ranges.items():
+                    if low <= channel < high:
+                        ranges[low, high] = max(after, message_id)
+                self._inboxes.setdefault(channel, _Inbox()).put((message_id, expires, json.loads(body)))
+            self._clean_expired()
+
+            interval = self.poll_interval if rows else min(interval * 2, self.max_poll_interval)
+            await asyncio.sleep(interval)
+
+        if self._received:
+            received, self._received = self._received, []
+            await self._run(self._delete, received)
+
+    def _clean_expired(self):
+        """Drop expired messages held for channels that nobody is receiving on."""
+        now = time.time()
+        for channel, inbox in list(self._inboxes.items()):
+            if inbox.receivers:
+                continue
+            # Their rows are deleted by _cleanup once they expire.
+            while inbox.messages and inbox.messages[0][1] < now:
+                inbox.messages.popleft()
+            if not inbox.messages:
+                del self._inboxes[channel]
+
+    async def flush(self):
+        self._inboxes = {}
+        self._seen = {}
+        self._received = []
+        await self._run(self._flush)
+
+    async def close(self):
+        await self._run(self._close)
@@ -0,0 +1,93 @@
+"""
+Like toggling.
+
+toggle_like() flips a Like row and moves Post.like_count in one transaction:
+a DELETE, and only if nothing was deleted an INSERT, then a single
+UPDATE ... RETURNING that yields the new count and the post's author. On
+SQLite the DELETE takes the write lock first, so concurrent double taps on the
+same post queue up behind each other instead of racing between a read and a
+write. Notifying the author (see main.notifications) happens only after the
+transaction commits, and so does starting a new feed generation for the
+anonymous page cache (main.page_cache).
+"""
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.db import IntegrityError, transaction
+
+from . import counters, notifications, page_cache, unread
+from .models import Like, Post
+
+
+def _toggle(user, post_id):
+    """Returns (liked, like_count, author id to notify or None)."""
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(user=user, post_id=post_id).delete()
+        liked = not deleted
+        if liked:
+            try:
+                with transaction.atomic():
+                    Like.objects.create(user=user, post_id=post_id)
+            except IntegrityError:
+                # A concurrent request liked it first; that one moved the counter.
+                liked, delta = True, 0
+            else:
+                delta = 1
+        else:
+            delta = -1
+
+        row = counters.adjust_returning(Post, post_id, ('like_count', 'user'), like_count=delta, version=1)
+        if row is None:
+            raise Post.DoesNotExist
+        like_count, author_id = row
+    notify = author_id if liked and delta and author_id != user.id else None
+    return liked, like_count, notify
+
+
+def toggle_like(user, post_id):
+    """
+    Like `post_id` for `user`, or remove the like if there is one.
+
+    Returns (liked, like_count). Raises Post.DoesNotExist.
+    """
+    liked, like_count, notify = _toggle(user, post_id)
+    page_cache.bump(page_cache.FEED)
+    if notify is not None:
+        transaction.on_commit(lambda: notify_like(notify, user, post_id))
+    return liked, like_count
+
+
+async def atoggle_like(user, post_id):
+    """toggle_like() for async views; the notification is sent once the toggle has committed."""
+    liked, like_count, notify = await sync_to_async(_toggle)(user, post_id)
+    await page_cache.abump(page_cache.FEED)
+    if notify is not None:
+        await anotify_like(notify, user, post_id)
+    return liked, like_count
+
+
+def notify_like(author_id, user, post_id):
+    if not notifications.record_like(author_id, user, post_id):
+        # Folded into a notification that was already unread; the badge is unchanged.
+        return
+    unread.notification_created(author_id)
+    # Broadcast the notification with the new count, so sockets don't re-count
+    async_to_sync(get_channel_layer().group_send)(
+        f"user_{author_id}",
+        {
+            "type": "unread_notification_count_update",
+            "count": unread.notification_count(author_id),
+        }
+    )
+
+
+async def anotify_like(author_id, user, post_id):
+    if not await sync_to_async(notifications.record_like)(author_id, user, post_id):
+        return
+    await unread.anotification_created(author_id)
+    await get_channel_layer().group_send(
+        f"user_{author_id}",
+        {
+            "type": "unread_notification_count_update",
+            "count": await unread.anotification_count(author_id),
+        }
+    )
@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main import retention
+
+
+class Command(BaseCommand):
+    help = 'Delete old seen notifications and archive old read messages, in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notification-days', type=int, default=settings.NOTIFICATION_RETENTION_DAYS)
+        parser.add_argument('--message-days', type=int, default=settings.MESSAGE_ARCHIVE_AFTER_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.RETENTION_BATCH_SIZE)
+        parser.add_argument(
+            '--pause', type=float, default=settings.RETENTION_BATCH_PAUSE,
+            help='Seconds to sleep between batches.',
+        )
+
+    def handle(self, *args, **options):
+        batch = {'batch_size': options['batch_size'], 'pause': options['pause']}
+        self._timed(
+            'Deleted {} notifications',
+            retention.prune_notifications, timedelta(days=options['notification_days']), **batch,
+        )
+        self._timed(
+            'Archived {} messages',
+            retention.archive_messages, timedelta(days=options['message_days']), **batch,
+        )
+
+    def _timed(self, message, function, *args, **kwargs):
+        start = time.perf_counter()
+        rows = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{message.format(rows)} in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s).'
+        ))
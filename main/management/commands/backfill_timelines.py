@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.models import Post, User
+from main import timeline
+
+
+class Command(BaseCommand):
+    help = 'Fill the materialized following timelines from existing posts and follows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--posts-per-author', type=int, default=settings.TIMELINE_BACKFILL_SIZE,
+            help='How many of each author\'s most recent posts to fan out.',
+        )
+
+    def handle(self, *args, **options):
+        limit = options['posts_per_author']
+        author_ids = Post.objects.values_list('user_id', flat=True).distinct()
+
+        authors = 0
+        posts = 0
+        for author in User.objects.filter(pk__in=author_ids).iterator():
+            recent = Post.objects.filter(user=author).select_related('user').order_by('-created_at', '-id')[:limit]
+            for post in recent:
+                # Entries that already exist are skipped, so the command can be re-run.
+                timeline.fan_out_post(post)
+                posts += 1
+            authors += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Fanned out {posts} posts from {authors} authors.'))
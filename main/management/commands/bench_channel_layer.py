@@ -0,0 +1,101 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from main.layers import SQLiteChannelLayer
+
+
+async def _point_to_point(layer, count):
+    channel = await layer.new_channel()
+
+    async def produce():
+        for i in range(count):
+            await layer.send(channel, {'type': 'bench.message', 'n': i})
+
+    async def consume():
+        for _ in range(count):
+            await layer.receive(channel)
+
+    started = time.perf_counter()
+    await asyncio.gather(produce(), consume())
+    return count / (time.perf_counter() - started)
+
+
+async def _fan_out(layer, group_size, count):
+    channels = [await layer.new_channel() for _ in range(group_size)]
+    for channel in channels:
+        await layer.group_add('bench', channel)
+
+    async def produce():
+        for i in range(count):
+            await layer.group_send('bench', {'type': 'bench.message', 'n': i})
+
+    async def consume(channel):
+        for _ in range(count):
+            await layer.receive(channel)
+
+    started = time.perf_counter()
+    await asyncio.gather(produce(), *(consume(channel) for channel in channels))
+    # Deliveries per second: every group_send reaches group_size sockets.
+    return count * group_size / (time.perf_counter() - started)
+
+
+def _remote_receiver(path, channel, count, ready):
+    async def run():
+        layer = SQLiteChannelLayer(path, capacity=count)
+        ready.set()
+        for _ in range(count):
+            await layer.receive(channel)
+        await layer.close()
+    asyncio.run(run())
+
+
+async def _cross_process(path, count):
+    layer = SQLiteChannelLayer(path, capacity=count)
+    channel = await layer.new_channel()
+    ready = multiprocessing.Event()
+    receiver = multiprocessing.Process(target=_remote_receiver, args=(path, channel, count, ready))
+    receiver.start()
+    ready.wait()
+
+    started = time.perf_counter()
+    for i in range(count):
+        await layer.send(channel, {'type': 'bench.message', 'n': i})
+    await asyncio.get_running_loop().run_in_executor(None, receiver.join)
+    elapsed = time.perf_counter() - started
+    await layer.close()
+    return count / elapsed
+
+
+class Command(BaseCommand):
+    help = 'Compare send/receive and group fan-out throughput of the in-memory and SQLite channel layers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000)
+        parser.add_argument('--group-size', type=int, default=50)
+        parser.add_argument('--group-messages', type=int, default=200)
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        group_size = options['group_size']
+        group_count = options['group_messages']
+
+        with tempfile.TemporaryDirectory() as tmp:
+            def layers():
+                yield 'memory', InMemoryChannelLayer(capacity=count)
+                yield 'sqlite', SQLiteChannelLayer(os.path.join(tmp, 'layer.sqlite3'), capacity=count)
+
+            self.stdout.write(f'{"layer":<18}{"point-to-point msg/s":>24}{"fan-out deliveries/s":>24}')
+            for name, layer in layers():
+                p2p = asyncio.run(_point_to_point(layer, count))
+                fan_out = asyncio.run(_fan_out(layer, group_size, group_count))
+                asyncio.run(layer.flush())
+                self.stdout.write(f'{name:<18}{p2p:>24,.0f}{fan_out:>24,.0f}')
+
+            cross = asyncio.run(_cross_process(os.path.join(tmp, 'cross.sqlite3'), count))
+            self.stdout.write(f'{"sqlite (2 procs)":<18}{cross:>24,.0f}{"-":>24}')
@@ -0,0 +1,69 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from main import views
+from main.models import User
+from main.username_filter import username_filter
+
+
+def _random_name(rng):
+    return 'bench_' + ''.join(rng.choices(string.ascii_lowercase + string.digits, k=10))
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare check_username throughput with a plain iexact query and with the '
+        'in-memory username filter. Synthetic users are rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50000, help='Synthetic accounts to create first.')
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--taken-ratio', type=float, default=0.1, help='Share of checks for names that exist.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        factory = RequestFactory()
+
+        with transaction.atomic():
+            names = [_random_name(rng) for _ in range(options['users'])]
+            User.objects.bulk_create(
+                (User(username=name, email=f'{name}@example.com', password='!') for name in names),
+                batch_size=1000,
+            )
+            checks = [
+                rng.choice(names) if rng.random() < options['taken_ratio'] else _random_name(rng)
+                for _ in range(options['requests'])
+            ]
+            requests = [factory.get('/check_username/', {'username': name}) for name in checks]
+
+            def query_view(request):
+                # check_username as it was before the filter.
+                User.objects.filter(username__iexact=request.GET['username']).exists()
+
+            def run(view):
+                started = time.perf_counter()
+                for request in requests:
+                    view(request)
+                return len(requests) / (time.perf_counter() - started)
+
+            username_filter.reset()
+            started = time.perf_counter()
+            username_filter.warm()
+            warm_ms = (time.perf_counter() - started) * 1000
+
+            before = run(query_view)
+            after = run(views.check_username)
+
+            self.stdout.write(f'{"users":<28}{User.objects.count():>12,}')
+            self.stdout.write(f'{"filter warm-up (ms)":<28}{warm_ms:>12,.1f}')
+            self.stdout.write(f'{"iexact query (checks/s)":<28}{before:>12,.0f}')
+            self.stdout.write(f'{"filter + confirm (checks/s)":<28}{after:>12,.0f}')
+            transaction.set_rollback(True)
+
+        username_filter.reset()
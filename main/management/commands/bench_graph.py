@@ -0,0 +1,77 @@
+import random
+import resource
+import statistics
+import time
+from array import array
+
+from django.core.management.base import BaseCommand
+
+from main.graph import FollowGraph
+
+GENERATE_CHUNK_SIZE = 1000000
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the CSR follow graph used for account suggestions from a synthetic '
+        'graph (or the Follow table) and time suggestion queries and updates.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--edges', type=int, default=50000000)
+        parser.add_argument('--queries', type=int, default=1000)
+        parser.add_argument('--limit', type=int, default=20, help='Suggestions per query.')
+        parser.add_argument('--from-db', action='store_true', help='Load the Follow table instead of generating a graph.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['from_db']:
+            graph = FollowGraph.load()
+        else:
+            graph = self.generate(options['users'], options['edges'])
+        self.stdout.write(
+            f'Built {len(graph.ids):,} users / {len(graph.targets):,} edges in {time.perf_counter() - start:.1f}s: '
+            f'{graph.nbytes / 2**20:,.0f} MB of arrays, peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10:,.0f} MB.'
+        )
+
+        rng = random.Random(0)
+        users = [graph.ids[rng.randrange(len(graph.ids))] for _ in range(options['queries'])]
+        latencies = []
+        for user_id in users:
+            started = time.perf_counter()
+            graph.suggestions(user_id, options['limit'])
+            latencies.append(time.perf_counter() - started)
+        self.report('suggestions', latencies)
+
+        latencies = []
+        for user_id in users:
+            started = time.perf_counter()
+            graph.follow_changed(user_id, users[0], True)
+            latencies.append(time.perf_counter() - started)
+        self.report('follow', latencies)
+
+        latencies = []
+        for user_id in users:
+            started = time.perf_counter()
+            graph.suggestions(user_id, options['limit'])
+            latencies.append(time.perf_counter() - started)
+        self.report('suggestions after follows', latencies)
+
+    def generate(self, users, edges):
+        """Every user follows edges // users random accounts."""
+        degree = edges // users
+        ids = array('q', range(1, users + 1))
+        offsets = array('q', range(0, users * degree + 1, degree))
+        targets = array('i')
+        population = range(users)
+        while len(targets) < users * degree:
+            targets.extend(random.choices(population, k=min(GENERATE_CHUNK_SIZE, users * degree - len(targets))))
+        return FollowGraph(ids, offsets, targets)
+
+    def report(self, name, latencies):
+        quantiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f'{name}: p50 {quantiles[49] * 1000:.3f} ms, p95 {quantiles[94] * 1000:.3f} ms, '
+            f'p99 {quantiles[98] * 1000:.3f} ms'
+        )
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+from main import inbox, timeline
+from main.models import Comment, Follow, Message, Post, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the feed, profile and inbox pages under daphne, '
+        'once with the sync views and once with the async ones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=64, help='Concurrent keep-alive connections.')
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        viewer, paths = self.create_data(tag)
+        session = SessionStore()
+        session.update({
+            SESSION_KEY: str(viewer.pk),
+            BACKEND_SESSION_KEY: settings.AUTHENTICATION_BACKENDS[0],
+            HASH_SESSION_KEY: viewer.get_session_auth_hash(),
+        })
+        session.create()
+
+        self.stdout.write(f'{"views":<8}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors":>8}')
+        try:
+            for mode in ('sync', 'async'):
+                server = self.start_server(mode, options['port'])
+                try:
+                    latencies, errors, elapsed = asyncio.run(self.load(
+                        options['port'], session.session_key, paths, options['concurrency'], options['seconds'],
+                    ))
+                finally:
+                    server.terminate()
+                    server.wait()
+                if not latencies:
+                    raise CommandError(f'No successful requests with the {mode} views.')
+                quantiles = statistics.quantiles(latencies, n=100)
+                self.stdout.write(
+                    f'{mode:<8}{len(latencies) / elapsed:>10,.0f}{quantiles[49] * 1000:>10.1f}'
+                    f'{quantiles[94] * 1000:>10.1f}{quantiles[98] * 1000:>10.1f}{errors:>8}'
+                )
+        finally:
+            session.delete()
+            User.objects.filter(username__startswith=f'bench_http_{tag}').delete()
+
+    def create_data(self, tag):
+        users = User.objects.bulk_create(
+            User(username=f'bench_http_{tag}_{i}', email=f'bench_http_{tag}_{i}@example.com', name=f'Bench {i}')
+            for i in range(20)
+        )
+        viewer, others = users[0], users[1:]
+        Follow.objects.bulk_create(Follow(from_user=viewer, to_user=other) for other in others)
+        for i, author in enumerate(others * 3):
+            post = Post.objects.create(user=author, image='posts/bench.jpg', caption=f'bench post {i}')
+            timeline.fan_out_post(post)
+            Comment.objects.bulk_create(
+                Comment(user=commenter, post=post, text='nice') for commenter in (viewer, author)
+            )
+        messages = Message.objects.bulk_create(
+            Message(sender=other, receiver=viewer, content='hello') for other in others
+        )
+        inbox.messages_saved(messages)
+        return viewer, ['/', '/?tab=all', f'/profile/{others[0].username}/', '/messages/']
+
+    def start_server(self, mode, port):
+        env = {**os.environ, 'ASYNC_VIEWS': '1' if mode == 'async' else '0'}
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(port), 'my_project.asgi:application'],
+            env=env, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError('daphne did not start.')
+
+    async def load(self, port, session_key, paths, concurrency, seconds):
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + seconds
+
+        async def client(index):
+            nonlocal errors
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            request_number = index
+            while time.perf_counter() < deadline:
+                path = paths[request_number % len(paths)]
+                request_number += 1
+                started = time.perf_counter()
+                writer.write((
+                    f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+                    f'Cookie: sessionid={session_key}\r\n\r\n'
+                ).encode())
+                await writer.drain()
+                status, length = await self.read_head(reader)
+                await reader.readexactly(length)
+                if status == 200:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+            writer.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+    async def read_head(self, reader):
+        head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+        status = int(head[0].split()[1])
+        headers = dict(line.split(': ', 1) for line in head[1:] if ': ' in line)
+        return status, int({name.lower(): value for name, value in headers.items()}.get('content-length', 0))
@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from main import images
+
+
+def _make_source(path, width, height, seed):
+    # Gradients and a fractal: compresses more like a photo than random noise does.
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (
+        gradient,
+        gradient.rotate(90 + seed, expand=False),
+        Image.effect_mandelbrot((width, height), (-2, -1.5, 1, 1.5), 64 + seed),
+    ))
+    image.save(path, quality=92)
+
+
+class Command(BaseCommand):
+    help = 'Measure image derivative rendering throughput with one process and with a process pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=24)
+        parser.add_argument('--width', type=int, default=3024)
+        parser.add_argument('--height', type=int, default=4032)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        sizes = {name: settings.IMAGE_DERIVATIVE_SIZES[name] for name in images.FIELD_SIZES['image']}
+        render = partial(
+            images.render, sizes=sizes,
+            image_format=settings.IMAGE_DERIVATIVE_FORMAT, quality=settings.IMAGE_DERIVATIVE_QUALITY,
+        )
+        workers = options['workers']
+
+        with tempfile.TemporaryDirectory() as tmp:
+            sources = []
+            for i in range(options['images']):
+                path = os.path.join(tmp, f'source_{i}.jpg')
+                _make_source(path, options['width'], options['height'], i)
+                with open(path, 'rb') as source:
+                    sources.append(source.read())
+
+            started = time.perf_counter()
+            for source in sources:
+                render(source)
+            serial = len(sources) / (time.perf_counter() - started)
+
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                # Start the workers before timing.
+                list(pool.map(render, sources[:workers]))
+                started = time.perf_counter()
+                list(pool.map(render, sources))
+                pooled = len(sources) / (time.perf_counter() - started)
+
+        self.stdout.write(f'{options["width"]}x{options["height"]} JPEG -> {", ".join(sizes)} ({settings.IMAGE_DERIVATIVE_FORMAT})')
+        self.stdout.write(f'{"1 process (images/s)":<30}{serial:>10.2f}')
+        self.stdout.write(f'{f"{workers} processes (images/s)":<30}{pooled:>10.2f}')
+        self.stdout.write(f'{"per core (images/s)":<30}{pooled / workers:>10.2f}')
@@ -0,0 +1,86 @@
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from main import counters, likes, unread
+from main.models import Like, Notification, Post, User
+
+
+def legacy_toggle(user, post_id):
+    """like_post as it was: get_or_create, then delete or notify, then re-read the count."""
+    post = Post.objects.get(id=post_id)
+    like, created = Like.objects.get_or_create(user=user, post=post)
+    if not created:
+        like.delete()
+        counters.adjust(Post, post.pk, like_count=-1)
+    else:
+        counters.adjust(Post, post.pk, like_count=1)
+        if post.user_id != user.id:
+            Notification.objects.create(user_id=post.user_id, created_by=user, notification_type='like', post=post)
+            unread.notification_created(post.user_id)
+    post.refresh_from_db(fields=['like_count'])
+    return not created, post.like_count
+
+
+class Command(BaseCommand):
+    help = 'Hammer one post with concurrent like toggles and compare the old and the atomic toggle.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--toggles', type=int, default=200, help='Toggles per thread.')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        tag = uuid.uuid4().hex[:8]
+        author = User.objects.create_user(username=f'bench_like_{tag}', email=f'bench_like_{tag}@example.com')
+        # Two threads per account, so taps on the same like collide.
+        likers = User.objects.bulk_create(
+            User(username=f'bench_like_{tag}_{i}', email=f'bench_like_{tag}_{i}@example.com')
+            for i in range(max(1, threads // 2))
+        )
+        post = Post.objects.create(user=author, caption='hot post')
+
+        self.stdout.write(f'{"path":<10}{"toggles/s":>12}{"errors":>10}{"count drift":>14}')
+        try:
+            for name, toggle in (('legacy', legacy_toggle), ('atomic', likes.toggle_like)):
+                Like.objects.filter(post=post).delete()
+                Post.objects.filter(pk=post.pk).update(like_count=0)
+                rate, errors = self.run(toggle, post.pk, likers, threads, options['toggles'])
+                post.refresh_from_db(fields=['like_count'])
+                drift = post.like_count - Like.objects.filter(post=post).count()
+                self.stdout.write(f'{name:<10}{rate:>12,.0f}{sum(errors.values()):>10}{drift:>14}')
+                for error, count in errors.most_common():
+                    self.stdout.write(f'    {count} x {error}')
+        finally:
+            User.objects.filter(username__startswith=f'bench_like_{tag}').delete()
+
+    def run(self, toggle, post_id, likers, threads, toggles):
+        errors = Counter()
+        lock = threading.Lock()
+        start = threading.Barrier(threads + 1)
+
+        def worker(index):
+            user = likers[index % len(likers)]
+            start.wait()
+            try:
+                for _ in range(toggles):
+                    try:
+                        toggle(user, post_id)
+                    except Exception as exc:
+                        with lock:
+                            errors[type(exc).__name__] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        return threads * toggles / (time.perf_counter() - started), errors
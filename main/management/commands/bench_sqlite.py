@@ -0,0 +1,107 @@
+import copy
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+PROFILES = {
+    'stock': {'OPTIONS': {}, 'CONN_MAX_AGE': 0},
+    'tuned': {'OPTIONS': settings.SQLITE_TUNED_OPTIONS, 'CONN_MAX_AGE': settings.SQLITE_TUNED_CONN_MAX_AGE},
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare mixed read/write throughput of the stock and tuned SQLite settings from many threads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of operations that write.')
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench_sqlite_')
+        self.stdout.write(f'{"profile":<10}{"reads/s":>10}{"writes/s":>10}{"errors":>10}')
+        try:
+            for name, profile in PROFILES.items():
+                alias = f'bench_{name}'
+                connections.settings[alias] = {
+                    **copy.deepcopy(connections['default'].settings_dict),
+                    'NAME': os.path.join(directory, f'{name}.sqlite3'),
+                    'OPTIONS': dict(profile['OPTIONS']),
+                    'CONN_MAX_AGE': profile['CONN_MAX_AGE'],
+                }
+                self.create_table(alias)
+                counts, errors = self.run(alias, options['threads'], options['seconds'], options['write_ratio'])
+                self.stdout.write(
+                    f'{name:<10}{counts["read"] / options["seconds"]:>10,.0f}'
+                    f'{counts["write"] / options["seconds"]:>10,.0f}{sum(errors.values()):>10}'
+                )
+                for error, count in errors.most_common():
+                    self.stdout.write(f'    {count} x {error}')
+                connections[alias].close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def create_table(self, alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE bench_message (id INTEGER PRIMARY KEY, receiver INTEGER, content TEXT, is_read INTEGER)'
+            )
+            cursor.execute('CREATE INDEX bench_message_receiver ON bench_message (receiver, id)')
+            cursor.executemany(
+                'INSERT INTO bench_message (receiver, content, is_read) VALUES (%s, %s, 1)',
+                [(i % 100, f'seed {i}') for i in range(10000)],
+            )
+
+    def run(self, alias, threads, seconds, write_ratio):
+        counts, errors = Counter(), Counter()
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def worker():
+            rng = random.Random()
+            local, failed = Counter(), Counter()
+            connection = connections[alias]
+            while time.perf_counter() < deadline:
+                receiver = rng.randrange(100)
+                try:
+                    if rng.random() < write_ratio:
+                        # Read-then-write, like the inbox and counter updates.
+                        with transaction.atomic(using=alias), connection.cursor() as cursor:
+                            cursor.execute('SELECT COUNT(*) FROM bench_message WHERE receiver = %s AND is_read = 0', [receiver])
+                            cursor.fetchone()
+                            cursor.execute(
+                                'INSERT INTO bench_message (receiver, content, is_read) VALUES (%s, %s, 0)',
+                                [receiver, 'hello'],
+                            )
+                        local['write'] += 1
+                    else:
+                        with connection.cursor() as cursor:
+                            cursor.execute(
+                                'SELECT id, content FROM bench_message WHERE receiver = %s ORDER BY id DESC LIMIT 20',
+                                [receiver],
+                            )
+                            cursor.fetchall()
+                        local['read'] += 1
+                except OperationalError as exc:
+                    failed[str(exc)] += 1
+                # What request_finished does at the end of every request.
+                connection.close_if_unusable_or_obsolete()
+            connection.close()
+            with lock:
+                counts.update(local)
+                errors.update(failed)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return counts, errors
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from main import blobs
+from main.storage import ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    help = 'Delete media blobs that no post or profile has referenced for longer than the grace period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-period', type=int, default=settings.BLOB_GC_GRACE_PERIOD,
+            help='Seconds a blob must have been unreferenced before it is deleted.',
+        )
+        parser.add_argument('--recount', action='store_true', help='Recompute reference counts first.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not main.storage.ContentAddressedStorage.')
+
+        if options['recount']:
+            fixed = blobs.recount()
+            self.stdout.write(f'{fixed} reference counts repaired')
+
+        removed, freed = blobs.collect_garbage(options['grace_period'], dry_run=options['dry_run'])
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {removed} blobs ({freed / 1024 / 1024:.1f} MiB).'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from main import images
+from main.models import Post, User
+
+
+class Command(BaseCommand):
+    help = 'Render resized derivatives for existing post images, profile pictures and cover images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render derivatives that are already up to date.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        sources = [
+            ('posts', Post.objects.exclude(image='').only('id', 'image', 'derivatives')),
+            ('users', User.objects.exclude(profile_picture='', cover_image='').only(
+                'id', 'profile_picture', 'cover_image', 'derivatives',
+            )),
+        ]
+        for label, queryset in sources:
+            rendered, failed = images.backfill(
+                queryset.order_by('pk').iterator(chunk_size=options['batch_size']),
+                force=options['force'],
+            )
+            self.stdout.write(f'{label}: {rendered} images rendered, {failed} failed')
+        self.stdout.write(self.style.SUCCESS('Image derivatives are up to date.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main import inbox
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized conversation inbox from the message history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows = inbox.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} conversation rows.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main import search
+
+
+class Command(BaseCommand):
+    help = 'Recreate the user search index and its triggers, then reindex every user.'
+
+    def handle(self, *args, **options):
+        # migrate reinstalls missing triggers itself; this also forces a full
+        # reindex, e.g. after restoring users from a backup.
+        if search.install_index():
+            self.stdout.write(self.style.SUCCESS('User search index rebuilt.'))
+        else:
+            self.stdout.write(self.style.WARNING('Full-text search is unavailable on this database; search uses the fallback query.'))
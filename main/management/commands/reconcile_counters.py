@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from main import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized like, comment and follow counters and repair drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        repaired = counters.reconcile(batch_size=options['batch_size'])
+        for counter, fixed in repaired.items():
+            self.stdout.write(f'{counter}: {fixed} rows repaired')
+        self.stdout.write(self.style.SUCCESS('Counters reconciled.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main import chat_writer
+
+
+class Command(BaseCommand):
+    help = 'Save chat messages the write-behind writer could not store, keeping their ids.'
+
+    def handle(self, *args, **options):
+        saved, kept = chat_writer.replay_dead_letters()
+        self.stdout.write(self.style.SUCCESS(f'Saved {saved} messages; {kept} still clash with stored rows.'))
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(model, fk):
+    counts = (
+        model.objects.filter(**{fk: OuterRef('pk')})
+        .order_by().values(fk).annotate(count=Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('main', 'Post')
+    User = apps.get_model('main', 'User')
+    Like = apps.get_model('main', 'Like')
+    Comment = apps.get_model('main', 'Comment')
+    Follow = apps.get_model('main', 'Follow')
+
+    Post.objects.update(
+        like_count=_count(Like, 'post'),
+        comment_count=_count(Comment, 'post'),
+    )
+    User.objects.update(
+        follower_count=_count(Follow, 'to_user'),
+        following_count=_count(Follow, 'from_user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='follower_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_message_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'receiver', '-timestamp', '-id'], name='message_pair_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:34
+
+from django.db import migrations, models
+
+
+def install_search_index(apps, schema_editor):
+    # The FTS5 table and its triggers are raw SQL owned by main.search.
+    from main.search import install_index
+    install_index(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from main.search import uninstall_index
+    uninstall_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_conversation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
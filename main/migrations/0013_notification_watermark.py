@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:52
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def populate_watermarks(apps, schema_editor):
+    # The newest notification each user has read becomes their watermark.
+    User = apps.get_model('main', 'User')
+    Notification = apps.get_model('main', 'Notification')
+    newest_read = (
+        Notification.objects.filter(user=OuterRef('pk'), is_read=True)
+        .order_by().values('user').annotate(newest=Max('created_at')).values('newest')
+    )
+    User.objects.update(last_seen_notification_at=Subquery(newest_read))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_notification_aggregation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_seen_notification_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='notification',
+            name='is_read',
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='notification_user_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_post_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatWriterNode',
+            fields=[
+                ('slot', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=32)),
+                ('leased_until', models.DateTimeField()),
+            ],
+        ),
+    ]
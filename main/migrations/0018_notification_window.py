@@ -0,0 +1,48 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:03
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def populate_times(apps, schema_editor):
+    # Existing windows started when their row was last bumped. Existing likes
+    # are dated to their post, so they predate every open window.
+    Like = apps.get_model('main', 'Like')
+    Notification = apps.get_model('main', 'Notification')
+    Post = apps.get_model('main', 'Post')
+    Notification.objects.update(window_started_at=F('created_at'))
+    Like.objects.update(created_at=Subquery(Post.objects.filter(pk=OuterRef('post')).values('created_at')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_user_lower_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notification_aggregate_idx',
+        ),
+        migrations.AddField(
+            model_name='like',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='window_started_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(populate_times, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['post', 'created_at'], name='like_post_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['post', 'notification_type', '-window_started_at'], name='notification_window_idx'),
+        ),
+    ]
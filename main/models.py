@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 from django.conf import settings
+from django.utils import timezone
 
 class User(AbstractUser):
     name = models.CharField(max_length=100)
@@ -9,19 +11,58 @@ class User(AbstractUser):
     bio = models.TextField(blank=True, null=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
     cover_image = models.ImageField(upload_to='cover_images/', blank=True, null=True)
+    # Set once the account has more followers than TIMELINE_FANOUT_LIMIT. Its
+    # posts are then merged into followers' feeds at read time instead of being
+    # copied into every follower's timeline.
+    fan_out_on_read = models.BooleanField(default=False)
+    # Denormalized counters, kept in step by main.counters and repaired by the
+    # reconcile_counters command.
+    follower_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+    # Resized versions of profile_picture and cover_image (main.images).
+    derivatives = models.JSONField(default=dict, blank=True)
+    # Notifications created after this are unread (main.unread); moved forward
+    # when the notifications page is opened.
+    last_seen_notification_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Case-insensitive prefix autocomplete on short queries (main.search).
+            models.Index(Lower('username'), name='user_username_lower_idx'),
+            models.Index(Lower('name'), name='user_name_lower_idx'),
+        ]
 
 class Post(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='posts')
     image = models.ImageField(upload_to='posts/')
     caption = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    like_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    # Resized versions of image (main.images).
+    derivatives = models.JSONField(default=dict, blank=True)
+    # Bumped with every change shown on the post's card (edits, new
+    # derivatives, like and comment counts); keys the cached card fragments.
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the feed walks (created_at, id) newest first.
+            models.Index(fields=['-created_at', '-id'], name='post_feed_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='post_user_feed_idx'),
+        ]
 
 class Like(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes')
+    # Counts the distinct likers of an aggregated notification (main.notifications).
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['post', 'created_at'], name='like_post_created_idx'),
+        ]
 
 class Comment(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -43,15 +84,32 @@ class Notification(models.Model):
     notification_type = models.CharField(max_length=10, choices=NOTIFICATION_TYPES)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, blank=True, null=True)
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, blank=True, null=True)
+    # Bumped when another like is folded into the row (main.notifications).
     created_at = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+    # Likes on one post within NOTIFICATION_AGGREGATION_WINDOW of the first
+    # one (window_started_at) share a row: created_by is the latest actor,
+    # recent_actors the latest usernames (newest first) and actor_count
+    # everyone who liked it since the window started.
+    window_started_at = models.DateTimeField(default=timezone.now)
+    actor_count = models.PositiveIntegerField(default=1)
+    recent_actors = models.JSONField(default=list, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Paging and unread counts (created_at after the user's watermark).
+            models.Index(fields=['user', '-created_at', '-id'], name='notification_user_idx'),
+            models.Index(fields=['post', 'notification_type', '-window_started_at'], name='notification_window_idx'),
+        ]
 
     def __str__(self):
         return f'{self.created_by} {self.notification_type}d your post'
 
+    @property
+    def other_actor_count(self):
+        """Actors beyond the ones named in recent_actors ("... and N others")."""
+        return max(0, self.actor_count - max(1, len(self.recent_actors)))
+
 class Follow(models.Model):
     from_user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='following', on_delete=models.CASCADE)
     to_user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='followers', on_delete=models.CASCADE)
@@ -63,19 +121,110 @@ class Follow(models.Model):
     def __str__(self):
         return f'{self.from_user} follows {self.to_user}'
 
+class TimelineEntry(models.Model):
+    """A post materialized into one user's following feed (fan-out on write)."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='timeline_entries', on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='timeline_entries', on_delete=models.CASCADE)
+    # Copy of post.created_at so a timeline can be paged without joining Post.
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.post_id} in timeline of {self.user_id}'
+
 class Message(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='received_messages', on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: write-behind saving assigns the timestamp when the
+    # message is sent, before the row is inserted.
+    timestamp = models.DateTimeField(default=timezone.now)
     is_read = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # One direction of a conversation, newest first (main.history).
+            models.Index(fields=['sender', 'receiver', '-timestamp', '-id'], name='message_pair_idx'),
+        ]
 
     def __str__(self):
         return f'From {self.sender} to {self.receiver}: {self.content[:50]}'
 
+class ChatWriterNode(models.Model):
+    """A node number in write-behind message ids, leased by one running process (main.chat_writer)."""
+    slot = models.PositiveSmallIntegerField(primary_key=True)
+    # Random per-process token; only the holder renews the lease.
+    token = models.CharField(max_length=32)
+    leased_until = models.DateTimeField()
+
+    def __str__(self):
+        return f'Node {self.slot} leased until {self.leased_until}'
+
+class Conversation(models.Model):
+    """One row per participant of a chat: the owner's inbox entry for other_user."""
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='conversations', on_delete=models.CASCADE)
+    other_user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    last_message = models.ForeignKey(Message, related_name='+', null=True, on_delete=models.SET_NULL)
+    last_message_at = models.DateTimeField()
+    # Messages from other_user that the owner has not read yet.
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('owner', 'other_user')
+        indexes = [
+            models.Index(fields=['owner', '-last_message_at'], name='conversation_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f'Conversation of {self.owner_id} with {self.other_user_id}'
+
+class MessageArchive(models.Model):
+    """
+    Read messages of one conversation moved out of Message by archive_messages
+    (main.retention), stored as one compressed chunk (main.history reads it).
+    """
+    # The conversation's two participants, lower id first.
+    low_user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    high_user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    # (timestamp, id) of the oldest and newest message in the chunk.
+    first_timestamp = models.DateTimeField()
+    first_id = models.BigIntegerField()
+    last_timestamp = models.DateTimeField()
+    last_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['low_user', 'high_user', '-last_timestamp', '-last_id'], name='message_archive_pair_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.message_count} archived messages between {self.low_user_id} and {self.high_user_id}'
+
+class Blob(models.Model):
+    """A stored media file (main.storage) and how many model fields point at it."""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    # Last time the blob was stored or its ref_count changed; gc_blobs waits
+    # a grace period after this before removing an unreferenced blob.
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'updated_at'], name='blob_gc_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
 class Room(models.Model):
     name = models.CharField(max_length=255)
 
@@ -0,0 +1,62 @@
+"""
+Aggregated like notifications.
+
+A like on a post whose author already has a like notification for it whose
+window started (with its first like) within the last
+NOTIFICATION_AGGREGATION_WINDOW seconds is folded into that row: the actor
+moves to the front of recent_actors, actor_count becomes the number of people
+who have liked the post since the window started, and the row's created_at
+moves to now, so it sorts first and is unread again. A popular post therefore
+yields one row per window instead of one per like.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import unread
+from .models import Like, Notification
+
+
+def record_like(author_id, actor, post_id):
+    """
+    Record that `actor` liked `author_id`'s post.
+
+    Returns True if this added an unread notification (a new row, or a seen
+    row that moved past the author's watermark), i.e. when the badge goes up.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.NOTIFICATION_AGGREGATION_WINDOW)
+    with transaction.atomic():
+        notification = (
+            Notification.objects.select_for_update(of=('self',))
+            .select_related('created_by')
+            .filter(user_id=author_id, post_id=post_id, notification_type='like', window_started_at__gte=cutoff)
+            .order_by('-window_started_at')
+            .first()
+        )
+        if notification is None:
+            liked_at = Like.objects.filter(user=actor, post_id=post_id).values_list('created_at', flat=True).first()
+            Notification.objects.create(
+                user_id=author_id, created_by=actor, notification_type='like', post_id=post_id,
+                recent_actors=[actor.username], window_started_at=liked_at or now,
+            )
+            return True
+
+        recent = notification.recent_actors or [notification.created_by.username]
+        recent = [actor.username] + [name for name in recent if name != actor.username]
+        # Like rows are one per person, so liking again (after an unlike)
+        # does not count as someone new. The author's own like is not news to them.
+        likers = (
+            Like.objects.filter(post_id=post_id, created_at__gte=notification.window_started_at)
+            .exclude(user_id=author_id).count()
+        )
+        Notification.objects.filter(pk=notification.pk).update(
+            created_by=actor,
+            created_at=now,
+            actor_count=max(likers, 1),
+            recent_actors=recent[:settings.NOTIFICATION_RECENT_ACTORS],
+        )
+        last_seen = unread.last_seen_notification_at(author_id)
+        return last_seen is not None and notification.created_at <= last_seen
@@ -0,0 +1,180 @@
+"""
+Full-page cache for signed-out visitors.
+
+Every anonymous visitor gets the same home feed and search results, so
+anonymous_page_cache() keeps the rendered response and serves it without
+touching the ORM, the templates or the context processors. Responses carry
+an ETag and Last-Modified, and conditional requests are answered with 304.
+
+A cached page depends on one or more named generations (FEED, USERS). A
+generation is the time its data last changed; an entry is served only while
+the generations it was rendered under are still current. Saves of posts,
+comments and users start new generations through model signals, and so do
+deletes of posts and users, cascades included. Code that deletes comments
+directly, or changes any of these rows with QuerySet.update(), must call
+invalidate() itself; likes only change through main.likes, which does.
+PAGE_CACHE_TIMEOUT only bounds how long superseded entries linger.
+"""
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from asgiref.sync import iscoroutinefunction
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.http import HttpResponse
+
+FEED = 'feed'
+USERS = 'users'
+
+# Generations started by saves of each model.
+SOURCES = {
+    'main.Post': (FEED,),
+    'main.Comment': (FEED,),
+    'main.User': (USERS,),
+}
+
+# A post_delete receiver keeps Django from deleting rows in bulk, so deletes
+# are only tracked where main.blobs already listens for them.
+DELETE_SOURCES = ('main.Post', 'main.User')
+
+# Saves that only touch these fields change nothing a cached page shows.
+IGNORED_FIELDS = frozenset({'last_login'})
+
+
+def _generation_key(name):
+    return f'page_cache:generation:{name}'
+
+
+def _page_key(request, params):
+    # Only the query parameters the view reads are part of the key, so that
+    # stray or reordered ones share the entry instead of each adding one.
+    query = urlencode(sorted((name, request.GET[name]) for name in params if name in request.GET))
+    return 'page_cache:page:' + hashlib.md5(f'{request.path}?{query}'.encode()).hexdigest()
+
+
+def _new_generations(names):
+    now = time.time()
+    return {_generation_key(name): now for name in names}
+
+
+def bump(*names):
+    """Start new generations of `names` now, for changes that have committed."""
+    cache.set_many(_new_generations(names), None)
+
+
+async def abump(*names):
+    await cache.aset_many(_new_generations(names), None)
+
+
+def invalidate(*names):
+    """Start new generations of `names` once the current transaction commits."""
+    transaction.on_commit(lambda: bump(*names))
+
+
+def _invalidate_for(sender, update_fields=None, **kwargs):
+    if update_fields and IGNORED_FIELDS.issuperset(update_fields):
+        return
+    invalidate(*SOURCES[sender._meta.label])
+
+
+def connect():
+    for label in SOURCES:
+        model = apps.get_model(label)
+        post_save.connect(_invalidate_for, sender=model, dispatch_uid=f'page_cache.save.{label}')
+        if label in DELETE_SOURCES:
+            post_delete.connect(_invalidate_for, sender=model, dispatch_uid=f'page_cache.delete.{label}')
+
+
+def _cached(request, key, names, found):
+    """The stored response at `key` if its generations are current, else None."""
+    entry = found.get(key)
+    generations = tuple(found.get(_generation_key(name)) for name in names)
+    if entry is None or entry['generations'] != generations:
+        return None
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    return _conditional(request, response, entry['etag'], entry['last_modified'])
+
+
+def _entry(request, response, names, found):
+    """What to store for a fresh `response`, or None if it must not be shared."""
+    generations = tuple(found.get(_generation_key(name)) for name in names)
+    if (
+        None in generations or response.status_code != 200 or response.streaming or response.cookies
+        # A page with a CSRF token belongs to one visitor.
+        or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    ):
+        return None
+    return {
+        'generations': generations,
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'etag': quote_etag(hashlib.md5(response.content).hexdigest()),
+        'last_modified': int(max(generations)),
+    }
+
+
+def _missing_generations(names, found):
+    """Generations that have not started yet (or were evicted); they start now."""
+    return {key: value for key, value in _new_generations(names).items() if key not in found}
+
+
+def _conditional(request, response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+
+
+def anonymous_page_cache(*names, params=()):
+    """
+    Serve GET and HEAD requests from signed-out visitors from the page cache,
+    which is invalidated whenever one of the generations `names` changes.
+    `params` are the query parameters the view reads for signed-out visitors;
+    any others are ignored. Works for sync and async views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD') or (await request.auser()).is_authenticated:
+                    return await view(request, *args, **kwargs)
+                keys = [_page_key(request, params), *map(_generation_key, names)]
+                found = await cache.aget_many(keys)
+                cached = _cached(request, keys[0], names, found)
+                if cached is not None:
+                    return cached
+                for key, value in _missing_generations(names, found).items():
+                    await cache.aadd(key, value, None)
+                response = await view(request, *args, **kwargs)
+                entry = _entry(request, response, names, found)
+                if entry is None:
+                    return response
+                await cache.aset(keys[0], entry, settings.PAGE_CACHE_TIMEOUT)
+                return _conditional(request, response, entry['etag'], entry['last_modified'])
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                    return view(request, *args, **kwargs)
+                keys = [_page_key(request, params), *map(_generation_key, names)]
+                found = cache.get_many(keys)
+                cached = _cached(request, keys[0], names, found)
+                if cached is not None:
+                    return cached
+                for key, value in _missing_generations(names, found).items():
+                    cache.add(key, value, None)
+                response = view(request, *args, **kwargs)
+                entry = _entry(request, response, names, found)
+                if entry is None:
+                    return response
+                cache.set(keys[0], entry, settings.PAGE_CACHE_TIMEOUT)
+                return _conditional(request, response, entry['etag'], entry['last_modified'])
+        return wrapper
+    return decorator
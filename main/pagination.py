@@ -0,0 +1,58 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(timestamp, pk):
+    """Encode a (timestamp, pk) position as an opaque, URL-safe token."""
+    raw = f'{timestamp.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Reverse encode_cursor(). Raises ValueError for a malformed token."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, pk = base64.urlsafe_b64decode(padded).decode().rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (TypeError, UnicodeDecodeError) as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+def _after(queryset, cursor, time_field, id_field):
+    queryset = queryset.order_by(f'-{time_field}', f'-{id_field}')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f'{time_field}__lt': timestamp}) |
+            Q(**{time_field: timestamp, f'{id_field}__lt': pk})
+        )
+    return queryset
+
+
+def _split(items, size, time_field, id_field):
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, time_field), getattr(last, id_field))
+    return items, next_cursor
+
+
+def keyset_page(queryset, cursor, size, time_field='created_at', id_field='id'):
+    """
+    Return one newest-first page of `queryset` and the cursor for the next one.
+
+    Rows are ordered by (time_field, id_field) descending and the page starts
+    strictly after the cursor position, so the cost of a page does not depend
+    on how deep into the list it is. `next_cursor` is None on the last page.
+    """
+    queryset = _after(queryset, cursor, time_field, id_field)
+    return _split(list(queryset[:size + 1]), size, time_field, id_field)
+
+
+async def akeyset_page(queryset, cursor, size, time_field='created_at', id_field='id'):
+    """keyset_page() for async views."""
+    queryset = _after(queryset, cursor, time_field, id_field)
+    return _split([item async for item in queryset[:size + 1]], size, time_field, id_field)
@@ -0,0 +1,140 @@
+"""
+Read replicas.
+
+With DATABASE_REPLICAS set, ReplicaRouter sends reads made inside a routing()
+scope to a random replica and all writes to the primary. Requests get a scope
+from ReplicaPinningMiddleware and the socket consumers open one around their
+database helpers. Reads outside any scope (management commands, startup)
+stay on the primary.
+
+Replicas lag, so a user who has just written reads from the primary for
+REPLICA_STICKY_SECONDS: the response carries a short-lived cookie, and the
+user id is pinned in the cache so a message sent over the chat socket also
+shows up on the next page. Within a scope, every read after a write, and
+every read inside a transaction, goes to the primary too.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'db_primary'
+
+_scope = ContextVar('replica_scope', default=None)
+
+
+class _Scope:
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def _pin_key(user_id):
+    return f'replicas:pinned:{user_id}'
+
+
+def is_pinned(user_id):
+    return bool(settings.DATABASE_REPLICAS) and cache.get(_pin_key(user_id)) is not None
+
+
+async def ais_pinned(user_id):
+    return bool(settings.DATABASE_REPLICAS) and await cache.aget(_pin_key(user_id)) is not None
+
+
+def pin(user_id):
+    if settings.DATABASE_REPLICAS:
+        cache.set(_pin_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+async def apin(user_id):
+    if settings.DATABASE_REPLICAS:
+        await cache.aset(_pin_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+@contextmanager
+def routing(user_id=None, pinned=None):
+    """
+    Let reads go to a replica for the duration, unless `pinned` or (when
+    `pinned` is None) `user_id` wrote recently. A write pins `user_id`.
+    """
+    if pinned is None:
+        pinned = user_id is not None and is_pinned(user_id)
+    scope = _Scope(pinned)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+        if scope.wrote and user_id is not None:
+            pin(user_id)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        scope = _scope.get()
+        if (
+            scope is None or scope.pinned or scope.wrote or not settings.DATABASE_REPLICAS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        scope = _scope.get()
+        if scope is not None:
+            scope.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary (see the sync_replicas command).
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaPinningMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Resolved before the scope opens, so sessions and users are read from the primary.
+        user_id = request.user.pk if request.user.is_authenticated else None
+        pinned = self._forced(request) or (user_id is not None and is_pinned(user_id))
+        with routing(user_id, pinned) as scope:
+            response = self.get_response(request)
+        return self._finish(scope, response)
+
+    async def __acall__(self, request):
+        user = await request.auser()
+        user_id = user.pk if user.is_authenticated else None
+        pinned = self._forced(request) or (user_id is not None and await ais_pinned(user_id))
+        # The user is pinned below rather than by routing(), which would use the sync cache API.
+        with routing(pinned=pinned) as scope:
+            response = await self.get_response(request)
+        if scope.wrote and user_id is not None:
+            await apin(user_id)
+        return self._finish(scope, response)
+
+    def _forced(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS') or PIN_COOKIE in request.COOKIES
+
+    def _finish(self, scope, response):
+        if scope.wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
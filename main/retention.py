@@ -0,0 +1,107 @@
+"""
+Retention for the notification and message tables.
+
+Notifications the user has seen (see main.unread) are deleted once they are
+older than NOTIFICATION_RETENTION_DAYS. Read messages older than
+MESSAGE_ARCHIVE_AFTER_DAYS are moved into compressed MessageArchive chunks,
+one conversation per chunk, which main.history keeps paging through. A
+message that is still some inbox's last_message stays in place.
+
+Work is done in transactions of RETENTION_BATCH_SIZE rows with a
+RETENTION_BATCH_PAUSE sleep between them, so on SQLite the write lock is only
+ever held for one short batch and chat writes interleave with a long run.
+"""
+import time
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import history
+from .models import Conversation, Message, MessageArchive, Notification
+
+
+def _batches(take, batch_size, pause):
+    """Run take(batch_size) in its own transaction until it returns 0; returns the total."""
+    total = 0
+    while True:
+        with transaction.atomic():
+            done = take(batch_size)
+        if not done:
+            return total
+        total += done
+        if pause:
+            time.sleep(pause)
+
+
+def prune_notifications(age, batch_size=None, pause=None):
+    """Delete seen notifications older than `age` (a timedelta). Returns how many."""
+    cutoff = timezone.now() - age
+    expired = Notification.objects.filter(
+        created_at__lt=cutoff, created_at__lte=F('user__last_seen_notification_at'),
+    ).order_by('pk')
+
+    def take(limit):
+        ids = list(expired.values_list('pk', flat=True)[:limit])
+        if ids:
+            Notification.objects.filter(pk__in=ids).delete()
+        return len(ids)
+
+    return _batches(
+        take,
+        batch_size or settings.RETENTION_BATCH_SIZE,
+        settings.RETENTION_BATCH_PAUSE if pause is None else pause,
+    )
+
+
+def _pair(message):
+    return tuple(sorted((message.sender_id, message.receiver_id)))
+
+
+def _archive(pair, messages, chunk_size):
+    """Append `messages` to the pair's newest chunk while it has room, else start a new one."""
+    low_id, high_id = pair
+    chunk = (
+        MessageArchive.objects.filter(low_user_id=low_id, high_user_id=high_id)
+        .order_by('-last_timestamp', '-last_id').first()
+    )
+    if chunk is None or chunk.message_count + len(messages) > chunk_size:
+        chunk = MessageArchive(low_user_id=low_id, high_user_id=high_id)
+    else:
+        messages = history.unpack(chunk) + messages
+    messages.sort(key=lambda message: (message.timestamp, message.id))
+
+    chunk.first_timestamp, chunk.first_id = messages[0].timestamp, messages[0].id
+    chunk.last_timestamp, chunk.last_id = messages[-1].timestamp, messages[-1].id
+    chunk.message_count = len(messages)
+    chunk.data = history.pack(messages)
+    chunk.save()
+
+
+def archive_messages(age, batch_size=None, pause=None, chunk_size=None):
+    """Move read messages older than `age` (a timedelta) into MessageArchive. Returns how many."""
+    cutoff = timezone.now() - age
+    chunk_size = chunk_size or settings.MESSAGE_ARCHIVE_CHUNK_SIZE
+    shown_in_inbox = Conversation.objects.filter(last_message__isnull=False).values('last_message_id')
+    cold = (
+        Message.objects.filter(timestamp__lt=cutoff, is_read=True)
+        .exclude(pk__in=shown_in_inbox).order_by('pk')
+    )
+
+    def take(limit):
+        messages = sorted(cold[:limit], key=_pair)
+        for pair, group in groupby(messages, key=_pair):
+            group = list(group)
+            for start in range(0, len(group), chunk_size):
+                _archive(pair, group[start:start + chunk_size], chunk_size)
+        if messages:
+            Message.objects.filter(pk__in=[message.pk for message in messages]).delete()
+        return len(messages)
+
+    return _batches(
+        take,
+        batch_size or settings.RETENTION_BATCH_SIZE,
+        settings.RETENTION_BATCH_PAUSE if pause is None else pause,
+    )
@@ -0,0 +1,152 @@
+"""
+User search and autocomplete.
+
+On SQLite, usernames and display names are indexed in an FTS5 table using the
+trigram tokenizer, so any substring of three or more characters is answered
+from the index and ranked with bm25. The table is an external-content index
+over main_user and is maintained by triggers, so signups, profile edits and
+account deletions update it in the same statement that changes the user.
+Shorter queries (the first keystrokes in the search box, or a two-letter
+Korean name) use prefix range scans on the lower-cased username and name
+indexes instead. Those only match the start of a username or name: "Al"
+finds "alice" but not "kalani", and "민수" does not find "김민수", until a
+third character brings in the trigram index. Other databases fall back to a
+limited icontains query.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from django.db.models import Q, Value
+from django.db.models.functions import Concat, Lower
+
+User = get_user_model()
+
+TABLE = 'main_user_search'
+TRIGRAM = 3
+
+INDEX_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+        username, name, content='main_user', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_insert AFTER INSERT ON main_user BEGIN
+        INSERT INTO {TABLE} (rowid, username, name) VALUES (new.id, new.username, new.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_delete AFTER DELETE ON main_user BEGIN
+        INSERT INTO {TABLE} ({TABLE}, rowid, username, name) VALUES ('delete', old.id, old.username, old.name);
+    END""",
+    # Logins and other saves rewrite every column; only reindex real changes.
+    f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_update AFTER UPDATE ON main_user
+    WHEN old.username IS NOT new.username OR old.name IS NOT new.name BEGIN
+        INSERT INTO {TABLE} ({TABLE}, rowid, username, name) VALUES ('delete', old.id, old.username, old.name);
+        INSERT INTO {TABLE} (rowid, username, name) VALUES (new.id, new.username, new.name);
+    END""",
+]
+
+_fts_available = None
+
+
+def install_index(using=connection):
+    """
+    Create the search table and its triggers if missing and rebuild the index.
+
+    Returns False when the database cannot host it (not SQLite, or an SQLite
+    build without FTS5 trigram support); search then uses the fallback.
+    """
+    global _fts_available
+    if using.vendor != 'sqlite':
+        return False
+    try:
+        with using.cursor() as cursor:
+            for statement in INDEX_SQL:
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('rebuild')")
+    except OperationalError:
+        return False
+    _fts_available = None
+    return True
+
+
+def ensure_index(using=connection):
+    """
+    post_migrate hook: reinstall the index if a migration dropped it.
+
+    SQLite migrations that alter main_user rebuild the table, which drops its
+    triggers along with it.
+    """
+    if using.vendor != 'sqlite':
+        return
+    with using.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE name IN (%s, %s, %s, %s)",
+            [TABLE, f'{TABLE}_insert', f'{TABLE}_delete', f'{TABLE}_update'],
+        )
+        if cursor.fetchone()[0] == 4:
+            return
+    install_index(using)
+
+
+def uninstall_index(using=connection):
+    if using.vendor != 'sqlite':
+        return
+    with using.cursor() as cursor:
+        for trigger in ('insert', 'delete', 'update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {TABLE}_{trigger}')
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+
+def fts_available():
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = connection.vendor == 'sqlite' and TABLE in connection.introspection.table_names()
+    return _fts_available
+
+
+def _match_expression(query):
+    # A quoted FTS5 string is matched literally, as a substring under trigram.
+    return '"' + query.replace('"', '""') + '"'
+
+
+def _ranked_ids(query, limit):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s '
+            # Username hits weigh more than display-name hits.
+            f'ORDER BY bm25({TABLE}, 2.0, 1.0) LIMIT %s',
+            [_match_expression(query), limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _prefix_matches(queryset, query, limit):
+    # Range conditions rather than LIKE, so SQLite can walk the Lower()
+    # indexes. The query is lowered by the database too, so both sides fold
+    # case the same way.
+    lower = Lower(Value(query))
+    upper = Concat(lower, Value('\U0010ffff'))
+    by_username = list(
+        queryset.alias(key=Lower('username')).filter(key__gte=lower, key__lt=upper).order_by('key')[:limit]
+    )
+    by_name = queryset.alias(key=Lower('name')).filter(key__gte=lower, key__lt=upper).order_by('key')[:limit]
+    seen = {user.pk for user in by_username}
+    return (by_username + [user for user in by_name if user.pk not in seen])[:limit]
+
+
+def search_users(query, limit=None, queryset=None):
+    """Return up to `limit` users matching `query`, best matches first."""
+    query = (query or '').strip()
+    limit = limit or settings.SEARCH_RESULTS_LIMIT
+    queryset = queryset if queryset is not None else User.objects.all()
+    if not query:
+        return []
+
+    if len(query) < TRIGRAM:
+        return _prefix_matches(queryset, query, limit)
+
+    if not fts_available():
+        return list(
+            queryset.filter(Q(username__icontains=query) | Q(name__icontains=query)).order_by('username')[:limit]
+        )
+
+    ids = _ranked_ids(query, limit)
+    users = queryset.in_bulk(ids)
+    return [users[pk] for pk in ids if pk in users]
@@ -0,0 +1,86 @@
+"""
+Content-addressed media storage.
+
+Uploads are stored once per distinct content under blobs/ab/cd/<sha256><ext>,
+whatever name or upload_to they were saved with, so a re-upload or repost of
+the same file costs no extra disk. Content is hashed while it is streamed in
+chunks and never read into memory whole. Large uploads that Django has already
+spooled to a temporary file are hashed in place and moved only when their
+content is new, so a duplicate upload writes nothing to the media directory.
+
+Every stored blob has a Blob row. The row's ref_count is kept by main.blobs
+from the model fields that point at the blob. delete() does not remove blob
+files, because other rows may still use them. Unreferenced blobs are removed
+by the gc_blobs command once they are older than a grace period.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+BLOB_PREFIX = 'blobs/'
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save(), and an
+        # existing file under it already holds exactly those bytes.
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        os.makedirs(self.path(BLOB_PREFIX + 'tmp'), exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            digest = hashlib.sha256()
+            for chunk in content.chunks():
+                digest.update(chunk)
+            name = blob_name(digest.hexdigest(), extension)
+            if not self.exists(name):
+                os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+                file_move_safe(content.temporary_file_path(), self.path(name), allow_overwrite=True)
+        else:
+            digest = hashlib.sha256()
+            fd, temp_path = tempfile.mkstemp(dir=self.path(BLOB_PREFIX + 'tmp'))
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    for chunk in content.chunks():
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode()
+                        digest.update(chunk)
+                        temp_file.write(chunk)
+                name = blob_name(digest.hexdigest(), extension)
+                if not self.exists(name):
+                    os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+                    # Atomic; a concurrent save of the same content wrote identical bytes.
+                    os.replace(temp_path, self.path(name))
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        if self.file_permissions_mode is not None:
+            os.chmod(self.path(name), self.file_permissions_mode)
+
+        from .blobs import register
+        register(name, self.size(name))
+        return name
+
+    def delete(self, name):
+        if is_blob(name):
+            # Shared between references; gc_blobs removes it once unreferenced.
+            return
+        super().delete(name)
+
+    def purge(self, name):
+        """Remove a blob file for good (used by garbage collection)."""
+        super().delete(name)
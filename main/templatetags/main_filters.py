@@ -1,7 +1,11 @@
 from django import template
 from django.utils import timezone
+from django.utils.html import format_html
 import datetime
 
+from .. import images, unread
+from ..pagination import encode_cursor
+
 register = template.Library()
 
 @register.filter
@@ -24,8 +28,27 @@ def time_ago(value):
     else:
         return f'방금 전'
 
+@register.simple_tag
+def time_ago_element(value):
+    """time_ago in a <time> element, which base.html keeps current in cached fragments."""
+    return format_html('<time class="time-ago" datetime="{}">{}</time>', value.isoformat(), time_ago(value))
+
+@register.filter
+def owned_by(post, user):
+    return post.user_id == user.pk
+
+@register.filter
+def keyset_cursor(obj):
+    """Cursor that continues a newest-first keyset page after `obj`."""
+    return encode_cursor(obj.created_at, obj.pk)
+
+@register.simple_tag
+def derivative_url(obj, field_name, size):
+    """URL of a resized version of an image field, or the original until it is ready."""
+    return images.derivative_url(obj, field_name, size)
+
 @register.simple_tag
 def unread_notification_count(user):
     if user.is_authenticated:
-        return user.notifications.filter(is_read=False).count()
+        return unread.notification_count(user.id)
     return 0
@@ -1,7 +1,39 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError
+from django.db.models import F
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, RequestFactory, override_settings
 from django.contrib.auth import get_user_model
-from django.urls import reverse
-from .models import Post, Like
+from PIL import Image
+from django.http import HttpResponse
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+from .models import Post, Like, Comment, Follow, Message, MessageArchive, TimelineEntry, Conversation, Blob, Notification
+from . import urls as main_urls
+from . import async_views, blobs, chat_writer, counters, graph, history, images, inbox, likes, notifications, page_cache, replicas, retention, timeline, unread, usernames, views
+from .context_processors import unread_counts
+from .chat_writer import MessageWriter
+from .consumers import ChatConsumer, NotificationConsumer
+from .layers import SQLiteChannelLayer
+from .search import search_users
+from .username_filter import username_filter
+from .templatetags.main_filters import keyset_cursor
 
 User = get_user_model()
 
@@ -52,6 +84,7 @@ class LikeModelTest(TestCase):
 
 class ViewsTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='testuser_views', password='password123', email='viewstester@example.com')
         self.client.login(username='testuser_views', password='password123')
 
@@ -68,4 +101,1061 @@ class ViewsTest(TestCase):
     def test_profile_view(self):
         response = self.client.get(reverse('profile'))
         self.assertEqual(response.status_code, 302) # Redirects to user_profile
-        self.assertRedirects(response, reverse('user_profile', kwargs={'username': self.user.username}))
\ No newline at end of file
+        self.assertRedirects(response, reverse('user_profile', kwargs={'username': self.user.username}))
+
+class FeedPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='feeduser', password='password123', email='feed@example.com')
+        self.client.login(username='feeduser', password='password123')
+        self.posts = [
+            Post.objects.create(user=self.user, image='posts/test.jpg', caption=f'post {i}')
+            for i in range(5)
+        ]
+
+    def test_first_page_is_bounded(self):
+        with self.settings(FEED_PAGE_SIZE=2):
+            response = self.client.get(reverse('index'), {'tab': 'all'})
+        self.assertEqual(len(response.context['posts']), 2)
+        self.assertEqual(response.context['posts'][0], self.posts[-1])
+        self.assertIsNotNone(response.context['next_cursor'])
+
+    def test_feed_endpoint_walks_all_posts(self):
+        seen = []
+        cursor = ''
+        with self.settings(FEED_PAGE_SIZE=2):
+            while True:
+                response = self.client.get(reverse('feed'), {'tab': 'all', 'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                seen.extend(response.context['posts'])
+                cursor = response.json()['next_cursor']
+                if not cursor:
+                    break
+        self.assertEqual(seen, list(reversed(self.posts)))
+
+    def test_feed_endpoint_rejects_bad_cursor(self):
+        response = self.client.get(reverse('feed'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', password='password123', email='viewer@example.com')
+        self.author = User.objects.create_user(username='author', password='password123', email='author@example.com')
+        self.stranger = User.objects.create_user(username='stranger', password='password123', email='stranger@example.com')
+        self.client.login(username='viewer', password='password123')
+
+    def _create_post(self, user, caption):
+        post = Post.objects.create(user=user, image='posts/test.jpg', caption=caption)
+        timeline.fan_out_post(post)
+        return post
+
+    def test_following_feed_only_shows_followed_authors(self):
+        self.client.post(reverse('follow_toggle', kwargs={'username': 'author'}))
+        followed = self._create_post(self.author, 'followed')
+        self._create_post(self.stranger, 'not followed')
+
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['posts'], [followed])
+
+        response = self.client.get(reverse('index'), {'tab': 'all'})
+        self.assertEqual(len(response.context['posts']), 2)
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        post = self._create_post(self.author, 'before follow')
+        self.client.post(reverse('follow_toggle', kwargs={'username': 'author'}))
+        self.assertTrue(TimelineEntry.objects.filter(user=self.viewer, post=post).exists())
+
+        self.client.post(reverse('follow_toggle', kwargs={'username': 'author'}))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.viewer, post=post).exists())
+
+    def test_popular_author_is_merged_on_read(self):
+        self.client.post(reverse('follow_toggle', kwargs={'username': 'author'}))
+        self.author.refresh_from_db()
+        with self.settings(TIMELINE_FANOUT_LIMIT=0):
+            post = self._create_post(self.author, 'popular')
+
+        self.assertFalse(TimelineEntry.objects.filter(user=self.viewer, post=post).exists())
+        post_ids, _ = timeline.home_timeline_page(self.viewer, None, 10)
+        self.assertEqual(post_ids, [post.id])
+
+
+class CounterTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='password123', email='user1@example.com')
+        self.user2 = User.objects.create_user(username='user2', password='password123', email='user2@example.com')
+        self.post = Post.objects.create(user=self.user1, image='posts/test.jpg', caption='counted')
+        self.client.login(username='user2', password='password123')
+
+    def test_like_toggle_updates_counter(self):
+        response = self.client.get(reverse('like_post', kwargs={'post_id': self.post.id}))
+        self.assertEqual(response.json(), {'likes_count': 1, 'liked': True})
+        response = self.client.get(reverse('like_post', kwargs={'post_id': self.post.id}))
+        self.assertEqual(response.json(), {'likes_count': 0, 'liked': False})
+
+    def test_adjust_returning_without_update_returning(self):
+        # SQLite before 3.35 has no RETURNING; the UPDATE is followed by a SELECT.
+        with mock.patch.object(counters, '_can_update_returning', return_value=False):
+            self.assertEqual(counters.adjust_returning(Post, self.post.pk, ('like_count',), like_count=2), (2,))
+            response = self.client.get(reverse('like_post', kwargs={'post_id': self.post.id}))
+            self.assertEqual(counters.adjust_returning(Post, 0, ('like_count',), like_count=1), None)
+        self.assertEqual(response.json(), {'likes_count': 3, 'liked': True})
+        self.assertEqual(counters.adjust_returning(Post, self.post.pk, ('like_count',), like_count=-1), (2,))
+
+    def test_comment_and_follow_update_counters(self):
+        self.client.post(reverse('add_comment', kwargs={'post_id': self.post.id}), {'text': 'hi'})
+        response = self.client.post(reverse('follow_toggle', kwargs={'username': 'user1'}))
+        self.assertEqual(response.json()['follower_count'], 1)
+        self.assertEqual(response.json()['following_count'], 1)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_reconcile_repairs_drift(self):
+        Like.objects.create(user=self.user2, post=self.post)
+        Comment.objects.create(user=self.user2, post=self.post, text='direct')
+        Follow.objects.create(from_user=self.user2, to_user=self.user1)
+
+        repaired = counters.reconcile()
+        self.assertEqual(repaired['Post.like_count'], 1)
+        self.post.refresh_from_db()
+        self.user1.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (1, 1))
+        self.assertEqual(self.user1.follower_count, 1)
+        self.assertEqual(counters.reconcile()['Post.like_count'], 0)
+
+    def test_profile_edit_keeps_concurrent_follows(self):
+        request = RequestFactory().post(reverse('edit_profile'), {'name': 'Renamed', 'bio': ''})
+        request.user = User.objects.get(pk=self.user1.pk)
+        counters.adjust(User, self.user1.pk, follower_count=1)
+        views.edit_profile(request)
+        self.user1.refresh_from_db()
+        self.assertEqual((self.user1.name, self.user1.follower_count), ('Renamed', 1))
+
+
+class CommentPreviewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='commenter', password='password123', email='commenter@example.com')
+        self.client.login(username='commenter', password='password123')
+        self.post = Post.objects.create(user=self.user, image='posts/test.jpg', caption='chatty', comment_count=5)
+        self.comments = [
+            Comment.objects.create(user=self.user, post=self.post, text=f'comment {i}')
+            for i in range(5)
+        ]
+
+    def test_feed_prefetches_only_preview(self):
+        with self.settings(COMMENT_PREVIEW_SIZE=2):
+            response = self.client.get(reverse('index'), {'tab': 'all'})
+        post = response.context['posts'][0]
+        self.assertEqual(post.preview_comments, [self.comments[4], self.comments[3]])
+        self.assertContains(response, 'data-next-cursor=')
+
+    def test_comments_endpoint_continues_after_preview(self):
+        with self.settings(COMMENT_PREVIEW_SIZE=2, COMMENTS_PAGE_SIZE=2):
+            response = self.client.get(reverse('index'), {'tab': 'all'})
+            cursor = response.context['posts'][0].preview_comments[-1]
+            response = self.client.get(
+                reverse('post_comments', kwargs={'post_id': self.post.id}),
+                {'cursor': keyset_cursor(cursor)},
+            )
+        self.assertEqual(list(response.context['comments']), [self.comments[2], self.comments[1]])
+        self.assertIsNotNone(response.json()['next_cursor'])
+
+
+class SQLiteChannelLayerTest(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'layer.sqlite3')
+
+    def test_group_send_reaches_other_instance(self):
+        # Two instances on one file stand in for two worker processes.
+        sender = SQLiteChannelLayer(self.path)
+        receiver = SQLiteChannelLayer(self.path)
+
+        async def run():
+            channel = await receiver.new_channel()
+            await receiver.group_add('room', channel)
+            await sender.group_send('room', {'type': 'chat.message', 'text': 'hi'})
+            message = await receiver.receive(channel)
+            await sender.close()
+            await receiver.close()
+            return message
+
+        self.assertEqual(async_to_sync(run)(), {'type': 'chat.message', 'text': 'hi'})
+
+    def test_capacity_and_expiry(self):
+        layer = SQLiteChannelLayer(self.path, capacity=1)
+        expiring = SQLiteChannelLayer(self.path, capacity=1, expiry=0)
+
+        async def run():
+            await layer.send('full', {'type': 'first'})
+            with self.assertRaises(ChannelFull):
+                await layer.send('full', {'type': 'second'})
+            # Expired messages no longer take up room in the channel.
+            await expiring.send('expiring', {'type': 'first'})
+            await expiring.send('expiring', {'type': 'second'})
+            await layer.close()
+            await expiring.close()
+
+        async_to_sync(run)()
+
+    def test_locally_buffered_messages_count_toward_capacity(self):
+        sender = SQLiteChannelLayer(self.path, capacity=1)
+        receiver = SQLiteChannelLayer(self.path, capacity=1)
+
+        async def run():
+            first = await receiver.new_channel()
+            second = await receiver.new_channel()
+            waiting = asyncio.ensure_future(receiver.receive(first))
+            await sender.send(second, {'type': 'one'})
+            await sender.send(first, {'type': 'wake'})
+            # Both were fetched by the same poll; `second` is now only buffered.
+            self.assertEqual(await waiting, {'type': 'wake'})
+            with self.assertRaises(ChannelFull):
+                await sender.send(second, {'type': 'two'})
+            self.assertEqual(await receiver.receive(second), {'type': 'one'})
+            # Received rows are deleted when the poller next runs.
+            await asyncio.sleep(0.2)
+            await sender.send(second, {'type': 'three'})
+            self.assertEqual(await receiver.receive(second), {'type': 'three'})
+            await sender.close()
+            await receiver.close()
+
+        async_to_sync(run)()
+
+
+class UnreadCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='password123', email='author@example.com')
+        self.fan = User.objects.create_user(username='fan', password='password123', email='fan@example.com')
+        self.post = Post.objects.create(user=self.author, image='posts/test.jpg', caption='liked')
+
+    def test_badges_are_served_from_cache(self):
+        request = RequestFactory().get('/')
+        request.user = self.author
+        unread_counts(request)
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_counts(request)['unread_notification_count'], 0)
+
+    def test_write_paths_adjust_counts(self):
+        self.assertEqual(unread.notification_count(self.author.id), 0)
+
+        self.client.login(username='fan', password='password123')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('like_post', kwargs={'post_id': self.post.id}))
+        with self.assertNumQueries(0):
+            self.assertEqual(unread.notification_count(self.author.id), 1)
+
+        self.client.login(username='author', password='password123')
+        self.client.get(reverse('notifications'))
+        self.assertEqual(unread.notification_count(self.author.id), 0)
+
+
+class NotificationConsumerTest(SimpleTestCase):
+    def test_events_in_window_are_coalesced(self):
+        async def run():
+            communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+            communicator.scope['user'] = User(id=4242, username='socket')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            channel_layer = get_channel_layer()
+            for count in (1, 2, 3):
+                await channel_layer.group_send('user_4242', {'type': 'unread_notification_count_update', 'count': count})
+            await channel_layer.group_send('user_4242', {'type': 'unread_message_count_update', 'count': 7})
+
+            frame = await communicator.receive_json_from(timeout=2)
+            self.assertTrue(await communicator.receive_nothing(timeout=0.5))
+            await communicator.disconnect()
+            return frame
+
+        with self.settings(NOTIFICATION_COALESCE_WINDOW=0.1):
+            frame = async_to_sync(run)()
+        self.assertEqual(frame, {'type': 'unread_update', 'notifications': 3, 'messages': 7})
+
+
+class MessageWriterTest(TransactionTestCase):
+    def test_batches_keep_assigned_ids_and_timestamps(self):
+        sender = User.objects.create_user(username='sender', password='password123', email='sender@example.com')
+        receiver = User.objects.create_user(username='receiver', password='password123', email='receiver@example.com')
+        writer = MessageWriter()
+        self.addCleanup(writer.stop)
+
+        sent = [writer.submit(sender, receiver, f'message {i}') for i in range(5)]
+        writer.flush()
+
+        saved = {message.id: message.timestamp for message in Message.objects.all()}
+        self.assertEqual(saved, {message.id: message.timestamp for message in sent})
+        self.assertEqual(sorted(saved), [message.id for message in sent])
+
+    def test_writers_lease_distinct_node_numbers(self):
+        writers = [MessageWriter(), MessageWriter()]
+        for writer in writers:
+            self.addCleanup(writer.stop)
+            writer.start()
+        self.assertNotEqual(writers[0]._ids.node, writers[1]._ids.node)
+
+    def test_writer_survives_failures(self):
+        sender = User.objects.create_user(username='sender', password='password123', email='sender@example.com')
+        receiver = User.objects.create_user(username='receiver', password='password123', email='receiver@example.com')
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        writer = MessageWriter()
+        self.addCleanup(writer.stop)
+
+        dead_letters = override_settings(CHAT_DEAD_LETTER_PATH=os.path.join(tmp.name, 'dead.jsonl'))
+        with dead_letters, self.assertLogs('main.chat_writer', 'WARNING'):
+            # A locked database is retried; anything else is dead-lettered
+            # and the writer carries on.
+            with mock.patch.object(inbox, 'messages_saved', side_effect=[OperationalError('database is locked'), None]):
+                locked = writer.submit(sender, receiver, 'locked')
+                writer.flush()
+            with mock.patch.object(writer, '_write', side_effect=RuntimeError):
+                failed = writer.submit(sender, receiver, 'failed')
+                writer.flush()
+            after = writer.submit(sender, receiver, 'after')
+            writer.flush()
+            self.assertEqual(set(Message.objects.values_list('id', flat=True)), {locked.id, after.id})
+
+            self.assertEqual(chat_writer.replay_dead_letters(), (1, 0))
+            self.assertEqual(Message.objects.get(id=failed.id).content, 'failed')
+
+    def test_clashing_ids_are_dead_lettered_not_changed(self):
+        sender = User.objects.create_user(username='sender', password='password123', email='sender@example.com')
+        receiver = User.objects.create_user(username='receiver', password='password123', email='receiver@example.com')
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        writer = MessageWriter()
+        self.addCleanup(writer.stop)
+
+        dead_letters = override_settings(CHAT_DEAD_LETTER_PATH=os.path.join(tmp.name, 'dead.jsonl'), CHAT_WRITE_BEHIND_INTERVAL=5)
+        with dead_letters, self.assertLogs('main.chat_writer', 'WARNING'):
+            message = writer.submit(sender, receiver, 'broadcast')
+            Message.objects.create(id=message.id, sender=receiver, receiver=sender, content='squatter')
+            writer.flush()
+            self.assertEqual(Message.objects.get(id=message.id).content, 'squatter')
+
+            self.assertEqual(chat_writer.replay_dead_letters(), (0, 1))
+            Message.objects.filter(id=message.id).delete()
+            self.assertEqual(chat_writer.replay_dead_letters(), (1, 0))
+            self.assertEqual(Message.objects.get(id=message.id).content, 'broadcast')
+
+
+class UsernameLookupTest(TransactionTestCase):
+    def setUp(self):
+        usernames.clear()
+        self.user = User.objects.create_user(username='lookup', password='password123', email='lookup@example.com')
+
+    def test_repeat_lookups_skip_the_database(self):
+        self.assertEqual(usernames.user_id_for('lookup'), self.user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(usernames.user_id_for('lookup'), self.user.id)
+
+    def test_chat_rejects_unknown_peer(self):
+        async def run():
+            communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), '/ws/chat/nobody/')
+            communicator.scope['user'] = self.user
+            communicator.scope['url_route'] = {'args': (), 'kwargs': {'username': 'nobody'}}
+            connected, _ = await communicator.connect()
+            await communicator.disconnect()
+            return connected
+
+        self.assertFalse(async_to_sync(run)())
+
+
+class ConversationHistoryTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password123', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', password='password123', email='bob@example.com')
+        carol = User.objects.create_user(username='carol', password='password123', email='carol@example.com')
+        for i in range(7):
+            sender, receiver = (self.alice, self.bob) if i % 2 else (self.bob, self.alice)
+            Message.objects.create(sender=sender, receiver=receiver, content=f'message {i}')
+        Message.objects.create(sender=carol, receiver=self.alice, content='elsewhere')
+
+    def test_pages_merge_both_directions(self):
+        seen = []
+        cursor = None
+        with self.settings(MESSAGES_PAGE_SIZE=3):
+            while True:
+                page, cursor = history.conversation_page(self.alice.id, self.bob.id, cursor)
+                seen.extend(message.content for message in page)
+                if cursor is None:
+                    break
+        self.assertEqual(seen, [f'message {i}' for i in reversed(range(7))])
+
+    def test_open_shows_latest_page_and_history_endpoint_continues(self):
+        self.client.login(username='alice', password='password123')
+        with self.settings(MESSAGES_PAGE_SIZE=4):
+            response = self.client.get(reverse('conversation', args=['bob']))
+            self.assertEqual(
+                [message.content for message in response.context['messages']],
+                [f'message {i}' for i in range(3, 7)],
+            )
+            older = self.client.get(
+                reverse('conversation_history', args=['bob']), {'cursor': response.context['next_cursor']}
+            ).json()
+        self.assertEqual([m['message'] for m in older['messages']], ['message 2', 'message 1', 'message 0'])
+        self.assertEqual(older['messages'][0]['sender'], 'bob')
+        self.assertIsNone(older['next_cursor'])
+        self.assertEqual(self.client.get(reverse('conversation_history', args=['bob']), {'cursor': '!'}).status_code, 400)
+
+
+class InboxTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password123', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', password='password123', email='bob@example.com')
+        self.carol = User.objects.create_user(username='carol', password='password123', email='carol@example.com')
+
+    def send(self, sender, receiver, content):
+        message = Message.objects.create(sender=sender, receiver=receiver, content=content)
+        inbox.messages_saved([message])
+        return message
+
+    def inbox_state(self):
+        return sorted(Conversation.objects.values_list('owner__username', 'other_user__username', 'last_message__content', 'unread_count'))
+
+    def test_rows_track_last_message_and_unread(self):
+        self.send(self.bob, self.alice, 'hi')
+        self.send(self.bob, self.alice, 'are you there?')
+        self.send(self.carol, self.alice, 'hello')
+        self.send(self.alice, self.carol, 'hey carol')
+        self.assertEqual(inbox.mark_read(self.alice.id, self.carol.id), 1)
+
+        self.assertEqual(self.inbox_state(), [
+            ('alice', 'bob', 'are you there?', 2),
+            ('alice', 'carol', 'hey carol', 0),
+            ('bob', 'alice', 'are you there?', 0),
+            ('carol', 'alice', 'hey carol', 1),
+        ])
+        maintained = self.inbox_state()
+        self.assertEqual(inbox.rebuild(), 4)
+        self.assertEqual(self.inbox_state(), maintained)
+
+    def test_messages_view_lists_inbox_newest_first(self):
+        self.send(self.bob, self.alice, 'hi')
+        self.send(self.carol, self.alice, 'hello')
+        self.client.login(username='alice', password='password123')
+        response = self.client.get(reverse('messages'))
+        conversations = list(response.context['conversations'])
+        self.assertEqual([c.other_user.username for c in conversations], ['carol', 'bob'])
+        self.assertContains(response, 'hello')
+
+
+class UserSearchTest(TestCase):
+    def setUp(self):
+        self.kim = User.objects.create_user(username='minsu_kim', name='김민수', password='password123', email='kim@example.com')
+        self.lee = User.objects.create_user(username='jlee', name='Minsu Lee', password='password123', email='lee@example.com')
+        User.objects.create_user(username='other', name='Other', password='password123', email='other@example.com')
+
+    def usernames(self, query):
+        return [user.username for user in search_users(query)]
+
+    def test_substring_matches_ranked_with_username_first(self):
+        self.assertEqual(self.usernames('minsu'), ['minsu_kim', 'jlee'])
+        self.assertEqual(self.usernames('nothing here'), [])
+
+    def test_short_queries_use_prefixes(self):
+        self.assertEqual(self.usernames('jl'), ['jlee'])
+        self.assertEqual(self.usernames('JL'), ['jlee'])
+        self.assertEqual(self.usernames('Mi'), ['minsu_kim', 'jlee'])
+        self.assertEqual(self.usernames('김민'), ['minsu_kim'])
+        # Infix matches need the trigram index, from three characters on.
+        self.assertEqual(self.usernames('민수'), [])
+        self.assertEqual(self.usernames('ee'), [])
+
+    def test_index_follows_profile_edits(self):
+        self.lee.name = 'Jisoo Lee'
+        self.lee.save()
+        self.assertEqual(self.usernames('jisoo'), ['jlee'])
+        self.assertEqual(self.usernames('minsu'), ['minsu_kim'])
+        self.kim.delete()
+        self.assertEqual(self.usernames('minsu'), [])
+
+    def test_autocomplete_endpoint(self):
+        response = self.client.get(reverse('search_autocomplete'), {'q': 'Lee'})
+        self.assertEqual(response.json()['results'], [{
+            'username': 'jlee', 'name': 'Minsu Lee', 'profile_picture': None, 'url': reverse('user_profile', args=['jlee']),
+        }])
+
+
+class UsernameFilterTest(TestCase):
+    def setUp(self):
+        username_filter.reset()
+        self.addCleanup(username_filter.reset)
+        User.objects.create_user(username='Taken', password='password123', email='taken@example.com')
+
+    def check(self, username):
+        return self.client.get(reverse('check_username'), {'username': username}).json()['is_taken']
+
+    def test_free_names_skip_the_database(self):
+        username_filter.warm()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.check('definitely-free'))
+        self.assertTrue(self.check('taken'))
+
+    def test_signup_adds_to_filter(self):
+        username_filter.warm()
+        self.client.post(reverse('signup'), {
+            'username': 'newcomer', 'name': 'New', 'email': 'new@example.com', 'phone_number': '010',
+            'password1': 'a-Strong-pass-123', 'password2': 'a-Strong-pass-123',
+        })
+        self.assertTrue(User.objects.filter(username='newcomer').exists())
+        self.assertTrue(username_filter.might_contain('NEWCOMER'))
+
+
+class ImageDerivativeTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = self.settings(MEDIA_ROOT=media_root, IMAGE_DERIVATIVE_WORKERS=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user(username='photographer', password='password123', email='photo@example.com')
+        self.client.login(username='photographer', password='password123')
+
+    def upload(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1500), 'teal').save(buffer, format='JPEG')
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_new_post_gets_derivatives_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('create'), {'image': self.upload(), 'caption': 'sunset'})
+        post = Post.objects.get()
+        # Until the derivatives exist, the original is served.
+        self.assertEqual(images.derivative_url(post, 'image', 'feed'), post.image.url)
+
+        for callback in callbacks:
+            callback()
+        post.refresh_from_db()
+        entry = post.derivatives['image']
+        self.assertEqual(entry['source'], post.image.name)
+        self.assertEqual(set(entry), {'source', 'thumb', 'feed', 'full'})
+        with Image.open(post.image.storage.path(entry['feed'])) as feed:
+            self.assertEqual((feed.format, feed.size), ('WEBP', (640, 480)))
+        self.assertEqual(images.derivative_url(post, 'image', 'feed'), post.image.storage.url(entry['feed']))
+
+    def test_renders_from_storages_without_paths(self):
+        storages = {
+            'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        }
+        with self.settings(STORAGES=storages), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('create'), {'image': self.upload(), 'caption': 'in memory'})
+        post = Post.objects.get()
+        self.assertEqual(set(post.derivatives['image']), {'source', 'thumb', 'feed', 'full'})
+
+    def test_pool_workers_do_not_load_django(self):
+        # Spawned workers unpickle main.image_render.render, importing only that module.
+        self.assertEqual(images.render.__module__, 'main.image_render')
+        loaded = subprocess.run(
+            [sys.executable, '-c', 'import sys, main.image_render; print(sorted({m.split(".")[0] for m in sys.modules}))'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        self.assertNotIn("'django'", loaded)
+
+    def test_backfill_renders_missing_derivatives(self):
+        post = Post.objects.create(user=self.user, image=self.upload(), caption='old')
+        with self.settings(IMAGE_DERIVATIVE_WORKERS=1):
+            self.assertEqual(images.backfill([post]), (1, 0))
+            self.assertEqual(images.backfill([Post.objects.get()]), (0, 0))
+
+
+class BlobStorageTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        overrides = self.settings(MEDIA_ROOT=self.media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user(username='uploader', password='password123', email='up@example.com')
+        self.client.login(username='uploader', password='password123')
+
+    def upload(self, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), color).save(buffer, format='PNG')
+        return SimpleUploadedFile('photo.PNG', buffer.getvalue(), content_type='image/png')
+
+    def test_duplicates_share_one_counted_blob(self):
+        self.client.post(reverse('create'), {'image': self.upload('red'), 'caption': 'first'})
+        self.client.post(reverse('create'), {'image': self.upload('red'), 'caption': 'repost'})
+        first, repost = Post.objects.order_by('id')
+        self.assertEqual(first.image.name, repost.image.name)
+        self.assertTrue(first.image.name.startswith('blobs/') and first.image.name.endswith('.png'))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+        self.client.get(reverse('delete_post', args=[first.id]))
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.client.post(reverse('edit_post', args=[repost.id]), {'image': self.upload('blue'), 'caption': 'new'})
+        red, blue = Blob.objects.order_by('id')
+        self.assertEqual((red.ref_count, blue.ref_count), (0, 1))
+
+        self.assertEqual(blobs.collect_garbage(grace_period=3600), (0, 0))
+        removed, freed = blobs.collect_garbage(grace_period=0)
+        self.assertEqual((removed, freed), (1, red.size))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, red.name)))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, blue.name)))
+        self.assertEqual(blobs.recount(), 0)
+
+
+class LikeToggleTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='password123', email='author@example.com')
+        self.fan = User.objects.create_user(username='fan', password='password123', email='fan@example.com')
+        self.post = Post.objects.create(user=self.author, caption='hot')
+
+    def test_toggle_notifies_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(likes.toggle_like(self.fan, self.post.id), (True, 1))
+            self.assertFalse(Notification.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Notification.objects.get().user, self.author)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(likes.toggle_like(self.fan, self.post.id), (False, 0))
+        self.assertEqual(callbacks, [])
+        self.assertFalse(Like.objects.exists())
+
+    def test_missing_post_is_404(self):
+        self.client.login(username='fan', password='password123')
+        response = self.client.get(reverse('like_post', kwargs={'post_id': self.post.id + 1}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Like.objects.exists())
+
+
+class AggregatedNotificationTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='password123', email='author@example.com')
+        self.fans = [
+            User.objects.create_user(username=f'fan{i}', password='password123', email=f'fan{i}@example.com')
+            for i in range(4)
+        ]
+        self.post = Post.objects.create(user=self.author, caption='hot')
+
+    def like(self, fan):
+        with self.captureOnCommitCallbacks(execute=True):
+            likes.toggle_like(fan, self.post.id)
+
+    def test_likes_fold_into_one_notification(self):
+        for fan in self.fans:
+            self.like(fan)
+        # Liking again (after an unlike) is not another person, even once
+        # the fan is no longer among the named recent actors.
+        self.like(self.fans[0])
+        self.like(self.fans[0])
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 4)
+        self.assertEqual(notification.recent_actors, ['fan0', 'fan3'])
+        self.assertEqual(notification.created_by, self.fans[0])
+
+        self.client.login(username='author', password='password123')
+        response = self.client.get(reverse('notifications'))
+        self.assertContains(response, '<strong>fan0, fan3</strong>')
+        self.assertContains(response, '님 외 2명이 회원님의 게시물을 좋아합니다.')
+
+    def test_authors_own_like_is_not_counted(self):
+        self.like(self.fans[0])
+        self.like(self.author)
+        self.like(self.fans[1])
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(notification.recent_actors, ['fan1', 'fan0'])
+
+    def test_window_is_anchored_on_first_like(self):
+        self.like(self.fans[0])
+        self.like(self.fans[1])
+        # Folding moved created_at, but the window still ends a full window after the first like.
+        Notification.objects.update(window_started_at=F('window_started_at') - timedelta(days=1))
+        self.like(self.fans[2])
+        self.assertEqual(list(Notification.objects.values_list('actor_count', flat=True)), [1, 2])
+
+    def test_seen_notification_becomes_unread_again(self):
+        notifications.record_like(self.author.id, self.fans[0], self.post.id)
+        unread.notifications_seen(self.author.id, Notification.objects.get().created_at)
+        self.assertEqual(unread.notification_count(self.author.id), 0)
+        self.assertTrue(notifications.record_like(self.author.id, self.fans[1], self.post.id))
+        cache.clear()
+        self.assertEqual(unread.notification_count(self.author.id), 1)
+
+
+class NotificationWatermarkTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='password123', email='author@example.com')
+        self.fan = User.objects.create_user(username='fan', password='password123', email='fan@example.com')
+        self.post = Post.objects.create(user=self.author, caption='hot')
+        for _ in range(3):
+            Notification.objects.create(user=self.author, created_by=self.fan, notification_type='comment', post=self.post)
+
+    @override_settings(NOTIFICATIONS_PAGE_SIZE=2)
+    def test_first_page_moves_watermark(self):
+        self.assertEqual(unread.notification_count(self.author.id), 3)
+        newest, middle, oldest = Notification.objects.order_by('-created_at', '-id')
+
+        self.client.login(username='author', password='password123')
+        response = self.client.get(reverse('notifications'))
+        self.assertEqual(list(response.context['notifications']), [newest, middle])
+        self.assertContains(response, 'class="notification-item unread"', count=2)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.last_seen_notification_at, newest.created_at)
+        cache.clear()
+        self.assertEqual(unread.notification_count(self.author.id), 0)
+
+        response = self.client.get(reverse('notifications'), {'cursor': response.context['next_cursor']})
+        self.assertEqual(list(response.context['notifications']), [oldest])
+        self.assertIsNone(response.context['next_cursor'])
+
+        Notification.objects.create(user=self.author, created_by=self.fan, notification_type='comment', post=self.post)
+        cache.clear()
+        self.assertEqual(unread.notification_count(self.author.id), 1)
+
+    def test_invalid_cursor(self):
+        self.client.login(username='author', password='password123')
+        response = self.client.get(reverse('notifications'), {'cursor': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RetentionTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password123', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', password='password123', email='bob@example.com')
+        self.old = timezone.now() - timedelta(days=400)
+
+    def _pages(self, size=3):
+        seen, cursor = [], None
+        while True:
+            page, cursor = history.conversation_page(self.alice.id, self.bob.id, cursor, size)
+            seen.extend(message.content for message in page)
+            if cursor is None:
+                return seen
+
+    def test_only_old_seen_notifications_are_deleted(self):
+        post = Post.objects.create(user=self.alice, caption='old')
+        for _ in range(3):
+            Notification.objects.create(user=self.alice, created_by=self.bob, notification_type='comment', post=post)
+        seen, unseen, recent = Notification.objects.order_by('id')
+        Notification.objects.filter(pk=seen.pk).update(created_at=self.old)
+        Notification.objects.filter(pk=unseen.pk).update(created_at=self.old + timedelta(days=1))
+        User.objects.filter(pk=self.alice.pk).update(last_seen_notification_at=self.old)
+
+        self.assertEqual(retention.prune_notifications(timedelta(days=90), batch_size=1, pause=0), 1)
+        self.assertQuerySetEqual(Notification.objects.order_by('id'), [unseen, recent])
+
+    def test_archived_messages_stay_in_history(self):
+        for i in range(9):
+            sender, receiver = (self.alice, self.bob) if i % 2 else (self.bob, self.alice)
+            Message.objects.create(
+                sender=sender, receiver=receiver, content=f'message {i}',
+                timestamp=self.old + timedelta(minutes=i), is_read=i != 4,
+            )
+        inbox.messages_saved(Message.objects.all())
+        before = self._pages()
+
+        archived = retention.archive_messages(timedelta(days=90), batch_size=2, pause=0, chunk_size=3)
+        self.assertEqual(archived, 7)
+        # The unread message and the inbox's last message stay in the table.
+        self.assertEqual(sorted(Message.objects.values_list('content', flat=True)), ['message 4', 'message 8'])
+        self.assertEqual(sum(MessageArchive.objects.values_list('message_count', flat=True)), 7)
+        self.assertTrue(all(count <= 3 for count in MessageArchive.objects.values_list('message_count', flat=True)))
+        self.assertEqual(self._pages(), before)
+        self.assertEqual(self._pages(size=2), before)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = replicas.ReplicaRouter()
+        self.user = User(pk=1, username='alice')
+
+    def _request(self, method='get', **cookies):
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies)
+        request.user = self.user
+        return request
+
+    def _record(self, write=False):
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(Post))
+            if write:
+                self.router.db_for_write(Post)
+                reads.append(self.router.db_for_read(Post))
+            return HttpResponse()
+
+        return replicas.ReplicaPinningMiddleware(view), reads
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_writes_pin_the_user_to_the_primary(self):
+        middleware, reads = self._record(write=True)
+        response = middleware(self._request())
+        self.assertEqual(reads, ['replica1', 'default'])
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+
+        # The next page, even without the cookie (e.g. after a chat message).
+        middleware, reads = self._record()
+        response = middleware(self._request())
+        self.assertEqual(reads, ['default'])
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+        cache.clear()
+        middleware(self._request(**{replicas.PIN_COOKIE: '1'}))
+        middleware(self._request(method='post'))
+        middleware(self._request())
+        self.assertEqual(reads, ['default', 'default', 'default', 'replica1'])
+
+
+class AsyncViewsTest(TestCase):
+    use_async_views = True
+    view_module = async_views
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # main.urls picks the view module when it is imported (and the root
+        # URLconf's include() keeps the patterns it first saw).
+        cls.addClassCleanup(cls.reload_urls)
+        cls.enterClassContext(override_settings(ASYNC_VIEWS=cls.use_async_views))
+        cls.reload_urls()
+
+    @staticmethod
+    def reload_urls():
+        importlib.reload(main_urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='password123', email='alice@example.com')
+        self.bob = User.objects.create_user(username='bob', password='password123', email='bob@example.com')
+        Follow.objects.create(from_user=self.alice, to_user=self.bob)
+        self.post = Post.objects.create(user=self.bob, image='posts/test.jpg', caption='async')
+        timeline.fan_out_post(self.post)
+        Comment.objects.create(user=self.alice, post=self.post, text='first')
+        Comment.objects.create(user=self.bob, post=self.post, text='second')
+        message = Message.objects.create(sender=self.bob, receiver=self.alice, content='hi')
+        inbox.messages_saved([message])
+        self.client.login(username='alice', password='password123')
+
+    def test_hot_pages_render_without_lazy_queries(self):
+        self.assertIs(resolve(reverse('index')).func, self.view_module.index)
+        # A query from a template would raise SynchronousOnlyOperation here.
+        for url in (reverse('index'), reverse('index') + '?tab=all', reverse('user_profile', args=['bob']), reverse('messages')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+        self.assertContains(self.client.get(reverse('index')), 'async')
+        self.assertContains(self.client.get(reverse('messages')), 'hi')
+        self.assertEqual(self.client.get(reverse('user_profile', args=['nobody'])).status_code, 404)
+
+    def test_like_and_comment(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('like_post', kwargs={'post_id': self.post.id}))
+        self.assertEqual(response.json(), {'likes_count': 1, 'liked': True})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_comment', kwargs={'post_id': self.post.id}), {'text': 'third'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(
+            sorted(Notification.objects.filter(user=self.bob).values_list('notification_type', flat=True)),
+            ['comment', 'like'],
+        )
+        self.assertEqual(unread.notification_count(self.bob.id), 2)
+
+    def test_comment_is_written_in_one_transaction(self):
+        with mock.patch.object(Notification.objects, 'create', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.client.post(reverse('add_comment', kwargs={'post_id': self.post.id}), {'text': 'lost'})
+        self.assertFalse(Comment.objects.filter(text='lost').exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+
+
+class SyncViewsTest(AsyncViewsTest):
+    """The same pages with ASYNC_VIEWS=0, which serves them from main.views."""
+    use_async_views = False
+    view_module = views
+
+
+class PostCardCacheTest(TestCase):
+    LIKED_ICON = 'img/clicklike.png" alt'
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='password123', email='author@example.com')
+        self.fan = User.objects.create_user(username='fan', password='password123', email='fan@example.com')
+        self.post = Post.objects.create(user=self.author, image='posts/test.jpg', caption='cached')
+
+    def get_feed(self, username):
+        self.client.login(username=username, password='password123')
+        return self.client.get(reverse('index'), {'tab': 'all'})
+
+    def test_fragment_is_reused_until_the_post_changes(self):
+        self.get_feed('fan')
+        # A write that does not bump the version is not seen through the cache.
+        Post.objects.filter(pk=self.post.pk).update(caption='stale')
+        self.assertContains(self.get_feed('fan'), 'cached')
+
+        self.client.get(reverse('like_post', kwargs={'post_id': self.post.id}))
+        response = self.get_feed('fan')
+        self.assertContains(response, 'stale')
+        self.assertContains(response, '1 likes')
+        self.assertContains(response, self.LIKED_ICON)
+
+        self.client.post(reverse('add_comment', kwargs={'post_id': self.post.id}), {'text': 'hello'})
+        self.assertContains(self.get_feed('fan'), 'class="time-ago"')
+
+        self.get_feed('author')
+        self.client.post(reverse('edit_post', kwargs={'post_id': self.post.id}), {'caption': 'edited'})
+        self.assertContains(self.get_feed('fan'), 'edited')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 4)
+
+    def test_edit_keeps_counts_that_moved_since_the_post_was_read(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        likes.toggle_like(self.fan, self.post.id)
+        self.client.login(username='author', password='password123')
+        with mock.patch('main.views.get_object_or_404', return_value=stale):
+            self.client.post(reverse('edit_post', kwargs={'post_id': self.post.id}), {'caption': 'edited'})
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.caption, self.post.like_count, self.post.version), ('edited', 1, 3))
+
+    def test_viewer_state_stays_outside_the_fragment(self):
+        self.client.login(username='fan', password='password123')
+        self.client.get(reverse('like_post', kwargs={'post_id': self.post.id}))
+        self.assertContains(self.get_feed('fan'), self.LIKED_ICON)
+
+        response = self.get_feed('author')
+        self.assertNotContains(response, self.LIKED_ICON)
+        self.assertContains(response, 'class="post-options-btn"')
+        self.assertNotContains(self.get_feed('fan'), 'class="post-options-btn"')
+
+
+class AnonymousPageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='password123', email='author@example.com', name='Author')
+        self.post = Post.objects.create(user=self.author, image='posts/test.jpg', caption='first')
+
+    def test_feed_is_served_from_cache_until_a_post_changes(self):
+        self.client.get(reverse('index'))  # starts the generations
+        response = self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('index'))
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertIn('Last-Modified', cached)
+
+        not_modified = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=cached['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(user=self.author, image='posts/test.jpg', caption='second')
+        self.assertContains(self.client.get(reverse('index')), 'second')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            likes.toggle_like(self.author, self.post.id)
+        self.assertContains(self.client.get(reverse('index')), '1 likes')
+
+    def test_bump_invalidates_cached_page(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        # QuerySet.update() sends no signals; the caller bumps the generation.
+        Post.objects.update(caption='edited', version=F('version') + 1)
+        self.assertContains(self.client.get(reverse('index')), 'first')
+        page_cache.bump(page_cache.FEED)
+        self.assertContains(self.client.get(reverse('index')), 'edited')
+
+    def test_key_ignores_parameters_the_view_does_not_read(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('index'), {'utm_source': 'mail', 'tab': 'all'})
+
+        self.client.get(reverse('search'), {'q': 'auth'})
+        with self.assertNumQueries(0):
+            self.client.get(reverse('search'), {'ref': 'nav', 'q': 'auth'})
+        self.assertNotContains(self.client.get(reverse('search'), {'q': 'nobody'}), 'Author')
+
+    def test_search_follows_profile_edits(self):
+        self.client.get(reverse('search'), {'q': 'auth'})
+        self.assertContains(self.client.get(reverse('search'), {'q': 'auth'}), 'Author')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.name = 'Renamed'
+            self.author.save()
+        self.assertContains(self.client.get(reverse('search'), {'q': 'auth'}), 'Renamed')
+
+        # Logging in only touches last_login.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.login(username='author', password='password123')
+        self.client.logout()
+        with self.assertNumQueries(0):
+            self.client.get(reverse('search'), {'q': 'auth'})
+
+    def test_signed_in_users_are_not_served_the_cached_page(self):
+        self.client.get(reverse('index'), {'tab': 'all'})
+        self.client.get(reverse('index'), {'tab': 'all'})
+        self.client.login(username='author', password='password123')
+        self.assertContains(self.client.get(reverse('index'), {'tab': 'all'}), 'comment-form')
+
+
+class FollowSuggestionTest(TestCase):
+    def setUp(self):
+        graph.follow_index.reset()
+        self.addCleanup(graph.follow_index.reset)
+        self.users = {
+            name: User.objects.create_user(username=name, password='password123', email=f'{name}@example.com')
+            for name in ('ann', 'ben', 'cat', 'dan', 'eve')
+        }
+        for from_user, to_user in [('ann', 'ben'), ('ann', 'cat'), ('ben', 'dan'), ('cat', 'dan'), ('cat', 'eve'), ('eve', 'ann')]:
+            Follow.objects.create(from_user=self.users[from_user], to_user=self.users[to_user])
+        self.client.login(username='ann', password='password123')
+
+    def ids(self, *names):
+        return [self.users[name].pk for name in names]
+
+    def test_graph_is_loaded_as_csr(self):
+        follow_graph = graph.FollowGraph.load()
+        self.assertEqual(list(follow_graph.ids), sorted(user.pk for user in self.users.values()))
+        self.assertEqual(len(follow_graph.targets), 6)
+        self.assertEqual(follow_graph.following(self.users['cat'].pk), set(self.ids('dan', 'eve')))
+        self.assertEqual(follow_graph.following(self.users['dan'].pk), set())
+
+    def test_suggestions_are_ranked_by_mutual_follows(self):
+        self.assertEqual(
+            graph.follow_index.suggestions(self.users['ann'].pk, 5),
+            [(self.users['dan'].pk, 2), (self.users['eve'].pk, 1)],
+        )
+        response = self.client.get(reverse('suggestions'))
+        self.assertEqual(
+            [(result['username'], result['mutual_count']) for result in response.json()['results']],
+            [('dan', 2), ('eve', 1)],
+        )
+        self.assertContains(self.client.get(reverse('index')), 'data-username="dan"')
+
+    def test_scoring_reads_a_copy_of_the_overlay(self):
+        follow_graph = graph.FollowGraph.load()
+        follow_graph.follow_changed(self.users['ben'].pk, self.users['eve'].pk, True)
+        prepared = follow_graph.prepare_suggestions(self.users['ann'].pk)
+        # Changes recorded once the lock is released do not reach a query already scoring.
+        follow_graph.follow_changed(self.users['ben'].pk, self.users['eve'].pk, False)
+        follow_graph.follow_changed(self.users['cat'].pk, self.users['dan'].pk, False)
+        self.assertEqual(follow_graph.score(prepared, 5), [(self.users['dan'].pk, 2), (self.users['eve'].pk, 2)])
+
+    def test_follow_toggle_updates_the_graph(self):
+        graph.follow_index.warm()
+        self.client.post(reverse('follow_toggle', args=['dan']))
+        self.assertEqual(graph.follow_index.suggestions(self.users['ann'].pk, 5), [(self.users['eve'].pk, 1)])
+        self.client.post(reverse('follow_toggle', args=['cat']))
+        self.assertEqual(graph.follow_index.suggestions(self.users['ann'].pk, 5), [])
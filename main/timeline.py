@@ -0,0 +1,108 @@
+"""
+Materialized following feeds.
+
+Posts are copied into a TimelineEntry row per follower when they are created
+(fan-out on write), so reading a feed is a single indexed range scan no matter
+how many accounts the viewer follows. Accounts with more than
+TIMELINE_FANOUT_LIMIT followers are switched to fan-out on read: their posts
+are not copied, and are merged into each follower's page when it is read.
+"""
+from django.conf import settings
+
+from .models import Follow, Post, TimelineEntry, User
+from .pagination import akeyset_page, encode_cursor, keyset_page
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def _update_fan_out_mode(author):
+    """Flag `author` for fan-out on read once they cross the follower limit."""
+    if not author.fan_out_on_read and author.follower_count > settings.TIMELINE_FANOUT_LIMIT:
+        author.fan_out_on_read = True
+        User.objects.filter(pk=author.pk).update(fan_out_on_read=True)
+    return author.fan_out_on_read
+
+
+def _insert_entries(user_ids, posts):
+    entries = (
+        TimelineEntry(user_id=user_id, post_id=post.id, created_at=post.created_at)
+        for user_id in user_ids
+        for post in posts
+    )
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= FANOUT_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    """Copy a new post into its author's timeline and those of their followers."""
+    user_ids = [post.user_id]
+    if not _update_fan_out_mode(post.user):
+        user_ids += Follow.objects.filter(to_user_id=post.user_id).values_list('from_user_id', flat=True)
+    _insert_entries(user_ids, [post])
+
+
+def follow_author(follower, author):
+    """Backfill the most recent posts of a newly followed author."""
+    if author.fan_out_on_read:
+        return
+    posts = Post.objects.filter(user=author).order_by('-created_at', '-id')[:settings.TIMELINE_BACKFILL_SIZE]
+    _insert_entries([follower.pk], list(posts.only('id', 'created_at')))
+
+
+def unfollow_author(follower, author):
+    """Remove an unfollowed author's posts from the follower's timeline."""
+    TimelineEntry.objects.filter(user=follower, post__user=author).delete()
+
+
+def _timeline_sources(user):
+    entries = TimelineEntry.objects.filter(user=user).only('created_at', 'post_id')
+    on_read_authors = User.objects.filter(followers__from_user=user, fan_out_on_read=True)
+    on_read_posts = Post.objects.filter(user__in=on_read_authors).only('id', 'created_at')
+    return entries, on_read_posts
+
+
+def _merge_timeline(entries_page, on_read_page, size):
+    (entries, entries_cursor), (on_read_posts, on_read_cursor) = entries_page, on_read_page
+    candidates = {entry.post_id: entry.created_at for entry in entries}
+    for post in on_read_posts:
+        candidates[post.id] = post.created_at
+    has_more = entries_cursor is not None or on_read_cursor is not None
+
+    ordered = sorted(candidates.items(), key=lambda item: (item[1], item[0]), reverse=True)
+    page = ordered[:size]
+    next_cursor = None
+    if page and (has_more or len(ordered) > size):
+        last_id, last_created_at = page[-1]
+        next_cursor = encode_cursor(last_created_at, last_id)
+    return [post_id for post_id, _ in page], next_cursor
+
+
+def home_timeline_page(user, cursor, size):
+    """
+    Return (post_ids, next_cursor) for one page of `user`'s following feed.
+
+    Materialized entries and posts from followed fan-out-on-read accounts are
+    each paged with the same (created_at, id) cursor and merged newest first.
+    """
+    entries, on_read_posts = _timeline_sources(user)
+    return _merge_timeline(
+        keyset_page(entries, cursor, size, id_field='post_id'),
+        keyset_page(on_read_posts, cursor, size),
+        size,
+    )
+
+
+async def ahome_timeline_page(user, cursor, size):
+    """home_timeline_page() for async views."""
+    entries, on_read_posts = _timeline_sources(user)
+    return _merge_timeline(
+        await akeyset_page(entries, cursor, size, id_field='post_id'),
+        await akeyset_page(on_read_posts, cursor, size),
+        size,
+    )
@@ -0,0 +1,125 @@
+"""
+Per-user unread message and notification counters kept in the cache.
+
+Badges are read on every page render, so the counts live in the cache and are
+adjusted by the write paths (new message, new notification, messages read,
+notifications page visited). A missing key is recomputed from the database
+on the next read; when an increment finds no key it is simply skipped, since
+that recompute will include it.
+
+A notification is unread if it was created after the user's
+last_seen_notification_at watermark, so visiting the notifications page
+moves one timestamp instead of rewriting a flag on every row.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import Message, Notification, User
+
+NOTIFICATIONS = 'notifications'
+MESSAGES = 'messages'
+
+
+def last_seen_notification_at(user_id):
+    return User.objects.filter(pk=user_id).values_list('last_seen_notification_at', flat=True).first()
+
+
+def _count_unread_notifications(user_id):
+    notifications = Notification.objects.filter(user_id=user_id)
+    last_seen = last_seen_notification_at(user_id)
+    if last_seen is not None:
+        notifications = notifications.filter(created_at__gt=last_seen)
+    return notifications.count()
+
+
+_COUNT_QUERIES = {
+    NOTIFICATIONS: _count_unread_notifications,
+    MESSAGES: lambda user_id: Message.objects.filter(receiver_id=user_id, is_read=False).count(),
+}
+
+
+def _key(kind, user_id):
+    return f'unread:{kind}:{user_id}'
+
+
+def get_count(kind, user_id):
+    key = _key(kind, user_id)
+    count = cache.get(key)
+    if count is None or count < 0:
+        count = _COUNT_QUERIES[kind](user_id)
+        cache.set(key, count, settings.UNREAD_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def adjust(kind, user_id, delta):
+    try:
+        cache.incr(_key(kind, user_id), delta)
+    except ValueError:
+        # Not cached; the next read recomputes it.
+        pass
+
+
+async def aget_count(kind, user_id):
+    count = await cache.aget(_key(kind, user_id))
+    if count is None or count < 0:
+        count = await sync_to_async(get_count)(kind, user_id)
+    return count
+
+
+async def aadjust(kind, user_id, delta):
+    try:
+        await cache.aincr(_key(kind, user_id), delta)
+    except ValueError:
+        pass
+
+
+def reset(kind, user_id):
+    cache.set(_key(kind, user_id), 0, settings.UNREAD_COUNT_CACHE_TIMEOUT)
+
+
+def notification_count(user_id):
+    return get_count(NOTIFICATIONS, user_id)
+
+
+def message_count(user_id):
+    return get_count(MESSAGES, user_id)
+
+
+def notification_created(user_id):
+    adjust(NOTIFICATIONS, user_id, 1)
+
+
+def notifications_seen(user_id, newest):
+    """Mark everything up to `newest` (the newest notification shown) as read."""
+    if newest is not None:
+        User.objects.filter(pk=user_id).filter(
+            Q(last_seen_notification_at__isnull=True) | Q(last_seen_notification_at__lt=newest)
+        ).update(last_seen_notification_at=newest)
+    reset(NOTIFICATIONS, user_id)
+
+
+def message_received(user_id):
+    adjust(MESSAGES, user_id, 1)
+
+
+async def anotification_count(user_id):
+    return await aget_count(NOTIFICATIONS, user_id)
+
+
+async def anotification_created(user_id):
+    await aadjust(NOTIFICATIONS, user_id, 1)
+
+
+async def amessage_count(user_id):
+    return await aget_count(MESSAGES, user_id)
+
+
+async def amessage_received(user_id):
+    await aadjust(MESSAGES, user_id, 1)
+
+
+def messages_read(user_id, count):
+    if count:
+        adjust(MESSAGES, user_id, -count)
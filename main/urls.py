@@ -1,12 +1,20 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# The hot read pages and like/comment have async versions (main.async_views).
+hot = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     # --- Common URLs ---
-    path('', views.index, name='index'),
+    path('', hot.index, name='index'),
+    path('feed/', views.feed, name='feed'),
     path('search/', views.search, name='search'),
-    path('messages/', views.messages_view, name='messages'),
+    path('search/autocomplete/', views.search_autocomplete, name='search_autocomplete'),
+    path('suggestions/', views.suggestions, name='suggestions'),
+    path('messages/', hot.messages_view, name='messages'),
     path('messages/<str:username>/', views.conversation, name='conversation'),
+    path('messages/<str:username>/history/', views.conversation_history, name='conversation_history'),
     path('notifications/', views.notifications, name='notifications'),
     path('create/', views.create, name='create'),
     
@@ -20,14 +28,15 @@ urlpatterns = [
     # --- Post and Profile URLs ---
     path('post/<int:post_id>/edit/', views.edit_post, name='edit_post'),
     path('post/<int:post_id>/delete/', views.delete_post, name='delete_post'),
-    path('post/<int:post_id>/comment/', views.add_comment, name='add_comment'),
-    path('post/<int:post_id>/like/', views.like_post, name='like_post'),
+    path('post/<int:post_id>/comment/', hot.add_comment, name='add_comment'),
+    path('post/<int:post_id>/comments/', views.post_comments, name='post_comments'),
+    path('post/<int:post_id>/like/', hot.like_post, name='like_post'),
     
     # --- Profile URLs (order is important) ---
     path('profile/edit/', views.edit_profile, name='edit_profile'),
     path('profile/<str:username>/replies/', views.user_replies, name='user_replies'),
     path('profile/<str:username>/likes/', views.user_likes, name='user_likes'),
-    path('profile/<str:username>/', views.user_profile, name='user_profile'),
+    path('profile/<str:username>/', hot.user_profile, name='user_profile'),
     path('profile/<str:username>/follow/', views.follow_toggle, name='follow_toggle'),
     path('profile/', views.profile, name='profile'), 
 ]
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Process-local Bloom filter of taken usernames for the signup availability check.
+
+check_username runs on every keystroke in the signup form. Usernames are
+casefolded and added to a Bloom filter that is built on first use (or at
+startup, see my_project/asgi.py), so a name the filter has never seen is
+reported as free without a query. A possible hit is still confirmed with
+`username__iexact`, so false positives cost one query and never give a wrong
+answer.
+
+Signups in this process are added straight away. Accounts created elsewhere
+(another worker, the admin, createsuperuser) are picked up by a cheap
+primary-key range query at most once every USERNAME_FILTER_REFRESH_INTERVAL
+seconds. Deleted names cannot be removed from a Bloom filter. They stay as
+false positives until the filter is rebuilt, which happens once it holds
+more names than it was sized for.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+MIN_CAPACITY = 1024
+LOAD_BATCH_SIZE = 5000
+
+
+class BloomFilter:
+    def __init__(self, capacity, false_positive_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        # Double hashing: k positions from two 64-bit halves of one digest.
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class UsernameFilter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._max_id = 0
+        self._refreshed_at = 0.0
+
+    @staticmethod
+    def _normalize(username):
+        return username.casefold()
+
+    def _build(self):
+        total = User.objects.count()
+        bloom = BloomFilter(max(MIN_CAPACITY, total * 2), settings.USERNAME_FILTER_FALSE_POSITIVE_RATE)
+        max_id = 0
+        rows = User.objects.order_by('pk').values_list('pk', 'username')
+        for pk, username in rows.iterator(chunk_size=LOAD_BATCH_SIZE):
+            bloom.add(self._normalize(username))
+            max_id = pk
+        self._bloom, self._max_id = bloom, max_id
+        self._refreshed_at = time.monotonic()
+
+    def _refresh(self):
+        new = list(User.objects.filter(pk__gt=self._max_id).order_by('pk').values_list('pk', 'username'))
+        for pk, username in new:
+            self._bloom.add(self._normalize(username))
+            self._max_id = pk
+        self._refreshed_at = time.monotonic()
+        if self._bloom.count > self._bloom.capacity:
+            self._build()
+
+    def warm(self):
+        """Build the filter now rather than on the first check."""
+        with self._lock:
+            if self._bloom is None:
+                self._build()
+
+    def warm_in_background(self):
+        def run():
+            try:
+                self.warm()
+            except Exception:
+                # Not fatal: the first check builds it instead.
+                logger.exception('Could not warm the username filter')
+        threading.Thread(target=run, name='username-filter-warm', daemon=True).start()
+
+    def add(self, username):
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(self._normalize(username))
+
+    def might_contain(self, username):
+        """False means the username is definitely free; True means ask the database."""
+        with self._lock:
+            if self._bloom is None:
+                self._build()
+            elif time.monotonic() - self._refreshed_at > settings.USERNAME_FILTER_REFRESH_INTERVAL:
+                self._refresh()
+            return self._normalize(username) in self._bloom
+
+    def reset(self):
+        with self._lock:
+            self._bloom = None
+            self._max_id = 0
+
+
+username_filter = UsernameFilter()
+
+
+def is_taken(username):
+    if not username:
+        return False
+    if not username_filter.might_contain(username):
+        return False
+    return User.objects.filter(username__iexact=username).exists()
@@ -0,0 +1,97 @@
+"""
+Process-wide username -> user id cache.
+
+Profile, follow and conversation URLs, and the chat socket route, all carry a
+username. Resolving it once and reusing the id turns later lookups into
+primary key (or purely id-based) queries. Only hits are cached, so a name
+that is registered after a failed lookup resolves normally next time.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import Http404
+
+User = get_user_model()
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def user_id_for(username):
+    """Return the id of the user called `username`. Raises User.DoesNotExist."""
+    with _lock:
+        if username in _cache:
+            _cache.move_to_end(username)
+            return _cache[username]
+
+    user_id = User.objects.values_list('pk', flat=True).get(username=username)
+
+    with _lock:
+        _cache[username] = user_id
+        if len(_cache) > settings.USERNAME_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return user_id
+
+
+async def auser_id_for(username):
+    """user_id_for() for async views."""
+    with _lock:
+        if username in _cache:
+            _cache.move_to_end(username)
+            return _cache[username]
+
+    user_id = await User.objects.values_list('pk', flat=True).aget(username=username)
+
+    with _lock:
+        _cache[username] = user_id
+        if len(_cache) > settings.USERNAME_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return user_id
+
+
+def forget(username):
+    with _lock:
+        _cache.pop(username, None)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def get_user_id_or_404(username):
+    try:
+        return user_id_for(username)
+    except User.DoesNotExist:
+        raise Http404('No user matches the given query.')
+
+
+def get_user_or_404(username, queryset=None):
+    """Like get_object_or_404(User, username=...), but looked up by cached id."""
+    queryset = queryset if queryset is not None else User.objects.all()
+    try:
+        return queryset.get(pk=get_user_id_or_404(username))
+    except User.DoesNotExist:
+        # The cached account was deleted; the name may belong to someone new.
+        forget(username)
+    try:
+        return queryset.get(pk=user_id_for(username))
+    except User.DoesNotExist:
+        raise Http404('No user matches the given query.')
+
+
+async def aget_user_or_404(username, queryset=None):
+    """get_user_or_404() for async views."""
+    queryset = queryset if queryset is not None else User.objects.all()
+    for _ in range(2):
+        try:
+            user_id = await auser_id_for(username)
+        except User.DoesNotExist:
+            break
+        try:
+            return await queryset.aget(pk=user_id)
+        except User.DoesNotExist:
+            forget(username)
+    raise Http404('No user matches the given query.')
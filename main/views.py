@@ -1,5 +1,6 @@
 # Django-related imports
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
 from django.contrib.auth import login, logout, authenticate, get_user_model
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.decorators import login_required
@@ -7,18 +8,22 @@ from django.contrib.auth.tokens import default_token_generator
 from django.contrib import messages
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.mail import EmailMessage
-from django.http import JsonResponse
-from django.db.models import Exists, OuterRef, Q, Max, Subquery, Count
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.db.models import F, Max
 import json
 from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
 # Local application imports
 from .forms import CustomUserCreationForm, PostForm, ProfileEditForm
 from .models import Post, Comment, Like, Notification, Follow, Message, Room
+from .pagination import keyset_page
+from .comments import add_comment as save_comment
+from .search import search_users
+from . import counters, feed as feeds, graph, history, images, inbox, likes, page_cache, timeline, unread, username_filter
+from .usernames import get_user_id_or_404, get_user_or_404
 
 # Get the User model
 User = get_user_model()
@@ -27,45 +32,68 @@ def check_username(request):
     """Check if a username is already taken (for AJAX request)."""
     username = request.GET.get('username', None)
     data = {
-        'is_taken': User.objects.filter(username__iexact=username).exists()
+        'is_taken': username_filter.is_taken(username)
     }
     return JsonResponse(data)
 
-def index(request):
-    posts = Post.objects.select_related('user').all().order_by('-created_at')
-    stories = []
-    posts = Post.objects.select_related('user').prefetch_related('comments', 'likes').all().order_by('-created_at')
+def _feed_page(request, cursor=None):
+    """One page of the home feed, newest first, keyed on (created_at, id)."""
+    posts = feeds.feed_posts(request.user)
+
+    if feeds.feed_tab(request) == 'following':
+        post_ids, next_cursor = timeline.home_timeline_page(request.user, cursor, settings.FEED_PAGE_SIZE)
+        posts_by_id = posts.in_bulk(post_ids)
+        return [posts_by_id[pk] for pk in post_ids if pk in posts_by_id], next_cursor
 
-    posts = Post.objects.select_related('user').prefetch_related('comments', 'likes').all().order_by('-created_at')
+    return keyset_page(posts, cursor, settings.FEED_PAGE_SIZE)
+
+@page_cache.anonymous_page_cache(page_cache.FEED, page_cache.USERS)
+def index(request):
+    posts, next_cursor = _feed_page(request)
     stories = []
+    suggestions = []
 
     if request.user.is_authenticated:
-        user_likes = Like.objects.filter(
-            post=OuterRef('pk'),
-            user=request.user
-        )
-        posts = posts.annotate(user_has_liked=Exists(user_likes))
-        
-        # Get users the current user is following
-        following_users = User.objects.filter(followers__from_user=request.user)
-        
-        # Add the current user to the stories for debugging
-        stories = list(following_users)
-        if request.user not in stories:
-            stories.insert(0, request.user)
+        suggestions = graph.suggested_users(request.user, settings.SUGGESTIONS_LIMIT)
+        stories = feeds.stories(request.user, feeds.following_users(request.user))
 
     context = {
         'posts': posts,
-        'stories': stories
+        'next_cursor': next_cursor,
+        'feed_tab': feeds.feed_tab(request),
+        'stories': stories,
+        'suggestions': suggestions,
     }
     return render(request, 'main/index.html', context)
 
+def feed(request):
+    """Return the next page of the home feed for infinite scroll (AJAX)."""
+    try:
+        posts, next_cursor = _feed_page(request, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    html = render_to_string('main/partials/post_list.html', {'posts': posts}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
+def post_comments(request, post_id):
+    """Return a page of a post's comments, newest first, for the "view all comments" link (AJAX)."""
+    comments = Comment.objects.filter(post_id=post_id).select_related('user')
+    try:
+        comments, next_cursor = keyset_page(comments, request.GET.get('cursor'), settings.COMMENTS_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    html = render_to_string('main/partials/comment_list.html', {'comments': comments}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
 def signup_view(request):
     """Handle user signup."""
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST)
         if form.is_valid():
             user = form.save()
+            username_filter.username_filter.add(user.username)
             login(request, user) # Log in after signup
             username = form.cleaned_data.get('username')
             messages.success(request, f'Account created for {username}')
@@ -84,7 +112,7 @@ def activate(request, uidb64, token):
 
     if user is not None and default_token_generator.check_token(user, token):
         user.is_active = True
-        user.save()
+        user.save(update_fields=['is_active'])
         login(request, user)
         return redirect('index')
     else:
@@ -107,87 +135,74 @@ def logout_view(request):
     logout(request)
     return redirect('index')
 
+@page_cache.anonymous_page_cache(page_cache.USERS, params=('q',))
 def search(request):
     query = request.GET.get('q')
-    if query:
-        users = User.objects.filter(
-            Q(username__icontains=query) | Q(name__icontains=query)
-        )
-    else:
-        users = User.objects.none()
+    users = search_users(query)
     context = {
         'query': query,
         'users': users
     }
     return render(request, 'main/search.html', context)
 
-@login_required
-def messages_view(request):
-    user = request.user
-
-    # Get all users the current user has had a conversation with
-    participants = User.objects.filter(
-        Q(sent_messages__receiver=user) | Q(received_messages__sender=user)
-    ).distinct().exclude(pk=user.pk)
-
-    # Subquery to get the last message content for each conversation
-    last_message_content_subquery = Message.objects.filter(
-        (Q(sender=user, receiver=OuterRef('pk')) | Q(sender=OuterRef('pk'), receiver=user))
-    ).order_by('-timestamp').values('content')[:1]
-
-    # Subquery to get the last message timestamp for each conversation
-    last_message_ts_subquery = Message.objects.filter(
-        (Q(sender=user, receiver=OuterRef('pk')) | Q(sender=OuterRef('pk'), receiver=user))
-    ).order_by('-timestamp').values('timestamp')[:1]
-    
-    # Subquery to get the last message sender for each conversation
-    last_message_sender_subquery = Message.objects.filter(
-        (Q(sender=user, receiver=OuterRef('pk')) | Q(sender=OuterRef('pk'), receiver=user))
-    ).order_by('-timestamp').values('sender__username')[:1]
-
-    # Subquery to get the count of unread messages from each user
-    unread_count_subquery = Message.objects.filter(
-        sender=OuterRef('pk'), receiver=user, is_read=False
-    ).values('pk').annotate(count=Count('pk')).values('count')
-
-    # Annotate the participants with the last message details and unread count
-    conversations = participants.annotate(
-        last_message_content=Subquery(last_message_content_subquery),
-        last_message_ts=Subquery(last_message_ts_subquery),
-        last_message_sender=Subquery(last_message_sender_subquery),
-        unread_count=Subquery(unread_count_subquery)
-    ).order_by('-last_message_ts')
-    
-    # The template needs to be adjusted to handle the annotated fields.
-    # I will create a list of dictionaries to pass to the template
-    # to maintain a similar structure to what was there before.
-    
-    conversation_list = []
-    for p in conversations:
-        conversation_list.append({
-            'other_user': p,
-            'last_message': {
-                'content': p.last_message_content,
-                'timestamp': p.last_message_ts,
-                'sender': {'username': p.last_message_sender}
-            },
-            'unread_count': p.unread_count if p.unread_count else 0
-        })
+def search_autocomplete(request):
+    """Return the top matches for the search box as the user types (AJAX)."""
+    users = search_users(
+        request.GET.get('q'),
+        limit=settings.SEARCH_AUTOCOMPLETE_LIMIT,
+        queryset=User.objects.only('id', 'username', 'name', 'profile_picture'),
+    )
+    return JsonResponse({'results': [
+        {
+            'username': user.username,
+            'name': user.name,
+            'profile_picture': user.profile_picture.url if user.profile_picture else None,
+            'url': reverse('user_profile', args=[user.username]),
+        }
+        for user in users
+    ]})
 
-    # Get users the current user is following for the "New Message" modal
-    following_users = User.objects.filter(followers__from_user=user)
+@login_required
+def suggestions(request):
+    """Accounts followed by the people the user follows, most mutual follows first (AJAX)."""
+    users = graph.suggested_users(request.user, settings.SUGGESTIONS_PAGE_SIZE)
+    return JsonResponse({'results': [
+        {
+            'username': user.username,
+            'name': user.name,
+            'profile_picture': images.derivative_url(user, 'profile_picture', 'thumb') or None,
+            'url': reverse('user_profile', args=[user.username]),
+            'mutual_count': user.mutual_count,
+        }
+        for user in users
+    ]})
 
+@login_required
+def messages_view(request):
     context = {
-        'conversations': conversation_list,
-        'following_users': following_users
+        'conversations': feeds.conversations(request.user),
+        # For the "New Message" modal
+        'following_users': feeds.following_users(request.user),
     }
     return render(request, 'main/messages.html', context)
 
 @login_required
 def notifications(request):
-    notifications = request.user.notifications.all()
-    notifications.update(is_read=True)
-    return render(request, 'main/notifications.html', {'notifications': notifications})
+    cursor = request.GET.get('cursor')
+    notifications = request.user.notifications.select_related('created_by', 'post', 'comment')
+    try:
+        notifications, next_cursor = keyset_page(notifications, cursor, settings.NOTIFICATIONS_PAGE_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    last_seen = request.user.last_seen_notification_at
+    if not cursor:
+        # Opening the page reads everything up to the newest notification on it.
+        unread.notifications_seen(request.user.id, notifications[0].created_at if notifications else None)
+    return render(request, 'main/notifications.html', {
+        'notifications': notifications,
+        'next_cursor': next_cursor,
+        'last_seen': last_seen,
+    })
 
 @login_required
 def create(request):
@@ -197,6 +212,8 @@ def create(request):
             post = form.save(commit=False)
             post.user = request.user
             post.save()
+            timeline.fan_out_post(post)
+            images.generate_derivatives(post, ['image'])
             return redirect('profile')
     else:
         form = PostForm()
@@ -208,29 +225,15 @@ def profile(request):
 
 @login_required
 def user_profile(request, username):
-    user = get_object_or_404(
-        User.objects.annotate(
-            follower_count=Count('followers', distinct=True),
-            following_count=Count('following', distinct=True)
-        ),
-        username=username
-    )
-    
-    posts = user.posts.select_related('user').prefetch_related('comments', 'likes').all().order_by('-created_at')
+    user = get_user_or_404(username)
 
     is_following = False
-    if request.user.is_authenticated and request.user != user:
+    if request.user != user:
         is_following = Follow.objects.filter(from_user=request.user, to_user=user).exists()
-        
-        user_likes = Like.objects.filter(
-            post=OuterRef('pk'),
-            user=request.user
-        )
-        posts = posts.annotate(user_has_liked=Exists(user_likes))
 
     context = {
         'user': user,
-        'posts': posts,
+        'posts': feeds.profile_posts(user, request.user),
         'is_following': is_following,
         'follower_count': user.follower_count,
         'following_count': user.following_count,
@@ -240,8 +243,8 @@ def user_profile(request, username):
 
 @login_required
 def user_replies(request, username):
-    user = get_object_or_404(User, username=username)
-    comments = Comment.objects.filter(user=user).select_related('post', 'post__user').order_by('-created_at')
+    user_id = get_user_id_or_404(username)
+    comments = Comment.objects.filter(user_id=user_id).select_related('post', 'post__user').order_by('-created_at')
     
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return render(request, 'main/partials/user_replies_content.html', {'comments': comments})
@@ -253,20 +256,15 @@ def user_replies(request, username):
 
 @login_required
 def user_likes(request, username):
-    user = get_object_or_404(User, username=username)
+    user_id = get_user_id_or_404(username)
     
     # Corrected filter to use the related_name 'likes' from the Like model
-    liked_posts = Post.objects.filter(likes__user=user).select_related('user').order_by('-created_at')
+    liked_posts = Post.objects.filter(likes__user_id=user_id).select_related('user').order_by('-created_at')
 
     # This view is for AJAX requests to dynamically load liked posts
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         # Annotate posts with user_has_liked for the current request.user if authenticated
-        if request.user.is_authenticated:
-            user_likes_annotation = Like.objects.filter(
-                post=OuterRef('pk'),
-                user=request.user
-            )
-            liked_posts = liked_posts.annotate(user_has_liked=Exists(user_likes_annotation))
+        liked_posts = feeds.annotate_user_has_liked(liked_posts, request.user)
 
         return render(request, 'main/partials/user_likes_content.html', {'posts': liked_posts})
 
@@ -277,7 +275,7 @@ def user_likes(request, username):
 @login_required
 def follow_toggle(request, username):
     if request.method == 'POST':
-        to_user = get_object_or_404(User, username=username)
+        to_user = get_user_or_404(username)
         from_user = request.user
 
         if from_user == to_user:
@@ -287,43 +285,74 @@ def follow_toggle(request, username):
 
         if not created:
             follow.delete()
+            timeline.unfollow_author(from_user, to_user)
             is_following = False
+            delta = -1
         else:
+            timeline.follow_author(from_user, to_user)
             is_following = True
+            delta = 1
 
-        follower_count = to_user.followers.count()
-        following_count = from_user.following.count()
+        counters.adjust(User, to_user.pk, follower_count=delta)
+        counters.adjust(User, from_user.pk, following_count=delta)
+        graph.follow_index.follow_changed(from_user.pk, to_user.pk, is_following)
+        to_user.refresh_from_db(fields=['follower_count'])
+        from_user.refresh_from_db(fields=['following_count'])
 
         return JsonResponse({
             'status': 'ok',
             'is_following': is_following,
-            'follower_count': follower_count,
-            'following_count': following_count
+            'follower_count': to_user.follower_count,
+            'following_count': from_user.following_count
         })
     return JsonResponse({'status': 'error', 'message': 'Invalid request method.'}, status=405)
 
 @login_required
 def conversation(request, username):
-    other_user = get_object_or_404(User, username=username)
-    
-    messages = Message.objects.filter(
-        Q(sender=request.user, receiver=other_user) | Q(sender=other_user, receiver=request.user)
-    ).order_by('timestamp')
+    other_user = get_user_or_404(username)
+
+    # Only the latest page; older messages are fetched as the user scrolls up.
+    messages, next_cursor = history.conversation_page(request.user.id, other_user.id)
+    messages.reverse()
 
-    Message.objects.filter(sender=other_user, receiver=request.user, is_read=False).update(is_read=True)
+    read = inbox.mark_read(request.user.id, other_user.id)
+    unread.messages_read(request.user.id, read)
 
     context = {
         'other_user': other_user,
-        'messages': messages
+        'messages': messages,
+        'next_cursor': next_cursor,
     }
     return render(request, 'main/messages.html', context)
 
+@login_required
+def conversation_history(request, username):
+    """Return a page of older messages in a conversation, newest first (AJAX)."""
+    other_user_id = get_user_id_or_404(username)
+    try:
+        messages, next_cursor = history.conversation_page(
+            request.user.id, other_user_id, request.GET.get('cursor')
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    names = {request.user.id: request.user.username, other_user_id: username}
+    return JsonResponse({
+        'messages': [history.serialize(message, names) for message in messages],
+        'next_cursor': next_cursor,
+    })
+
 @login_required
 def edit_profile(request):
     if request.method == 'POST':
         form = ProfileEditForm(request.POST, request.FILES, instance=request.user)
         if form.is_valid():
-            form.save()
+            # Only the edited columns: the follow counters in request.user may
+            # already be stale (see main.counters).
+            form.save(commit=False).save(update_fields=ProfileEditForm._meta.fields)
+            changed_images = [name for name in ('profile_picture', 'cover_image') if name in form.changed_data]
+            if changed_images:
+                images.generate_derivatives(request.user, changed_images)
             return redirect('profile')
     else:
         form = ProfileEditForm(instance=request.user)
@@ -335,52 +364,16 @@ def add_comment(request, post_id):
     if request.method == 'POST':
         text = request.POST.get('text')
         if text:
-            comment = Comment.objects.create(user=request.user, post=post, text=text)
-            if post.user != request.user:
-                notification = Notification.objects.create(
-                    user=post.user,
-                    created_by=request.user,
-                    notification_type='comment',
-                    post=post,
-                    comment=comment
-                )
-                # Broadcast the notification
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    f"user_{post.user.id}",
-                    {
-                        "type": "unread_notification_count_update",
-                    }
-                )
+            save_comment(request.user, post, text)
     return redirect('index')
 
 @login_required
 def like_post(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    like, created = Like.objects.get_or_create(user=request.user, post=post)
-    
-    if not created:
-        like.delete()
-        liked = False
-    else:
-        liked = True
-        if post.user != request.user:
-            notification = Notification.objects.create(
-                user=post.user,
-                created_by=request.user,
-                notification_type='like',
-                post=post
-            )
-            # Broadcast the notification
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"user_{post.user.id}",
-                {
-                    "type": "unread_notification_count_update",
-                }
-            )
-            
-    return JsonResponse({'likes_count': post.likes.count(), 'liked': liked})
+    try:
+        liked, like_count = likes.toggle_like(request.user, post_id)
+    except Post.DoesNotExist:
+        raise Http404('No Post matches the given query.')
+    return JsonResponse({'likes_count': like_count, 'liked': liked})
 
 @login_required
 def edit_post(request, post_id):
@@ -391,7 +384,13 @@ def edit_post(request, post_id):
     if request.method == 'POST':
         form = PostForm(request.POST, request.FILES, instance=post)
         if form.is_valid():
-            form.save()
+            # Only the edited columns: like and comment counts may have moved
+            # since the post was read. The version is bumped in the UPDATE.
+            post = form.save(commit=False)
+            post.version = F('version') + 1
+            post.save(update_fields=[*PostForm._meta.fields, 'version'])
+            if 'image' in form.changed_data:
+                images.generate_derivatives(post, ['image'])
             return redirect('index')
     else:
         form = PostForm(instance=post)
@@ -403,6 +402,7 @@ def edit_post(request, post_id):
 def delete_post(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     if post.user == request.user:
+        # Timeline entries for the post go with it (on_delete=CASCADE).
         post.delete()
         return redirect('index')
     else:
@@ -5,12 +5,26 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 
-from main import routing
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'my_project.settings')
 
+# Set up Django (and the app registry) before importing anything that uses models.
+django_asgi_app = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+from main import routing  # noqa: E402
+from main.chat_writer import writer  # noqa: E402
+from main.graph import follow_index  # noqa: E402
+from main.username_filter import username_filter  # noqa: E402
+
+username_filter.warm_in_background()
+follow_index.warm_in_background()
+if settings.CHAT_WRITE_BEHIND:
+    # Lease the writer's node number now rather than on the first message.
+    writer.start()
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(
             URLRouter(
@@ -18,4 +32,4 @@ application = ProtocolTypeRouter({
             )
         )
     ),
-})
\ No newline at end of file
+})
@@ -53,11 +53,41 @@ INSTALLED_APPS = [
 
 ASGI_APPLICATION = 'my_project.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
+# Serve the feed, profiles, the inbox and like/comment from the async views in
+# main.async_views. ASYNC_VIEWS=0 falls back to the sync views in main.views
+# (compare the two with bench_http).
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '1') != '0'
+
+# 'memory' only reaches sockets in the same process. Use 'sqlite' to run several
+# daphne workers on one host without a broker, or 'redis' across hosts.
+CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'memory')
+
+if CHANNEL_LAYER_BACKEND == 'sqlite':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'main.layers.SQLiteChannelLayer',
+            'CONFIG': {
+                'path': os.environ.get('CHANNEL_LAYER_PATH', str(BASE_DIR / 'channels.sqlite3')),
+                'capacity': 100,
+                'expiry': 60,
+            },
+        },
+    }
+elif CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379')],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -65,6 +95,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main.replicas.ReplicaPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -91,12 +122,140 @@ WSGI_APPLICATION = 'my_project.wsgi.application'
 
 
 # Database
+# SQLITE_PROFILE=tuned (the default) runs SQLite in WAL mode, so reads never
+# wait for a writer, and starts every transaction with BEGIN IMMEDIATE, so
+# concurrent writers queue on the busy timeout instead of failing with
+# "database is locked" when a read transaction tries to upgrade. Connections
+# are reused across requests. SQLITE_PROFILE=stock is Django's default
+# behaviour; bench_sqlite compares the two.
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'tuned')
+SQLITE_TUNED_OPTIONS = {
+    # Seconds a connection waits for the write lock (busy_timeout).
+    'timeout': 20,
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        # Per-connection page cache in KiB (negative) and memory-mapped I/O in bytes.
+        'PRAGMA cache_size=-16000;'
+        'PRAGMA mmap_size=268435456;'
+        'PRAGMA temp_store=MEMORY;'
+    ),
+}
+SQLITE_TUNED_CONN_MAX_AGE = 600
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
+if SQLITE_PROFILE == 'tuned':
+    DATABASES['default'].update({
+        'OPTIONS': SQLITE_TUNED_OPTIONS,
+        'CONN_MAX_AGE': SQLITE_TUNED_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    })
+
+# Read replicas (main.replicas). SQLITE_REPLICAS=N adds aliases replica1..N
+# backed by db.replicaN.sqlite3 files; the sync_replicas command copies the
+# primary into them, standing in for real replication. Reads in requests and
+# socket consumers go to a random replica, except for REPLICA_STICKY_SECONDS
+# after the user's own writes.
+DATABASE_REPLICAS = []
+for _index in range(1, int(os.environ.get('SQLITE_REPLICAS', '0')) + 1):
+    DATABASES[f'replica{_index}'] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / f'db.replica{_index}.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{_index}')
+DATABASE_ROUTERS = ['main.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = 10
+
+
+# Cache
+# Unread badge counters live here. The default local-memory cache is per
+# process; multi-worker deployments should point CACHE_BACKEND at redis so
+# every worker sees the same counts.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379'),
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Upper bound on how long a cached unread count can drift before it is
+# recomputed from the database.
+UNREAD_COUNT_CACHE_TIMEOUT = 300
+
+# Signed-out visitors' feed and search pages are cached whole (main.page_cache)
+# and replaced as soon as the posts or users they show change; this only
+# bounds how long superseded pages stay in the cache.
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Badge updates reaching a notification socket within this many seconds are
+# sent to the browser as a single frame.
+NOTIFICATION_COALESCE_WINDOW = 0.25
+
+# Likes on the same post within this many seconds are shown as one
+# notification naming the latest NOTIFICATION_RECENT_ACTORS users.
+NOTIFICATION_AGGREGATION_WINDOW = 24 * 60 * 60
+NOTIFICATION_RECENT_ACTORS = 2
+
+# Notifications per page of the notifications list.
+NOTIFICATIONS_PAGE_SIZE = 30
+
+
+# --- Chat ---
+
+# Entries in the per-process username -> user id cache used by profile and
+# conversation URLs and by ChatConsumer.
+USERNAME_CACHE_SIZE = 10000
+
+# Write-behind mode: chat messages are broadcast immediately and saved by a
+# background thread in batches of up to BATCH_SIZE or every INTERVAL seconds.
+CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', '') == '1'
+CHAT_WRITE_BEHIND_BATCH_SIZE = 200
+CHAT_WRITE_BEHIND_INTERVAL = 0.05
+# Attempts at saving a batch (with exponential backoff) before its messages
+# are appended to CHAT_DEAD_LETTER_PATH for replay_chat_dead_letters.
+CHAT_WRITE_BEHIND_RETRIES = 5
+CHAT_DEAD_LETTER_PATH = os.environ.get('CHAT_DEAD_LETTER_PATH', str(BASE_DIR / 'chat_dead_letters.jsonl'))
+# Write-behind message ids embed a node number (0-1023) that must differ
+# between processes saving messages at the same time. Set CHAT_WRITER_NODE
+# per worker, or leave it unset to lease a free number from the database for
+# CHAT_WRITER_NODE_LEASE seconds at a time.
+CHAT_WRITER_NODE = int(os.environ['CHAT_WRITER_NODE']) if os.environ.get('CHAT_WRITER_NODE') else None
+CHAT_WRITER_NODE_LEASE = 600
+
+# Messages shown when a conversation is opened and returned by each "load
+# older" request (HTTP or the chat socket).
+MESSAGES_PAGE_SIZE = 30
+
+
+# --- Retention ---
+
+# Used by the apply_retention command (main.retention). Notifications the
+# user has already seen are deleted after NOTIFICATION_RETENTION_DAYS; read
+# messages are moved into compressed archive chunks of up to
+# MESSAGE_ARCHIVE_CHUNK_SIZE messages after MESSAGE_ARCHIVE_AFTER_DAYS.
+NOTIFICATION_RETENTION_DAYS = 90
+MESSAGE_ARCHIVE_AFTER_DAYS = 180
+MESSAGE_ARCHIVE_CHUNK_SIZE = 500
+# Rows deleted or archived per transaction, and seconds to pause between
+# transactions so other writers are never kept waiting on SQLite's lock.
+RETENTION_BATCH_SIZE = 500
+RETENTION_BATCH_PAUSE = 0.05
 
 
 # Password validation
@@ -143,4 +302,78 @@ SITE_ID = 1
 AUTH_USER_MODEL = 'main.User'
 LOGIN_URL = 'login'
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Uploaded media is stored once per distinct content (main.storage).
+STORAGES = {
+    'default': {
+        'BACKEND': 'main.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Seconds an unreferenced media blob is kept before gc_blobs may delete it,
+# so uploads whose rows are still being saved are never collected.
+BLOB_GC_GRACE_PERIOD = 24 * 60 * 60
+
+# --- Feed ---
+
+# Number of posts rendered on the first page of the home feed and returned by
+# each subsequent infinite-scroll request.
+FEED_PAGE_SIZE = 10
+
+# Comments prefetched per post card; the rest are loaded on demand, this many
+# at a time.
+COMMENT_PREVIEW_SIZE = 3
+COMMENTS_PAGE_SIZE = 20
+
+# Accounts with more followers than this stop copying new posts into every
+# follower's timeline; their posts are merged in when a feed is read instead.
+TIMELINE_FANOUT_LIMIT = 5000
+
+# How many recent posts of a newly followed account are copied into the
+# follower's timeline.
+TIMELINE_BACKFILL_SIZE = 50
+
+# --- Search ---
+
+# Users listed on the search results page and suggested by the search box's
+# autocomplete, best matches first.
+SEARCH_RESULTS_LIMIT = 50
+SEARCH_AUTOCOMPLETE_LIMIT = 8
+
+# --- Suggestions ---
+
+# Suggested accounts shown beside the home feed and returned by the
+# suggestions endpoint.
+SUGGESTIONS_LIMIT = 5
+SUGGESTIONS_PAGE_SIZE = 20
+
+# Followees whose follows are counted for one suggestion query; users who
+# follow more accounts are scored from a random sample of this size.
+SUGGESTIONS_SCAN_LIMIT = 1000
+
+# How often (seconds) each process rebuilds its in-memory follow graph
+# (main.graph) to pick up follows made in other processes.
+GRAPH_REFRESH_INTERVAL = 10 * 60
+
+# --- Signup ---
+
+# Target false positive rate of the in-memory taken-username filter used by
+# check_username, and how often (seconds) it picks up accounts created by
+# other processes.
+USERNAME_FILTER_FALSE_POSITIVE_RATE = 0.01
+USERNAME_FILTER_REFRESH_INTERVAL = 5
+
+# --- Images ---
+
+# Longest edge in pixels of each derivative rendered from uploaded images
+# (main.images); "thumb" is cropped square.
+IMAGE_DERIVATIVE_SIZES = {'thumb': 160, 'feed': 640, 'full': 1440}
+IMAGE_DERIVATIVE_FORMAT = 'WEBP'
+IMAGE_DERIVATIVE_QUALITY = 80
+# Rendering processes; None uses one per CPU, 0 renders inline in the
+# request's process (useful for tests).
+IMAGE_DERIVATIVE_WORKERS = None